@@ -0,0 +1,245 @@
+import json
+import os
+import re
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count
+
+from metrics import record_cache
+from serving_manifest import load_serving_manifest
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+class AdapterError(Exception):
+    """Raised for unknown adapters or adapters that fail to load."""
+
+class AdapterRegistry:
+    """
+    Serve several LoRA adapters on top of one resident base model.
+
+    Adapters are registered by name (name -> adapter directory) and loaded on
+    first use. At most max_loaded adapters stay in memory; the least recently
+    used one is unloaded when another has to come in. The base weights are
+    never reloaded, only the small adapter matrices are.
+
+    Each load gets its own peft adapter name (<name>__<n>), so a replacement or
+    the next adapter is loaded before anything is unloaded: a load that fails
+    leaves the adapters that were already in memory untouched.
+
+    With base_model_path set, an adapter is only accepted if it was trained on
+    those weights: its base_model_name_or_path is base_model_path, or a merged
+    export with the same serving manifest.
+    """
+
+    def __init__(self, base_model, max_loaded=4, base_model_path=None):
+        if max_loaded < 1:
+            raise ValueError(f"max_loaded must be at least 1, got {max_loaded}")
+        self.base_model = base_model
+        self.base_model_path = base_model_path
+        self.serving_manifest = load_serving_manifest(base_model_path) if base_model_path else None
+        self.peft_model = None
+        self.max_loaded = max_loaded
+        self.registered = {}
+        # name -> peft adapter name, least recently used first
+        self.loaded = OrderedDict()
+        self.load_ids = count(1)
+        self.hits = 0
+        self.misses = 0
+        # peft keeps a single "active adapter" on the model: generations with the
+        # active adapter run side by side, and switching, loading or unloading
+        # waits until none is running (see _exclusive)
+        self.lock = threading.RLock()
+        self.idle = threading.Condition(self.lock)
+        self.active = None
+        self.generating = 0
+        self.switches_waiting = 0
+
+    @property
+    def model(self):
+        """The model to generate with (the PeftModel once any adapter has been loaded)."""
+        return self.peft_model if self.peft_model is not None else self.base_model
+
+    def register(self, name, path, load=True):
+        """Register (or replace) an adapter. A replaced adapter is swapped in place."""
+        if not ADAPTER_NAME_PATTERN.match(name):
+            raise AdapterError(f"Invalid adapter name '{name}' (use letters, digits, '-' and '_')")
+        if not os.path.exists(os.path.join(path, "adapter_config.json")):
+            raise AdapterError(f"No adapter_config.json in {path}")
+        self._check_base(name, path)
+
+        with self._exclusive():
+            replacing = name in self.loaded
+            previous_path = self.registered.get(name)
+            self.registered[name] = path
+            if load or replacing:
+                try:
+                    self._load(name)
+                except AdapterError:
+                    # keep serving what was registered before
+                    if previous_path is None:
+                        del self.registered[name]
+                    else:
+                        self.registered[name] = previous_path
+                    raise
+
+        logger.info(f"Adapter {'swapped' if replacing else 'registered'}: {name} -> {path}")
+
+    def unregister(self, name):
+        """Forget an adapter and free its weights."""
+        with self._exclusive():
+            if name not in self.registered:
+                raise AdapterError(f"Unknown adapter '{name}'")
+            if name in self.loaded:
+                self._unload(name)
+            del self.registered[name]
+
+        logger.info(f"Adapter removed: {name}")
+
+    def _check_base(self, name, path):
+        if self.base_model_path is None:
+            return
+        with open(os.path.join(path, "adapter_config.json"), "r", encoding="utf-8") as f:
+            trained_on = json.load(f).get("base_model_name_or_path") or ""
+        if _same_path(trained_on, self.base_model_path):
+            return
+        if self.serving_manifest and os.path.isdir(trained_on):
+            try:
+                trained_manifest = load_serving_manifest(trained_on)
+            except ValueError:
+                trained_manifest = None
+            # the same merged export, e.g. another promoted copy of it
+            if trained_manifest and all(
+                trained_manifest[field] == self.serving_manifest[field] for field in ("base_model", "adapter_sha256")
+            ):
+                return
+        raise AdapterError(
+            f"Adapter '{name}' was trained on {trained_on or 'an unknown base model'}, "
+            f"but the server runs {self.base_model_path}"
+        )
+
+    def _load(self, name):
+        from peft import PeftModel
+
+        path = self.registered[name]
+        self._check_base(name, path)
+        adapter_name = f"{name}__{next(self.load_ids)}"
+        try:
+            if self.peft_model is None:
+                # injects the LoRA layers into the base model in place
+                self.peft_model = PeftModel.from_pretrained(self.base_model, path, adapter_name=adapter_name)
+            else:
+                self.peft_model.load_adapter(path, adapter_name=adapter_name)
+        except Exception as e:
+            raise AdapterError(f"Failed to load adapter '{name}' from {path}: {e}")
+
+        self.peft_model.eval()
+        replaced = self.loaded.pop(name, None)
+        self.loaded[name] = adapter_name
+        if replaced is not None:
+            self._delete(replaced)
+
+        # only now make room, so memory peaks at max_loaded + 1 adapters during a load
+        while len(self.loaded) > self.max_loaded:
+            evicted = next(iter(self.loaded))
+            self._unload(evicted)
+            logger.info(f"Evicted least recently used adapter: {evicted}")
+
+    def _unload(self, name):
+        self._delete(self.loaded.pop(name))
+
+    def _delete(self, adapter_name):
+        # peft refuses to delete the active adapter, so point it elsewhere first
+        remaining = list(self.loaded.values())
+        if remaining and self.peft_model.active_adapter == adapter_name:
+            self.peft_model.set_adapter(remaining[0])
+        self.peft_model.delete_adapter(adapter_name)
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the lock with no generation running, for changes to the model."""
+        with self.lock:
+            self.switches_waiting += 1
+            try:
+                self.idle.wait_for(lambda: self.generating == 0)
+            finally:
+                self.switches_waiting -= 1
+            yield
+
+    def _activate(self, name):
+        if name is None:
+            if self.peft_model is not None:
+                self.peft_model.base_model.disable_adapter_layers()
+        else:
+            if name not in self.loaded:
+                self._load(name)
+            self.peft_model.base_model.enable_adapter_layers()
+            self.peft_model.set_adapter(self.loaded[name])
+        self.active = name
+
+    @contextmanager
+    def use(self, name=None):
+        """
+        Yield a model with the named adapter active (or the plain base model for None).
+
+        Requests for the adapter that is already active generate concurrently;
+        a request for another one waits for them to finish, then switches. Once
+        a switch is waiting, new requests queue behind it.
+        """
+        with self.lock:
+            if name is not None:
+                if name not in self.registered:
+                    raise AdapterError(f"Unknown adapter '{name}'")
+                hit = name in self.loaded
+                record_cache("adapter", hit)
+                if hit:
+                    self.hits += 1
+                    self.loaded.move_to_end(name)
+                else:
+                    self.misses += 1
+            if not (self.generating and self.active == name and not self.switches_waiting):
+                with self._exclusive():
+                    self._activate(name)
+            self.generating += 1
+        try:
+            yield self.model
+        finally:
+            with self.lock:
+                self.generating -= 1
+                if self.generating == 0:
+                    self.idle.notify_all()
+
+    def describe(self):
+        """Registered adapters, which of them are in memory, and LRU hit counts."""
+        with self.lock:
+            return {
+                "max_loaded": self.max_loaded,
+                "adapters": [
+                    {"name": name, "path": path, "loaded": name in self.loaded}
+                    for name, path in sorted(self.registered.items())
+                ],
+                "lru_order": list(self.loaded),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+def _same_path(a, b):
+    if os.path.exists(a) and os.path.exists(b):
+        return os.path.samefile(a, b)
+    return a.rstrip("/\\") == b.rstrip("/\\")
+
+def parse_adapter_spec(spec):
+    """Parse an ADAPTERS env value like "icsid=./runs/a/adapter,pca=./runs/b/adapter"."""
+    adapters = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, path = item.partition("=")
+        if not path:
+            raise AdapterError(f"Invalid adapter spec '{item}', expected name=path")
+        adapters[name.strip()] = path.strip()
+    return adapters
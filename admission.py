@@ -0,0 +1,166 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import registry
+
+QUEUE_DEPTH = registry.gauge(
+    "legaltech_admission_queue_depth", "Requests waiting for a slot", ["pool", "workload"]
+)
+RUNNING = registry.gauge(
+    "legaltech_admission_running", "Requests holding a slot", ["pool", "workload"]
+)
+REJECTED = registry.counter(
+    "legaltech_admission_rejected_total", "Requests shed by admission control", ["pool", "workload", "reason"]
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "legaltech_admission_wait_seconds", "Time spent queued before admission", ["pool", "workload"]
+)
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; retry_after is a hint in whole seconds."""
+
+    def __init__(self, workload, reason, retry_after):
+        super().__init__(f"{workload} queue {reason}, retry after {retry_after}s")
+        self.workload = workload
+        self.reason = reason
+        self.retry_after = retry_after
+
+class WorkloadClass:
+    """Limits for one kind of work. Lower priority values are served first."""
+
+    def __init__(self, name, priority, max_concurrency, max_queue, deadline_s, initial_service_s=1.0):
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline_s = deadline_s
+        # moving average of how long a request holds its slot, used to predict queue wait
+        self.service_s = initial_service_s
+        self.running = 0
+        self.waiting = deque()
+
+class AdmissionController:
+    """
+    Bounded, prioritised queues in front of one pool of slots (the local model,
+    or the outbound OpenAI calls).
+
+    Each workload class has its own concurrency limit and queue bound, and all
+    classes share total_slots. When a slot frees up, the highest-priority class
+    with a waiter under its own limit goes next (FIFO within a class). A request
+    is rejected straight away if its queue is full or the predicted wait is past
+    its deadline, and rejected later if it is still queued at the deadline.
+    """
+
+    def __init__(self, classes, total_slots, pool="model"):
+        self.pool = pool
+        self.classes = {workload.name: workload for workload in classes}
+        self.total_slots = total_slots
+        self.total_running = 0
+        self.condition = threading.Condition()
+
+    def _estimated_wait(self, workload):
+        if workload.running < workload.max_concurrency and self.total_running < self.total_slots and not workload.waiting:
+            return 0.0
+        slots = max(1, min(workload.max_concurrency, self.total_slots))
+        return (len(workload.waiting) + 1) / slots * workload.service_s
+
+    def _can_run(self, workload, ticket):
+        if workload.waiting[0] is not ticket:
+            return False
+        if workload.running >= workload.max_concurrency or self.total_running >= self.total_slots:
+            return False
+        # leave the slot to a more urgent class that could use it
+        for other in self.classes.values():
+            if other.priority < workload.priority and other.waiting and other.running < other.max_concurrency:
+                return False
+        return True
+
+    def _reject(self, workload, reason, wait):
+        REJECTED.inc(pool=self.pool, workload=workload.name, reason=reason)
+        raise AdmissionRejected(workload.name, reason, max(1, math.ceil(wait)))
+
+    def acquire(self, name):
+        """Block until a slot is granted; returns the admission time. Raises AdmissionRejected."""
+        workload = self.classes[name]
+        enqueued = time.perf_counter()
+
+        with self.condition:
+            if len(workload.waiting) >= workload.max_queue:
+                self._reject(workload, "full", workload.service_s)
+
+            estimated = self._estimated_wait(workload)
+            if estimated > workload.deadline_s:
+                self._reject(workload, "deadline", estimated)
+
+            ticket = object()
+            workload.waiting.append(ticket)
+            QUEUE_DEPTH.set(len(workload.waiting), pool=self.pool, workload=name)
+
+            deadline = enqueued + workload.deadline_s
+            try:
+                while not self._can_run(workload, ticket):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._reject(workload, "timeout", self._estimated_wait(workload))
+                    self.condition.wait(remaining)
+            finally:
+                if ticket in workload.waiting:
+                    workload.waiting.remove(ticket)
+                QUEUE_DEPTH.set(len(workload.waiting), pool=self.pool, workload=name)
+                # a departure may unblock the next waiter in this or a lower class
+                self.condition.notify_all()
+
+            workload.running += 1
+            self.total_running += 1
+            RUNNING.set(workload.running, pool=self.pool, workload=name)
+
+        admitted = time.perf_counter()
+        QUEUE_WAIT_SECONDS.observe(admitted - enqueued, pool=self.pool, workload=name)
+        return admitted
+
+    def release(self, name, admitted):
+        workload = self.classes[name]
+        held = time.perf_counter() - admitted
+        with self.condition:
+            workload.running -= 1
+            self.total_running -= 1
+            workload.service_s = 0.8 * workload.service_s + 0.2 * held
+            RUNNING.set(workload.running, pool=self.pool, workload=name)
+            self.condition.notify_all()
+
+    @contextmanager
+    def admit(self, name):
+        admitted = self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name, admitted)
+
+    def busy(self, name):
+        """Requests of a class currently running or queued (used to back off background work)."""
+        workload = self.classes[name]
+        with self.condition:
+            return workload.running + len(workload.waiting)
+
+    def describe(self):
+        with self.condition:
+            return {
+                "pool": self.pool,
+                "total_slots": self.total_slots,
+                "total_running": self.total_running,
+                "workloads": {
+                    workload.name: {
+                        "priority": workload.priority,
+                        "running": workload.running,
+                        "queued": len(workload.waiting),
+                        "max_concurrency": workload.max_concurrency,
+                        "max_queue": workload.max_queue,
+                        "deadline_s": workload.deadline_s,
+                        "avg_service_s": round(workload.service_s, 3)
+                    }
+                    for workload in sorted(self.classes.values(), key=lambda w: w.priority)
+                }
+            }
@@ -1,4 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, send_file
+from functools import wraps
+import json
+import time
+import threading
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import requests
@@ -6,31 +10,141 @@ from dotenv import load_dotenv
 import os
 from flask_cors import CORS
 from handle_rag import ArbitrationRAGChroma
+from serving_manifest import load_serving_manifest
+from adapter_registry import AdapterRegistry, AdapterError, parse_adapter_spec
+from structured_output import get_structured_generator
+from request_profiler import StackSampler, ProfileStore, ProfiledThreadPoolExecutor, should_profile
+from admission import AdmissionController, AdmissionRejected, WorkloadClass
+from ingestion_jobs import IngestionJobManager
+from reranker import CrossEncoderReranker
+from index_snapshot import import_snapshot
+from speculative_decoding import SpeculativeDecoder
+from search_terms import SearchTermExtractor
+from context_builder import ContextBuilder, hf_counter
+from conversation_sessions import SessionStore, retrieve_for_session
+from closing_statements import ClosingStatementWriter, SummaryCache
+from metrics import (
+    timed, record_tokens, render_metrics, PROMETHEUS_CONTENT_TYPE,
+    REQUEST_SECONDS, REQUESTS_IN_FLIGHT
+)
 import logging
 
+# ----------------------------
+# config
+# ----------------------------
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com/search")
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "numpy" (memory-mapped, see vector_store.py)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16")  # numpy backend storage: float16 or int8
+SHARD_BY = os.getenv("SHARD_BY")  # partition cases into worker-process shards: "institution" or "hash" (unset = one collection)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "4"))  # number of shards for SHARD_BY=hash
+INDEX_SNAPSHOT = os.getenv("INDEX_SNAPSHOT")  # snapshot loaded at startup when the collection is empty (see index_snapshot.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # "torch" or "onnx" (int8 export, see onnx_embedder.py)
+ONNX_EMBEDDER_DIR = os.getenv("ONNX_EMBEDDER_DIR", "./onnx_embedder")
+INDEX_DECISIONS = os.getenv("INDEX_DECISIONS", "0") == "1"  # index full decision texts for /openai/closing-statement (off by default: it multiplies ingestion work)
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+# OpenAI models clients may ask for; the name becomes a metric label and a cache key, so others are rejected
+DEFAULT_OPENAI_MODEL = "ft:gpt-4o-mini-2024-07-18:personal::CFU019NU"
+OPENAI_MODELS = {
+    name.strip() for name in os.getenv("OPENAI_MODELS", f"{DEFAULT_OPENAI_MODEL},gpt-4o-mini,gpt-4o,gpt-3.5-turbo").split(",")
+    if name.strip()
+}
+
+# optional cross-encoder rerank of retrieval results (disabled unless RERANK_MODEL is set)
+RERANK_MODEL = os.getenv("RERANK_MODEL")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_MAX_BUSY = int(os.getenv("RERANK_MAX_BUSY", "2"))  # skip reranking once this many interactive requests (both pools) are running or queued
+
+# admin endpoints require this value in the X-Admin-Token header (disabled if unset)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# request profiling: admins send "X-Profile: 1", or set a sampling rate for random requests
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+profile_store = ProfileStore(os.getenv("PROFILE_DIR", "./profiles"))
+
+# admission control: (priority, max concurrency, max queued, queue deadline seconds, initial service time guess)
+# interactive chat goes first, closing statements next, bulk/admin loads only when there is room
+WORKLOAD_LIMITS = {
+    "interactive": (0, 2, 16, 15.0, 2.0),
+    "closing_statement": (1, 1, 4, 60.0, 10.0),
+    "bulk": (2, 1, 2, 5.0, 30.0),
+}
+admission = AdmissionController(
+    [WorkloadClass(name, *limits) for name, limits in WORKLOAD_LIMITS.items()],
+    total_slots=int(os.getenv("ADMISSION_TOTAL_SLOTS", "2"))
+)
+# /openai/* endpoints wait on the network, not the local model, so they get their own,
+# wider pool: chat traffic neither caps at the model's slots nor blocks local generation
+OPENAI_WORKLOAD_LIMITS = {
+    "interactive": (0, 16, 64, 15.0, 2.0),
+    "closing_statement": (1, 4, 8, 60.0, 20.0),
+    "bulk": (2, 2, 2, 5.0, 60.0),
+}
+openai_admission = AdmissionController(
+    [WorkloadClass(name, *limits) for name, limits in OPENAI_WORKLOAD_LIMITS.items()],
+    total_slots=int(os.getenv("OPENAI_TOTAL_SLOTS", "16")),
+    pool="openai"
+)
+
 # ----------------------------
 # load fine tuned model
 # ----------------------------
-MODEL_PATH = "C:/Users/Gabriel Kuek/Desktop/Side Stuff/legaltechthing/model/"
+MODEL_PATH = os.getenv("MODEL_PATH", "C:/Users/Gabriel Kuek/Desktop/Side Stuff/legaltechthing/model/")
+LOCAL_MODEL_NAME = "local"  # model label used in token metrics
+
+# merged exports (see export_model.py) carry a manifest; refuse to serve one that doesn't match its files
+serving_manifest = load_serving_manifest(MODEL_PATH)
+if serving_manifest:
+    logger.info(
+        f"Serving merged model: base={serving_manifest['base_model']} "
+        f"adapter={serving_manifest['adapter_sha256'][:12]} dtype={serving_manifest['dtype']}"
+    )
+else:
+    logger.warning(f"No serving manifest in {MODEL_PATH}, loading as-is (run export_model.py for a merged artifact)")
+
 tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
 model = AutoModelForCausalLM.from_pretrained(
     MODEL_PATH,
     device_map="auto",
-    dtype="auto",
+    dtype=serving_manifest["dtype"] if serving_manifest else "auto",
     offload_folder="offload",
     low_cpu_mem_usage=True
 )
 model.eval()
 
-# ----------------------------
-# config
-# ----------------------------
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# LoRA adapters served on top of the resident model, selected per request by name;
+# only adapters trained on the weights at MODEL_PATH are accepted
+adapter_registry = AdapterRegistry(model, max_loaded=int(os.getenv("MAX_LOADED_ADAPTERS", "4")), base_model_path=MODEL_PATH)
+for adapter_name, adapter_path in parse_adapter_spec(os.getenv("ADAPTERS")).items():
+    try:
+        adapter_registry.register(adapter_name, adapter_path, load=False)
+    except AdapterError as e:
+        logger.error(f"Skipping adapter {adapter_name}: {str(e)}")
 
-TAVILY_API_URL = "https://api.tavily.com/search"
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# optional speculative decoding: a small draft model sharing the tokenizer proposes tokens for the served model to verify
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH")
+speculative_decoder = None
+if DRAFT_MODEL_PATH:
+    draft_tokenizer = AutoTokenizer.from_pretrained(DRAFT_MODEL_PATH)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        logger.error(f"Draft model {DRAFT_MODEL_PATH} uses a different tokenizer, speculative decoding disabled")
+    else:
+        draft_model = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL_PATH, dtype="auto", low_cpu_mem_usage=True).to(model.device)
+        draft_model.eval()
+        speculative_decoder = SpeculativeDecoder(
+            draft_model,
+            vocab_size=len(tokenizer),
+            draft_tokens=int(os.getenv("SPECULATIVE_DRAFT_TOKENS", "4"))
+        )
+        baseline = speculative_decoder.calibrate(model, tokenizer("User: hello\nAssistant:", return_tensors="pt")["input_ids"].to(model.device))
+        logger.info(f"Speculative decoding with {DRAFT_MODEL_PATH} (greedy baseline {baseline * 1000:.1f} ms/token)")
 
 def parse_model_output(raw_text):
     """
@@ -67,28 +181,50 @@ def parse_model_output(raw_text):
     return parsed
 
 # handles webscraping and rag
-def tavily_search(query_text):
-    """call Tavily API to scrape relevant content."""
-    payload = {"query": query_text}
-    headers = {"Authorization": f"Bearer {TAVILY_API_KEY}"}
-    try:
-        response = requests.post(TAVILY_API_URL, json=payload, headers=headers, timeout=10)
-        if response.status_code == 200:
-            return response.json().get("content", "")
+def model_generate_with_stats(prompt, max_tokens=200, adapter=None, skip_special_tokens=False, speculative=True, input_ids=None):
+    """
+    generate text from model (or one of its LoRA adapters) with optional context.
+    pass input_ids instead of prompt when the prompt is already tokenized.
+    returns (text, decoding stats); stats is None unless speculative decoding was used.
+    """
+    if input_ids is not None:
+        input_tensor = torch.tensor([input_ids], device=model.device)
+        inputs = {"input_ids": input_tensor, "attention_mask": torch.ones_like(input_tensor)}
+    else:
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    stats = None
+    with adapter_registry.use(adapter) as active_model:
+        if speculative and speculative_decoder is not None:
+            outputs, stats = speculative_decoder.generate(
+                active_model, inputs["input_ids"], max_tokens, eos_token_id=tokenizer.eos_token_id
+            )
         else:
-            return f"[Tavily error: {response.status_code}]"
-    except Exception as e:
-        return f"[Tavily exception: {str(e)}]"
-
-def model_generate(prompt, max_tokens=200):
-    """generate text from model with optional context."""
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    outputs = model.generate(**inputs, max_new_tokens=max_tokens)
-    raw_answer = tokenizer.decode(outputs[0], skip_special_tokens=False)
+            outputs = active_model.generate(**inputs, max_new_tokens=max_tokens)
+    prompt_tokens = inputs["input_ids"].shape[1]
+    record_tokens(LOCAL_MODEL_NAME, prompt_tokens, outputs.shape[1] - prompt_tokens)
+    raw_answer = tokenizer.decode(outputs[0], skip_special_tokens=skip_special_tokens)
     # clean up <|endoftext|> and <|endof|>
     clean_answer = raw_answer.replace("<|endoftext|>", "").replace("<|endof|>", "").strip()
-    return clean_answer
+    return clean_answer, stats
+
+def model_generate(prompt, max_tokens=200, adapter=None, skip_special_tokens=False, speculative=True):
+    """generate text from model (or one of its LoRA adapters) with optional context."""
+    return model_generate_with_stats(prompt, max_tokens, adapter, skip_special_tokens, speculative)[0]
     
+def model_generate_structured(prompt, adapter=None):
+    """generate the case fields as a JSON object, decoding only the field values."""
+    generator = get_structured_generator(tokenizer)
+    with adapter_registry.use(adapter) as active_model:
+        fields, stats = generator.generate(active_model, prompt)
+    record_tokens(LOCAL_MODEL_NAME, stats["forced_tokens"], stats["generated_tokens"])
+    return fields, stats
+
+def unknown_model_response(model_name):
+    return jsonify({
+        "error": "Unknown model",
+        "message": f"Model {str(model_name)[:100]!r} is not enabled; choose one of {sorted(OPENAI_MODELS)} (OPENAI_MODELS)"
+    }), 400
+
 def extract_summary(raw_text, max_chars=500):
     """truncate long outputs for a concise snippet."""
     sentences = raw_text.split(". ")
@@ -110,16 +246,134 @@ def tavily_test(query_text):
     except Exception as e:
         return {"error": str(e)}
 
+# several search queries per question run side by side
+tavily_executor = ProfiledThreadPoolExecutor(max_workers=8, thread_name_prefix="tavily")
+
+def tavily_search_many(queries, max_results=6):
+    """run Tavily searches concurrently and merge them into one context string (results deduped by url, best first)."""
+    contents = []
+    results = {}
+    for query_text, response in zip(queries, tavily_executor.map(tavily_test, queries)):
+        if "error" in response:
+            logger.warning(f"Tavily search failed for '{query_text}': {response['error']}")
+            continue
+        for key in ("answer", "content"):
+            if response.get(key):
+                contents.append(response[key])
+        for result in response.get("results", []):
+            url = result.get("url") or result.get("title")
+            if url not in results or result.get("score", 0) > results[url].get("score", 0):
+                results[url] = result
+
+    best = sorted(results.values(), key=lambda result: result.get("score", 0), reverse=True)[:max_results]
+    lines = list(dict.fromkeys(contents)) + [f"{result.get('title', '')}: {result.get('content', '')}" for result in best]
+    return "\n".join(lines)
+
 # ----------------------------
 # Initialize ChromaDB RAG System
 # ----------------------------
 rag_system = None
+ingestion_jobs = None
+closing_writer = None
+
+# web search terms come from regexes and a gazetteer of known cases, not from the model
+search_extractor = SearchTermExtractor()
+
+# chat sessions: prior turns and retrieved cases kept server-side between /openai/query calls
+sessions = SessionStore(ttl_s=float(os.getenv("SESSION_TTL_S", "1800")), max_sessions=int(os.getenv("MAX_SESSIONS", "1000")))
+
+# ----------------------------
+# Local RAG: case index context for the local model
+# ----------------------------
+LOCAL_RAG_SYSTEM = "You are an arbitration case assistant. Answer using only the case records below and cite the Case ID of every case you use."
+LOCAL_RAG_PREFIX_IDS = tokenizer(f"System: {LOCAL_RAG_SYSTEM}\nUser: Case records:\n")["input_ids"]
+local_context_builder = ContextBuilder(hf_counter(tokenizer), budget_tokens=int(os.getenv("LOCAL_CONTEXT_TOKEN_BUDGET", "800")))
+# Tavily output gets its own budget on top of the case context
+LOCAL_WEB_TOKEN_BUDGET = int(os.getenv("LOCAL_WEB_TOKEN_BUDGET", "400"))
+retrieval_executor = ProfiledThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+def trim_web_context(web_context, budget_tokens=LOCAL_WEB_TOKEN_BUDGET):
+    """
+    Keep whole lines of web results (best first, see tavily_search_many) while
+    they fit the local model's token budget; a first line that alone is over
+    budget is cut.
+    """
+    kept = []
+    used = 0
+    for line in web_context.splitlines():
+        line_ids = tokenizer(line + "\n", add_special_tokens=False)["input_ids"]
+        if used + len(line_ids) > budget_tokens:
+            if not kept:
+                kept.append(tokenizer.decode(line_ids[:budget_tokens], skip_special_tokens=True).rstrip() + " ...")
+            break
+        kept.append(line)
+        used += len(line_ids)
+    return "\n".join(kept)
+
+def local_rag_inputs(question, n_results=3, web_context=None):
+    """
+    build the local model's input ids from retrieved cases, in the User:/Assistant: training layout.
+    the case search runs in the background while the question part of the prompt is tokenized.
+    """
+    search = retrieval_executor.submit(rag_system.search_cases, question, n_results)
+
+    web_part = f"Web results:\n{trim_web_context(web_context)}\n\n" if web_context else ""
+    suffix_ids = tokenizer(f"\n\n{web_part}Question: {question}\nAssistant:", add_special_tokens=False)["input_ids"]
+
+    cases = search.result()
+    with timed("context_build"):
+        built = local_context_builder.build(rag_system.with_decision_summaries(cases))
+    context_ids = tokenizer(built["text"], add_special_tokens=False)["input_ids"]
+    return LOCAL_RAG_PREFIX_IDS + context_ids + suffix_ids, built
 
 def initialize_rag():
     """Initialize the RAG system once at startup"""
-    global rag_system
+    global rag_system, ingestion_jobs, closing_writer
     try:
-        rag_system = ArbitrationRAGChroma()
+        rag_system = ArbitrationRAGChroma(
+            persist_directory=CHROMA_PERSIST_DIR,
+            backend=VECTOR_BACKEND,
+            vector_dtype=VECTOR_DTYPE,
+            shard_by=SHARD_BY,
+            shard_count=SHARD_COUNT,
+            context_token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+            index_decisions=INDEX_DECISIONS,
+            embedding_backend=EMBEDDING_BACKEND,
+            onnx_model_dir=ONNX_EMBEDDER_DIR
+        )
+        if INDEX_SNAPSHOT and rag_system.collection.count() == 0:
+            logger.info(f"Empty collection, importing snapshot {INDEX_SNAPSHOT}")
+            import_snapshot(rag_system, INDEX_SNAPSHOT)
+        search_extractor.collection = rag_system.collection
+        search_extractor.request_refresh()
+        if RERANK_MODEL:
+            rag_system.enable_reranker(
+                CrossEncoderReranker(
+                    RERANK_MODEL,
+                    budget_ms=RERANK_BUDGET_MS,
+                    overloaded=lambda: admission.busy("interactive") + openai_admission.busy("interactive") > RERANK_MAX_BUSY,
+                    calibration_pairs=RERANK_CANDIDATES
+                ),
+                candidates=RERANK_CANDIDATES
+            )
+            logger.info(
+                f"Reranking top {RERANK_CANDIDATES} candidates with {RERANK_MODEL} "
+                f"({rag_system.reranker.pair_seconds * 1000:.2f} ms per pair)"
+            )
+        if rag_system.decisions is not None:
+            closing_writer = ClosingStatementWriter(
+                rag_system.decisions,
+                SummaryCache(os.path.join(CHROMA_PERSIST_DIR, "decision_summaries.jsonl")),
+                map_concurrency=int(os.getenv("CLOSING_MAP_CONCURRENCY", "4"))
+            )
+        ingestion_jobs = IngestionJobManager(
+            rag_system,
+            admission=admission,
+            batch_size=int(os.getenv("INGESTION_BATCH_SIZE", "16")),
+            max_cases_per_s=float(os.getenv("INGESTION_MAX_CASES_PER_S", "0")) or None,
+            # new cases can bring new institutions, countries and parties
+            on_finished=lambda job: search_extractor.request_refresh()
+        )
         logger.info("ChromaDB RAG system initialized successfully")
         logger.info(f"Cases loaded: {rag_system.collection.count()}")
         return True
@@ -133,10 +387,160 @@ def initialize_rag():
 app = Flask(__name__)
 CORS(app)
 
+# ----------------------------
+# request metrics
+# ----------------------------
+def metrics_endpoint_label():
+    # route pattern rather than raw path, so label cardinality stays bounded
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = metrics_endpoint_label()
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if "request_start" not in g:
+        return
+    REQUESTS_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - g.request_start,
+        endpoint=g.metrics_endpoint,
+        status=g.get("response_status", 500)
+    )
+
+# ----------------------------
+# request profiling
+# ----------------------------
+def is_admin_request():
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+@app.before_request
+def start_request_profile():
+    requested = request.headers.get("X-Profile") == "1" and is_admin_request()
+    if should_profile(requested, PROFILE_SAMPLE_RATE):
+        g.profiler = StackSampler(threading.get_ident(), interval=PROFILE_INTERVAL_MS / 1000).start()
+
+def finish_request_profile(profiler, profile_id, meta):
+    profiler.stop()
+    profile_store.save(profiler, meta, profile_id=profile_id)
+    logger.info(f"Saved profile {profile_id} for {meta['method']} {meta['path']} ({profiler.duration:.2f}s)")
+
+@app.after_request
+def save_request_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profile_id = profile_store.new_id()
+        meta = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": g.get("metrics_endpoint"),
+            "status": response.status_code,
+            "streamed": response.is_streamed
+        }
+        response.headers["X-Profile-Id"] = profile_id
+        if response.is_streamed:
+            # the body is generated after the view returns; keep sampling until the server closes it
+            response.call_on_close(lambda: finish_request_profile(profiler, profile_id, meta))
+        else:
+            finish_request_profile(profiler, profile_id, meta)
+    return response
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # after_request is skipped when a view raises, so make sure the sampler thread ends
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def require_admin(view):
+    """Reject requests without the configured X-Admin-Token header."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints are disabled (ADMIN_TOKEN not set)"}), 403
+        if not is_admin_request():
+            return jsonify({"error": "Invalid admin token"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def admitted(default_workload, allowed=None, controller=None):
+    """
+    Run the view under admission control (the local model's pool unless
+    another controller is given).
+
+    Clients pick a workload class with the X-Workload-Class header or a
+    "workload" body field (limited to `allowed`); shed requests get a 429
+    with Retry-After.
+    """
+    allowed = set(allowed or [default_workload])
+    controller = controller or admission
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            workload = request.headers.get("X-Workload-Class") or data.get("workload") or default_workload
+            if workload not in allowed:
+                return jsonify({
+                    "error": "Invalid workload class",
+                    "message": f"Workload must be one of: {', '.join(sorted(allowed))}"
+                }), 400
+
+            try:
+                with controller.admit(workload):
+                    return view(*args, **kwargs)
+            except AdmissionRejected as e:
+                logger.warning(f"Shed {workload} request to {request.path}: {e.reason}")
+                response = jsonify({
+                    "error": "Server busy",
+                    "message": str(e),
+                    "workload": workload
+                })
+                response.status_code = 429
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+        return wrapper
+    return decorator
+
+@app.route("/admin/admission", methods=["GET"])
+@require_admin
+def admission_status():
+    return jsonify({"model": admission.describe(), "openai": openai_admission.describe()})
+
 # ----------------------------
 # ChromaDB RAG endpoint
 # ----------------------------
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+def format_sources(cases):
+    sources = []
+    for case in cases:
+        meta = case['metadata']
+        sources.append({
+            "case_id": meta.get('case_id'),
+            "title": meta.get('title'),
+            "institution": meta.get('institution'),
+            "status": meta.get('status'),
+            "similarity": f"{1-case['distance']:.3f}" if case['distance'] else "N/A"
+        })
+    return sources
+
 @app.route("/openai/query", methods=["POST"])
+@admitted("interactive", allowed=["interactive", "closing_statement"], controller=openai_admission)
 def openai_rag_query():
     """
     Query arbitration cases using ChromaDB RAG system
@@ -144,7 +548,10 @@ def openai_rag_query():
     Expected JSON body:
     {
         "question": "What is case IDS-817 about?",
-        "model": "gpt-3.5-turbo" (optional, defaults to gpt-3.5-turbo)
+        "model": "gpt-3.5-turbo" (optional, defaults to gpt-3.5-turbo),
+        "workload": "interactive" (optional, or "closing_statement"),
+        "session": true (optional, start a conversation; the response carries its session_id),
+        "session_id": "..." (optional, continue a conversation: earlier turns and cases are reused)
     }
     """
     try:
@@ -179,35 +586,44 @@ def openai_rag_query():
             }), 400
         
         # Get optional model parameter
-        model_name = data.get('model', 'ft:gpt-4o-mini-2024-07-18:personal::CFU019NU')
+        model_name = data.get('model', DEFAULT_OPENAI_MODEL)
+        if not isinstance(model_name, str) or model_name not in OPENAI_MODELS:
+            return unknown_model_response(model_name)
         
         logger.info(f"RAG Query: {question}")
         
-        # Use the RAG system to answer the question
-        answer = rag_system.answer_question(question, model=model_name)
+        # Continue (or start) a conversation session if asked; an expired id silently starts a new one
+        session = None
+        if data.get('session_id') or data.get('session'):
+            session = sessions.get_or_create(data.get('session_id'))
         
-        # Get the relevant cases that were found
-        relevant_cases = rag_system.search_cases(question, n_results=3)
+        # Use the RAG system to answer the question
+        with timed("rag_answer"):
+            if session is None:
+                result = rag_system.answer_question_with_context(question, model=model_name)
+            else:
+                with session.lock:
+                    with timed("session_retrieval"):
+                        cases, reused = retrieve_for_session(rag_system, session, question)
+                    result = rag_system.answer_question_with_context(
+                        question, model=model_name, cases=cases, history=session.history()
+                    )
+                    session.add_turn(question, result["answer"], [case['id'] for case in result["cases"]])
         
-        # Format response with case information
-        sources = []
-        for case in relevant_cases:
-            meta = case['metadata']
-            sources.append({
-                "case_id": meta.get('case_id'),
-                "title": meta.get('title'),
-                "institution": meta.get('institution'),
-                "status": meta.get('status'),
-                "similarity": f"{1-case['distance']:.3f}" if case['distance'] else "N/A"
-            })
+        # Format response with the cases that made it into the prompt
+        sources = format_sources(result["cases"])
         
         response_data = {
             "question": question,
-            "answer": answer,
+            "answer": result["answer"],
             "model_used": model_name,
             "sources": sources,
+            "context_tokens": result["context_tokens"],
             "total_cases_in_db": rag_system.collection.count()
         }
+        if session is not None:
+            response_data["session_id"] = session.id
+            response_data["retrieval_reused"] = reused
         
         logger.info(f"✅ RAG Response generated with {len(sources)} sources")
         return jsonify(response_data)
@@ -219,21 +635,168 @@ def openai_rag_query():
             "message": str(e)
         }), 500
 
+@app.route("/openai/query/batch", methods=["POST"])
+def openai_rag_query_batch():
+    """
+    Answer a list of questions, streaming one JSON line per answer as it finishes
+    
+    Expected JSON body:
+    {
+        "questions": ["What is case IDS-817 about?", ...],
+        "model": "gpt-3.5-turbo" (optional)
+    }
+    
+    Response is application/x-ndjson: {"index", "question", "answer", "sources", "context_tokens"}
+    lines in completion order, then {"done": true, "count", "elapsed_s"}. Runs as bulk work.
+    """
+    if rag_system is None:
+        return jsonify({
+            "error": "RAG system not initialized",
+            "message": "ChromaDB RAG system failed to load. Check server logs."
+        }), 500
+    
+    data = request.get_json(silent=True) or {}
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return jsonify({
+            "error": "Missing required field",
+            "message": "Field 'questions' must be a non-empty list"
+        }), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({
+            "error": "Batch too large",
+            "message": f"At most {MAX_BATCH_QUESTIONS} questions per batch"
+        }), 400
+    questions = [str(question).strip() for question in questions]
+    if not all(questions):
+        return jsonify({
+            "error": "Invalid question",
+            "message": "Questions cannot be empty"
+        }), 400
+    
+    model_name = data.get('model', DEFAULT_OPENAI_MODEL)
+    if not isinstance(model_name, str) or model_name not in OPENAI_MODELS:
+        return unknown_model_response(model_name)
+    
+    # hold the bulk slot for as long as the stream runs, not just until the view returns
+    try:
+        admitted_at = openai_admission.acquire("bulk")
+    except AdmissionRejected as e:
+        logger.warning(f"Shed bulk request to {request.path}: {e.reason}")
+        response = jsonify({"error": "Server busy", "message": str(e), "workload": "bulk"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    
+    logger.info(f"RAG batch: {len(questions)} questions")
+    
+    def stream():
+        started = time.time()
+        try:
+            for index, result in rag_system.answer_questions(questions, model=model_name, max_concurrency=BATCH_CONCURRENCY):
+                yield json.dumps({
+                    "index": index,
+                    "question": questions[index],
+                    "answer": result["answer"],
+                    "sources": format_sources(result["cases"]),
+                    "context_tokens": result["context_tokens"]
+                }) + "\n"
+            yield json.dumps({"done": True, "count": len(questions), "elapsed_s": round(time.time() - started, 2)}) + "\n"
+        finally:
+            openai_admission.release("bulk", admitted_at)
+    
+    return Response(stream(), mimetype="application/x-ndjson")
+
+@app.route("/openai/closing-statement", methods=["POST"])
+@admitted("closing_statement", controller=openai_admission)
+def closing_statement():
+    """
+    Generate a long-form closing statement from the full decision texts
+    
+    Expected JSON body:
+    {
+        "details": {"caseTitle", "caseNumber", "court", "attorney", "client", "caseType", "jurisdiction"},
+        "instructions": "..." (optional),
+        "session_id": "..." (optional, prefer decisions of the cases discussed in that chat session),
+        "model": "gpt-4o-mini" (optional)
+    }
+    
+    Decision passages are summarized in parallel (cached per decision), then one
+    completion writes the statement from the summaries.
+    """
+    if closing_writer is None:
+        return jsonify({
+            "error": "Closing statements unavailable",
+            "message": "Decision passages are not indexed (INDEX_DECISIONS=0 or RAG system failed to load)"
+        }), 503
+    
+    data = request.get_json(silent=True) or {}
+    details = data.get('details')
+    if not isinstance(details, dict) or not details.get('caseTitle'):
+        return jsonify({
+            "error": "Missing required field",
+            "message": "Field 'details' with at least 'caseTitle' is required"
+        }), 400
+    
+    model_name = data.get('model', DEFAULT_OPENAI_MODEL)
+    if not isinstance(model_name, str) or model_name not in OPENAI_MODELS:
+        return unknown_model_response(model_name)
+    
+    case_ids = None
+    session = sessions.get(data['session_id']) if data.get('session_id') else None
+    if session is not None:
+        # the session's turn lock, so /openai/query can't change its cases mid-read
+        with session.lock:
+            case_ids = [case['metadata'].get('case_id') for case in session.cases.values()]
+    
+    try:
+        with timed("closing_statement"):
+            result = closing_writer.write(details, model_name, instructions=data.get('instructions', ''), case_ids=case_ids)
+    except Exception as e:
+        logger.error(f"Error generating closing statement: {str(e)}")
+        return jsonify({"error": "Internal server error", "message": str(e)}), 500
+    
+    if result["statement"] is None:
+        return jsonify({
+            "error": "No decision passages found",
+            "message": "Load cases with decision texts first"
+        }), 404
+    
+    logger.info(f"✅ Closing statement from {len(result['decisions'])} decisions ({result['cached_summaries']} summaries cached)")
+    result["model_used"] = model_name
+    return jsonify(result)
+
+@app.route("/openai/sessions/<session_id>", methods=["GET"])
+def get_session(session_id):
+    """Turns and cached case ids of a live conversation session"""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": f"Session not found or expired: {session_id}"}), 404
+    return jsonify(session.to_dict())
+
+@app.route("/openai/sessions/<session_id>", methods=["DELETE"])
+def end_session(session_id):
+    if not sessions.delete(session_id):
+        return jsonify({"error": f"Session not found or expired: {session_id}"}), 404
+    return jsonify({"message": f"Session {session_id} ended"})
+
 # ----------------------------
-# Load cases endpoint
+# Load cases endpoints
 # ----------------------------
 @app.route("/openai/load-cases", methods=["POST"])
 def load_cases():
     """
-    Load arbitration cases from JSON file into ChromaDB
+    Queue a background job loading arbitration cases from a JSON file or case store (case_store.py) into ChromaDB
     
     Expected JSON body:
     {
         "filename": "path/to/your/cases.json"
     }
+    
+    Returns 202 with a job id; poll GET /openai/load-cases/<job_id> for progress.
     """
     try:
-        if rag_system is None:
+        if rag_system is None or ingestion_jobs is None:
             return jsonify({
                 "error": "RAG system not initialized"
             }), 500
@@ -252,17 +815,14 @@ def load_cases():
                 "error": f"File not found: {filename}"
             }), 404
         
-        # Load cases
-        initial_count = rag_system.collection.count()
-        rag_system.load_cases_from_json(filename)
-        final_count = rag_system.collection.count()
-        cases_added = final_count - initial_count
+        job = ingestion_jobs.submit(filename)
         
         return jsonify({
-            "message": f"Successfully loaded {cases_added} cases",
-            "total_cases": final_count,
+            "message": "Ingestion job queued",
+            "job_id": job.id,
+            "status_url": f"/openai/load-cases/{job.id}",
             "filename": filename
-        })
+        }), 202
         
     except Exception as e:
         logger.error(f"Error loading cases: {str(e)}")
@@ -271,12 +831,33 @@ def load_cases():
             "message": str(e)
         }), 500
 
+@app.route("/openai/load-cases", methods=["GET"])
+def list_load_jobs():
+    if ingestion_jobs is None:
+        return jsonify({"error": "RAG system not initialized"}), 500
+    return jsonify({"jobs": ingestion_jobs.list()})
+
+@app.route("/openai/load-cases/<job_id>", methods=["GET"])
+def load_job_status(job_id):
+    """Progress of an ingestion job: processed, rate, errors and ETA"""
+    job = ingestion_jobs.get(job_id) if ingestion_jobs else None
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/openai/load-cases/<job_id>/cancel", methods=["POST"])
+def cancel_load_job(job_id):
+    job = ingestion_jobs.cancel(job_id) if ingestion_jobs else None
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
 # ----------------------------
 # Get database stats endpoint
 # ----------------------------
 @app.route("/openai/stats", methods=["GET"])
 def get_rag_stats():
-    """Get ChromaDB database statistics"""
+    """Get ChromaDB database statistics (facet counts are maintained on write, no collection scan)"""
     try:
         if rag_system is None:
             return jsonify({
@@ -285,10 +866,14 @@ def get_rag_stats():
         
         stats = rag_system.get_database_stats()
         
-        return jsonify({
-            "stats": stats,
-            "total_cases": rag_system.collection.count()
-        })
+        response_data = {
+            "stats": stats["facets"],
+            "total_cases": stats["total_cases"]
+        }
+        if "shards" in stats:
+            response_data["shards"] = stats["shards"]
+        
+        return jsonify(response_data)
         
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
@@ -305,9 +890,14 @@ def get_rag_stats():
 # {
 # "question": string
 # "use_webscraping": true
+# "structured": true  (optional, answer is returned as typed case fields)
+# "speculative": false  (optional, turn off draft-model decoding when DRAFT_MODEL_PATH is set)
+# "use_rag": true  (optional, answer from the case index with the local model, no external calls)
+# "workload": "interactive"  (optional, or "closing_statement")
 # }
 
 @app.route("/query", methods=["POST"])
+@admitted("interactive", allowed=["interactive", "closing_statement"])
 def query_model():
     data = request.get_json()
     if "question" not in data:
@@ -315,37 +905,137 @@ def query_model():
 
     question = data["question"]
     use_webscraping = data.get("use_webscraping", False)  # default False
+    adapter = data.get("adapter")  # optional LoRA adapter name, default is the base model
+    structured = data.get("structured", False)
+    speculative = data.get("speculative", True)
+    use_rag = data.get("use_rag", False)
 
-    # Step 1: Optionally get Tavily context
-    if use_webscraping:
-        # Let the model suggest a search term
-        agent_prompt = (
-            f"You are an agent that finds the most relevant search term for the following question.\n"
-            f"Question: {question}\n"
-            f"Return only the keyword or phrase to search online."
-        )
-        search_term_inputs = tokenizer(agent_prompt, return_tensors="pt").to(model.device)
-        search_term_outputs = model.generate(**search_term_inputs, max_new_tokens=30)
-        search_term = tokenizer.decode(search_term_outputs[0], skip_special_tokens=True)
+    if use_rag and rag_system is None:
+        return jsonify({"error": "RAG system not initialized"}), 500
 
-        # Call Tavily
-        tavily_content = tavily_search(search_term)
+    try:
+        # Step 1: Optionally get Tavily context
+        search_queries = None
+        if use_webscraping:
+            # Pick search terms (case numbers, parties, institutions, keywords) without the model
+            with timed("search_term_extraction"):
+                search_queries = search_extractor.extract(question)["queries"]
 
-        # Build prompt including context
-        final_prompt = f"Use the following context to answer the question:\n{tavily_content}\n\nQuestion: {question}"
-    else:
-        final_prompt = question
+            # Call Tavily, one request per query at the same time
+            with timed("tavily_search"):
+                tavily_content = tavily_search_many(search_queries)
+
+            # Build prompt including context
+            final_prompt = f"Use the following context to answer the question:\n{trim_web_context(tavily_content)}\n\nQuestion: {question}"
+        else:
+            tavily_content = None
+            final_prompt = question
 
-    # Step 2: Tokenize and generate answer
-    inputs = tokenizer(final_prompt, return_tensors="pt").to(model.device)
-    outputs = model.generate(**inputs, max_new_tokens=200)
-    raw_answer = tokenizer.decode(outputs[0], skip_special_tokens=False)
+        # Optionally answer from the case index (retrieval overlaps prompt tokenization)
+        rag_ids = None
+        if use_rag:
+            with timed("local_rag_prepare"):
+                rag_ids, rag_context = local_rag_inputs(question, web_context=tavily_content)
+
+        # Step 2: Tokenize and generate answer
+        if structured:
+            # decode straight into the case fields and stop once the object is closed
+            if rag_ids is not None:
+                structured_prompt = tokenizer.decode(rag_ids, skip_special_tokens=True) + " "
+            else:
+                structured_prompt = f"User: {final_prompt}\nAssistant: "
+            with timed("structured_generate"):
+                fields, stats = model_generate_structured(structured_prompt, adapter=adapter)
+            return jsonify({
+                "question": question,
+                "answer": fields,
+                "adapter": adapter,
+                "generated_tokens": stats["generated_tokens"]
+            })
+
+        with timed("generate"):
+            raw_answer, decoding_stats = model_generate_with_stats(
+                final_prompt, max_tokens=200, adapter=adapter, speculative=speculative, input_ids=rag_ids
+            )
+    except AdapterError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Step 3: Parse/clean model output
     parsed_answer = parse_model_output(raw_answer)
 
     # Step 4: Return same DeepSeek-style JSON
-    return jsonify({"question": question, "answer": parsed_answer})
+    response_data = {"question": question, "answer": parsed_answer, "adapter": adapter}
+    if search_queries:
+        response_data["search_queries"] = search_queries
+    if use_rag:
+        response_data["sources"] = [
+            {
+                "case_id": case['metadata'].get('case_id'),
+                "title": case['metadata'].get('title'),
+                "institution": case['metadata'].get('institution')
+            }
+            for case in rag_context["cases"]
+        ]
+        response_data["context_tokens"] = rag_context["tokens"]
+    if decoding_stats:
+        response_data["speculative"] = decoding_stats
+    return jsonify(response_data)
+
+# ----------------------------
+# profile admin endpoints
+# ----------------------------
+@app.route("/admin/profiles", methods=["GET"])
+@require_admin
+def list_profiles():
+    return jsonify({"profiles": profile_store.list()})
+
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+@require_admin
+def get_profile(profile_id):
+    """Folded stacks, ready for flamegraph.pl or speedscope"""
+    path = profile_store.folded_path(profile_id)
+    if path is None:
+        return jsonify({"error": f"Profile not found: {profile_id}"}), 404
+    return send_file(os.path.abspath(path), mimetype="text/plain", as_attachment=True, download_name=f"{profile_id}.folded")
+
+# ----------------------------
+# adapter admin endpoints
+# ----------------------------
+# sample body for POST /admin/adapters
+# {
+# "name": "icsid",
+# "path": "./runs/run-20250101-120000/adapter"
+# }
+
+@app.route("/admin/adapters", methods=["GET"])
+@require_admin
+def list_adapters():
+    return jsonify(adapter_registry.describe())
+
+@app.route("/admin/adapters", methods=["POST"])
+@require_admin
+def load_adapter():
+    """Register a new adapter, or swap the weights behind an existing name."""
+    data = request.get_json() or {}
+    if "name" not in data or "path" not in data:
+        return jsonify({"error": "Fields 'name' and 'path' are required"}), 400
+
+    try:
+        adapter_registry.register(data["name"], data["path"], load=data.get("preload", True))
+    except AdapterError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(adapter_registry.describe())
+
+@app.route("/admin/adapters/<name>", methods=["DELETE"])
+@require_admin
+def unload_adapter(name):
+    try:
+        adapter_registry.unregister(name)
+    except AdapterError as e:
+        return jsonify({"error": str(e)}), 404
+
+    return jsonify(adapter_registry.describe())
 
 @app.route("/tavily/test", methods=["POST"])
 def tavily_test_endpoint():
@@ -0,0 +1,295 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from serving_manifest import load_serving_manifest
+from generate_finetuning_data import FineTuningDataGenerator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# metadata fields checked in every answer, keyed by the name used in the report
+CASE_FIELDS = {
+    "case_id": "Identifier",
+    "title": "Title",
+    "case_number": "CaseNumber",
+    "institution": "Institution",
+    "status": "Status",
+    "industries": "Industries",
+    "nationalities": "PartyNationalities",
+    "rules": "RulesOfArbitration",
+    "treaties": "ApplicableTreaties",
+}
+
+# which of the generated training examples become benchmark questions
+QUESTION_TEMPLATES = ("Tell me about arbitration case", "What was the outcome of case", "Which parties were involved in case")
+
+def normalize(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+def field_values(doc, key):
+    value = doc.get(key)
+    if isinstance(value, list):
+        return [v for v in value if v]
+    return [value] if value else []
+
+def build_question_set(documents, max_cases=50):
+    """
+    Build a fixed, ordered question set from the case corpus.
+
+    Questions and reference answers come from FineTuningDataGenerator, so they
+    match what the model was trained on. Each item also records which case
+    metadata values the reference answer contains, for field-level scoring.
+    """
+    generator = FineTuningDataGenerator()
+    documents = sorted(documents, key=lambda d: d.get("Identifier", ""))[:max_cases]
+
+    questions = []
+    for doc in documents:
+        for example in generator.create_training_examples(doc):
+            messages = {msg["role"]: msg["content"] for msg in example["messages"]}
+            if not messages["user"].startswith(QUESTION_TEMPLATES):
+                continue
+
+            reference = messages["assistant"]
+            expected_fields = {}
+            for name, key in CASE_FIELDS.items():
+                values = [v for v in field_values(doc, key) if normalize(v) in normalize(reference)]
+                if values:
+                    expected_fields[name] = values
+
+            questions.append({
+                "case_id": doc.get("Identifier", ""),
+                "system": messages.get("system", ""),
+                "question": messages["user"],
+                "reference": reference,
+                "expected_fields": expected_fields
+            })
+
+    return questions
+
+def format_prompt(item):
+    """Same System/User/Assistant layout as load_training_data in deepseek_model_training.py"""
+    return f"System: {item['system']}\nUser: {item['question']}\nAssistant:"
+
+def extract_answer(generated):
+    """Keep the assistant turn only, in case the model runs on into another turn."""
+    answer = generated.replace("<|endoftext|>", "")
+    for marker in ("\nUser:", "\nSystem:", "\nAssistant:"):
+        answer = answer.split(marker)[0]
+    return answer.strip()
+
+def score_answer(item, answer):
+    norm_answer = normalize(answer)
+    fields = {
+        name: all(normalize(v) in norm_answer for v in values)
+        for name, values in item["expected_fields"].items()
+    }
+    return {
+        "exact_match": norm_answer == normalize(item["reference"]),
+        "fields": fields
+    }
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def peak_memory_bytes():
+    """
+    Peak device memory on GPU. On CPU, the process's peak resident set size as
+    tracked by the OS, which includes the high-water mark inside generate, not
+    just what is left after it (None where that isn't available).
+    """
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated()
+    try:
+        import resource
+    except ImportError:
+        # Windows: psutil reports the peak working set instead
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return getattr(psutil.Process(os.getpid()).memory_info(), "peak_wset", None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def load_model(model_dir):
+    """Load a merged export or an adapter directory (transformers applies the adapter via peft)."""
+    manifest = load_serving_manifest(model_dir)
+    dtype = manifest["dtype"] if manifest else ("float16" if torch.cuda.is_available() else "float32")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # decoder-only batching needs left padding so every prompt ends at the same position
+    tokenizer.padding_side = "left"
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_dir,
+        dtype=getattr(torch, dtype),
+        device_map="auto" if torch.cuda.is_available() else None,
+        low_cpu_mem_usage=True
+    )
+    model.eval()
+    return model, tokenizer, manifest, dtype
+
+def run_benchmark(model_dir, questions, batch_size=8, max_new_tokens=128, warmup=True):
+    """Greedy, batched generation over the question set; returns the full report dict."""
+    model, tokenizer, manifest, dtype = load_model(model_dir)
+    torch.manual_seed(0)
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+    generation_kwargs = {
+        "max_new_tokens": max_new_tokens,
+        "do_sample": False,
+        "num_beams": 1,
+        "pad_token_id": tokenizer.pad_token_id,
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+
+    if warmup and questions:
+        warm = tokenizer([format_prompt(questions[0])], return_tensors="pt").to(model.device)
+        with torch.no_grad():
+            model.generate(**warm, **dict(generation_kwargs, max_new_tokens=4))
+
+    results = []
+    # one wall time per generate call: every question in a batch waits for the whole batch
+    batch_latencies = []
+    total_new_tokens = 0
+    total_time = 0.0
+    peak_memory = peak_memory_bytes()
+
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start + batch_size]
+        inputs = tokenizer([format_prompt(item) for item in batch], return_tensors="pt", padding=True).to(model.device)
+        prompt_length = inputs["input_ids"].shape[1]
+
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        batch_start = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(**inputs, **generation_kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - batch_start
+
+        total_time += elapsed
+        batch_latencies.append(elapsed)
+        memory = peak_memory_bytes()
+        if memory is not None:
+            peak_memory = max(peak_memory or 0, memory)
+
+        for item, output in zip(batch, outputs):
+            new_tokens = output[prompt_length:]
+            # padding after eos is not generated work
+            generated_count = int((new_tokens != tokenizer.pad_token_id).sum().item())
+            if tokenizer.pad_token_id == tokenizer.eos_token_id and generated_count < len(new_tokens):
+                generated_count += 1
+            total_new_tokens += generated_count
+
+            answer = extract_answer(tokenizer.decode(new_tokens, skip_special_tokens=True))
+            results.append(dict(item, answer=answer, new_tokens=generated_count, batch_latency_s=elapsed, **score_answer(item, answer)))
+
+        logger.info(f"Batch {start // batch_size + 1}: {len(batch)} questions in {elapsed:.2f}s")
+
+    field_totals = {}
+    for result in results:
+        for name, ok in result["fields"].items():
+            hit, count = field_totals.get(name, (0, 0))
+            field_totals[name] = (hit + int(ok), count + 1)
+
+    summary = {
+        "questions": len(results),
+        "exact_match": sum(r["exact_match"] for r in results) / len(results) if results else None,
+        "field_accuracy": {name: hit / count for name, (hit, count) in sorted(field_totals.items())},
+        "field_accuracy_overall": (
+            sum(h for h, _ in field_totals.values()) / sum(c for _, c in field_totals.values())
+            if field_totals else None
+        ),
+        "tokens_per_second": total_new_tokens / total_time if total_time else None,
+        "generated_tokens": total_new_tokens,
+        "total_time_s": total_time,
+        # throughput, not latency: batch wall time shared out over the batch's questions
+        "seconds_per_question": total_time / len(results) if results else None,
+        "batch_latency_p50_s": percentile(batch_latencies, 50),
+        "batch_latency_p95_s": percentile(batch_latencies, 95),
+        "peak_memory_bytes": peak_memory,
+    }
+
+    return {
+        "model_dir": os.path.abspath(model_dir),
+        "manifest": manifest,
+        "config": {
+            "dtype": dtype,
+            "device": str(model.device),
+            "batch_size": batch_size,
+            "max_new_tokens": max_new_tokens,
+            "decoding": "greedy",
+            "torch_version": torch.__version__,
+        },
+        "created_at": datetime.now().isoformat(),
+        "summary": summary,
+        "results": results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Quality and latency benchmark for the fine-tuned model")
+    parser.add_argument("model_dir", help="merged export or adapter directory")
+    parser.add_argument("--cases", default="./case_data_clean", help="folder of case JSON files, or a case store (case_store.py)")
+    parser.add_argument("--max-cases", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--output", default=None, help="results JSON (default: ./benchmark_results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    # benchmark questions never use decision text
+    documents = list(FineTuningDataGenerator().load_documents(args.cases, with_text=False))
+    if not documents:
+        print(f"No documents found in {args.cases}")
+        return
+
+    questions = build_question_set(documents, max_cases=args.max_cases)
+    print(f"Benchmarking {len(questions)} questions from {min(len(documents), args.max_cases)} cases")
+
+    report = run_benchmark(args.model_dir, questions, batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+
+    output = args.output or os.path.join("./benchmark_results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    summary = report["summary"]
+    print("\nBENCHMARK SUMMARY")
+    print("=" * 40)
+    if summary["exact_match"] is not None:
+        print(f"Exact match: {summary['exact_match']:.3f}")
+    for name, accuracy in summary["field_accuracy"].items():
+        print(f"  {name}: {accuracy:.3f}")
+    if summary["tokens_per_second"] is not None:
+        print(f"Tokens/s: {summary['tokens_per_second']:.1f}")
+    if summary["seconds_per_question"] is not None:
+        print(f"Seconds per question (throughput): {summary['seconds_per_question']:.2f}s")
+        print(
+            f"Batch latency p50/p95 ({report['config']['batch_size']} questions per batch): "
+            f"{summary['batch_latency_p50_s']:.2f}s / {summary['batch_latency_p95_s']:.2f}s"
+        )
+    if summary["peak_memory_bytes"]:
+        print(f"Peak memory: {summary['peak_memory_bytes'] / 1e9:.2f} GB")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# facet name -> metadata key in the case collection
+FACETS = {
+    "institution": "institution",
+    "status": "status",
+    "industry": "industries",
+    "nationality": "nationalities",
+    "decision_type": "decision_types",
+}
+
+# facets stored in metadata as joined lists (see join_values)
+MULTI_VALUE_FACETS = {"industry", "nationality", "decision_type"}
+
+# values like "Korea, Republic of" contain commas, so lists are joined with "|";
+# records indexed before that have no "list_separator" key and used ", "
+LIST_SEPARATOR = "|"
+
+def join_values(values):
+    """A list of values as one metadata string (Chroma metadata must be scalar)"""
+    return LIST_SEPARATOR.join(value.replace(LIST_SEPARATOR, "/").strip() for value in values if value and value.strip())
+
+def split_values(metadata, key):
+    """The list stored in a metadata field by join_values (or comma-joined, for older records)"""
+    separator = metadata.get("list_separator", ",")
+    return [value.strip() for value in (metadata.get(key) or "").split(separator) if value.strip()]
+
+class CaseStatsStore:
+    """
+    Running facet counts for the case collection, persisted as JSON.
+
+    Updated on every add/upsert/delete instead of scanning the collection,
+    so reading the stats is a dict copy no matter how many cases are stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.total = 0
+        self.counts = {facet: Counter() for facet in FACETS}
+        self._batch_depth = 0
+        self._dirty = False
+        self.exists = os.path.exists(path)
+        if self.exists:
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.total = data.get("total_cases", 0)
+        for facet in FACETS:
+            self.counts[facet] = Counter(data.get("facets", {}).get(facet, {}))
+
+    def save(self):
+        with self.lock:
+            if self._batch_depth:
+                self._dirty = True
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._as_dict(), f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self.exists = True
+
+    @contextmanager
+    def batch(self):
+        """Defer writing to disk until the outermost batch ends (for bulk loads)."""
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._dirty:
+                    self.save()
+
+    @staticmethod
+    def facet_values(metadata, facet):
+        if facet in MULTI_VALUE_FACETS:
+            return split_values(metadata, FACETS[facet])
+        return [metadata.get(FACETS[facet]) or "Unknown"]
+
+    def _apply(self, metadata, delta):
+        self.total += delta
+        for facet in FACETS:
+            for value in self.facet_values(metadata, facet):
+                self.counts[facet][value] += delta
+                if self.counts[facet][value] <= 0:
+                    del self.counts[facet][value]
+
+    def add(self, metadata):
+        with self.lock:
+            self._apply(metadata, 1)
+            self.save()
+
+    def remove(self, metadata):
+        with self.lock:
+            self._apply(metadata, -1)
+            self.save()
+
+    def replace(self, old_metadata, new_metadata):
+        """Account for an upsert: old_metadata is None when the case is new."""
+        with self.lock:
+            if old_metadata:
+                self._apply(old_metadata, -1)
+            self._apply(new_metadata, 1)
+            self.save()
+
+    def reset(self):
+        with self.lock:
+            self.total = 0
+            self.counts = {facet: Counter() for facet in FACETS}
+            self.save()
+
+    def rebuild(self, collection, page_size=1000):
+        """Recount from scratch by paging through the collection's metadata."""
+        with self.lock:
+            self.total = 0
+            self.counts = {facet: Counter() for facet in FACETS}
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+                metadatas = page["metadatas"]
+                if not metadatas:
+                    break
+                for metadata in metadatas:
+                    self._apply(metadata, 1)
+                offset += len(metadatas)
+            self.save()
+        return self.snapshot()
+
+    def _as_dict(self):
+        return {
+            "total_cases": self.total,
+            "facets": {
+                facet: dict(counter.most_common())
+                for facet, counter in self.counts.items()
+            }
+        }
+
+    def snapshot(self):
+        """Total case count plus per-facet value counts (most common first)."""
+        with self.lock:
+            return self._as_dict()
+
+def main():
+    from handle_rag import ArbitrationRAGChroma
+
+    parser = argparse.ArgumentParser(description="Case statistics maintenance")
+    parser.add_argument("command", choices=["show", "rebuild"])
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    args = parser.parse_args()
+
+    rag = ArbitrationRAGChroma(persist_directory=args.persist_dir)
+    if args.command == "rebuild":
+        print("Rebuilding case statistics from the collection...")
+        stats = rag.rebuild_stats()
+    else:
+        stats = rag.get_database_stats()
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
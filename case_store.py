@@ -0,0 +1,287 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    rowid INTEGER PRIMARY KEY,
+    identifier TEXT UNIQUE NOT NULL,
+    title TEXT,
+    case_number TEXT,
+    status TEXT,
+    institution TEXT,
+    industries TEXT,       -- JSON array
+    nationalities TEXT,    -- JSON array
+    rules TEXT,            -- JSON array
+    treaties TEXT,         -- JSON array
+    source_sha1 TEXT
+);
+CREATE INDEX IF NOT EXISTS cases_institution ON cases (institution);
+CREATE INDEX IF NOT EXISTS cases_status ON cases (status);
+CREATE TABLE IF NOT EXISTS decisions (
+    case_rowid INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT,
+    type TEXT,
+    date TEXT,
+    opinions TEXT,         -- JSON array of opinion fields, without their text
+    content_chars INTEGER,
+    PRIMARY KEY (case_rowid, position)
+);
+-- cleaned text (zlib-compressed), kept apart so metadata scans never read it;
+-- part 0 is the decision itself, part n its n-th opinion
+CREATE TABLE IF NOT EXISTS decision_texts (
+    case_rowid INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    text BLOB,
+    PRIMARY KEY (case_rowid, position, part)
+);
+"""
+
+# list fields of the case JSON and their columns
+LIST_FIELDS = {
+    "Industries": "industries",
+    "PartyNationalities": "nationalities",
+    "RulesOfArbitration": "rules",
+    "ApplicableTreaties": "treaties",
+}
+
+MARKDOWN_ESCAPE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!])")
+
+def clean_markdown(text):
+    """
+    Remove the conversion artifacts in decision markdown: bold markers split
+    mid-word ("**G****lossary of** **D****efined**"), emphasis markers in
+    general, backslash escapes, non-breaking spaces and runs of blank lines.
+    Headings, lists and tables are kept.
+    """
+    if not text:
+        return ""
+    text = text.replace("\r\n", "\n").replace("\u00a0", " ")
+    text = text.replace("****", "")
+    text = re.sub(r"\*\*[ \t]+\*\*", " ", text)
+    text = re.sub(r"\*{2,3}", "", text)
+    text = MARKDOWN_ESCAPE.sub(r"\1", text)
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+def _compress(text):
+    return zlib.compress(text.encode("utf-8"), 6)
+
+def _decompress(blob):
+    return zlib.decompress(blob).decode("utf-8") if blob is not None else ""
+
+class CaseStore:
+    """
+    All cases in one SQLite file, normalized from the raw JSON dumps.
+
+    Case fields are columns (list fields as JSON), decisions are rows of their
+    own, and the cleaned decision/opinion texts live in a separate compressed
+    table that is only read when asked for. iter_cases streams cases back in the
+    original JSON shape with a fixed number of queries, whatever the case count.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def is_store(path):
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    def _source_hash(self, case):
+        return hashlib.sha1(json.dumps(case, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def import_cases(self, cases):
+        """Insert or replace cases by Identifier; unchanged cases are skipped. Returns (imported, unchanged)."""
+        imported = unchanged = 0
+        with self.conn:
+            for case in cases:
+                identifier = case.get("Identifier")
+                if not identifier:
+                    continue
+                source_sha1 = self._source_hash(case)
+                existing = self.conn.execute("SELECT rowid, source_sha1 FROM cases WHERE identifier = ?", (identifier,)).fetchone()
+                if existing and existing[1] == source_sha1:
+                    unchanged += 1
+                    continue
+                if existing:
+                    for table in ("decisions", "decision_texts"):
+                        self.conn.execute(f"DELETE FROM {table} WHERE case_rowid = ?", (existing[0],))
+                    self.conn.execute("DELETE FROM cases WHERE rowid = ?", (existing[0],))
+
+                cursor = self.conn.execute(
+                    "INSERT INTO cases (identifier, title, case_number, status, institution, industries, nationalities, rules, treaties, source_sha1) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (identifier, case.get("Title"), case.get("CaseNumber"), case.get("Status"), case.get("Institution"),
+                     *(json.dumps(case.get(field) or [], ensure_ascii=False) for field in LIST_FIELDS), source_sha1)
+                )
+                case_rowid = cursor.lastrowid
+
+                for position, decision in enumerate(case.get("Decisions") or []):
+                    content = clean_markdown(decision.get("Content"))
+                    opinions = [opinion if isinstance(opinion, dict) else {"Title": str(opinion)} for opinion in decision.get("Opinions") or []]
+                    self.conn.execute(
+                        "INSERT INTO decisions (case_rowid, position, title, type, date, opinions, content_chars) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (case_rowid, position, decision.get("Title"), decision.get("Type"), decision.get("Date"),
+                         json.dumps([{k: v for k, v in opinion.items() if k != "Content"} for opinion in opinions], ensure_ascii=False),
+                         len(content))
+                    )
+                    texts = [content] + [clean_markdown(opinion.get("Content")) for opinion in opinions]
+                    self.conn.executemany(
+                        "INSERT INTO decision_texts (case_rowid, position, part, text) VALUES (?, ?, ?, ?)",
+                        [(case_rowid, position, part, _compress(text)) for part, text in enumerate(texts) if text]
+                    )
+                imported += 1
+        return imported, unchanged
+
+    def import_files(self, paths):
+        """Import raw case dumps (a case or an array of cases per file). Returns (imported, unchanged, failed files)."""
+        imported = unchanged = 0
+        failed = []
+        for path in paths:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                failed.append((path, str(e)))
+                continue
+            added, same = self.import_cases(data if isinstance(data, list) else [data])
+            imported += added
+            unchanged += same
+        return imported, unchanged, failed
+
+    def decision_text(self, identifier, position, part=0):
+        """Cleaned text of one decision (part 0) or one of its opinions"""
+        row = self.conn.execute(
+            "SELECT t.text FROM decision_texts t JOIN cases c ON c.rowid = t.case_rowid "
+            "WHERE c.identifier = ? AND t.position = ? AND t.part = ?", (identifier, position, part)
+        ).fetchone()
+        return _decompress(row[0]) if row else ""
+
+    def iter_cases(self, with_text=False, identifiers=None):
+        """
+        Yield cases as dicts in the raw JSON shape, ordered by import.
+
+        Decision "Content" (and opinion "Content") is only filled in with_text=True;
+        otherwise use decision_text() for the few decisions that need it.
+        """
+        where, params = "", ()
+        if identifiers is not None:
+            identifiers = list(identifiers)
+            where = f"WHERE c.identifier IN ({','.join('?' * len(identifiers))})"
+            params = tuple(identifiers)
+
+        # three ordered cursors merged in step, instead of one query per case
+        cases = self.conn.execute(
+            "SELECT c.rowid, c.identifier, c.title, c.case_number, c.status, c.institution, "
+            f"c.industries, c.nationalities, c.rules, c.treaties FROM cases c {where} ORDER BY c.rowid", params
+        )
+        decisions = self.conn.execute(
+            "SELECT d.case_rowid, d.title, d.type, d.date, d.opinions FROM decisions d "
+            f"JOIN cases c ON c.rowid = d.case_rowid {where} ORDER BY d.case_rowid, d.position", params
+        )
+        texts = None
+        if with_text:
+            texts = self.conn.execute(
+                "SELECT t.case_rowid, t.position, t.part, t.text FROM decision_texts t "
+                f"JOIN cases c ON c.rowid = t.case_rowid {where} ORDER BY t.case_rowid, t.position, t.part", params
+            )
+
+        next_decision = decisions.fetchone()
+        next_text = texts.fetchone() if texts else None
+        for rowid, identifier, title, case_number, status, institution, *list_values in cases:
+            case = {
+                "Identifier": identifier,
+                "Title": title,
+                "CaseNumber": case_number,
+                "Industries": json.loads(list_values[0]),
+                "Status": status,
+                "PartyNationalities": json.loads(list_values[1]),
+                "Institution": institution,
+                "RulesOfArbitration": json.loads(list_values[2]),
+                "ApplicableTreaties": json.loads(list_values[3]),
+                "Decisions": []
+            }
+            while next_decision is not None and next_decision[0] == rowid:
+                _, decision_title, decision_type, date, opinions = next_decision
+                case["Decisions"].append({"Title": decision_title, "Type": decision_type, "Date": date, "Opinions": json.loads(opinions)})
+                next_decision = decisions.fetchone()
+            while next_text is not None and next_text[0] == rowid:
+                _, position, part, blob = next_text
+                decision = case["Decisions"][position]
+                if part == 0:
+                    decision["Content"] = _decompress(blob)
+                elif part - 1 < len(decision["Opinions"]):
+                    decision["Opinions"][part - 1]["Content"] = _decompress(blob)
+                next_text = texts.fetchone()
+            yield case
+
+def stream_cases(path, with_text=False, identifiers=None):
+    """
+    iter_cases over the store at path, for callers that hand the iterator on:
+    the store is closed once the cases run out, or when the generator is
+    closed or dropped before that.
+    """
+    with CaseStore(path) as store:
+        yield from store.iter_cases(with_text=with_text, identifiers=identifiers)
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize raw case dumps into one compact SQLite case store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="import a folder of raw case JSON files")
+    import_parser.add_argument("folder", nargs="?", default="./case_data_raw")
+    subparsers.add_parser("info", help="case, decision and text counts")
+    export_parser = subparsers.add_parser("export", help="write the cases back out as one JSON array")
+    export_parser.add_argument("output")
+    for sub in subparsers.choices.values():
+        sub.add_argument("--db", default=os.getenv("CASE_STORE", "./case_data.db"))
+    args = parser.parse_args()
+
+    store = CaseStore(args.db)
+    if args.command == "import":
+        started = time.time()
+        paths = sorted(glob.glob(os.path.join(args.folder, "*.json")))
+        imported, unchanged, failed = store.import_files(paths)
+        for path, error in failed:
+            print(f"Error reading {path}: {error}")
+        store.conn.execute("VACUUM")
+        print(f"Imported {imported} cases ({unchanged} unchanged) from {len(paths)} files in {time.time() - started:.1f}s")
+        print(f"{args.db}: {os.path.getsize(args.db) / 1e6:.1f} MB")
+    elif args.command == "info":
+        decisions, text_chars = store.conn.execute("SELECT COUNT(*), COALESCE(SUM(content_chars), 0) FROM decisions").fetchone()
+        print(f"{store.count()} cases, {decisions} decisions, {text_chars / 1e6:.1f}M characters of decision text")
+        print(f"{args.db}: {os.path.getsize(args.db) / 1e6:.1f} MB")
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(list(store.iter_cases(with_text=True)), f, ensure_ascii=False)
+        print(f"Exported {store.count()} cases to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import {
   AlertCircle
 } from 'lucide-react';
 
-export default function ClosingStatementModal({ isOpen, onClose, chatMessages = [] }) {
+export default function ClosingStatementModal({ isOpen, onClose, chatMessages = [], sessionId = null }) {
   const [formData, setFormData] = useState({
     caseTitle: '',
     caseNumber: '',
@@ -173,39 +173,67 @@ Date: ${formData.date}
     }
   };
 
-  const generateStatement = async () => {
-    setIsGenerating(true);
-    
-    const chatContext = extractChatContext();
+  // Fallback for servers without decision passages: one prompt through the chat endpoint
+  const queryStatement = async () => {
+    // Prepare prompt for the model
+    let prompt = `Generate a closing statement for this case given the relevant info:
     
-    try {
-      // Prepare prompt for the model
-      const prompt = `Generate a closing statement for this case given the relevant info:
-      
 Case: ${formData.caseTitle}
 Case Number: ${formData.caseNumber}
 Court: ${formData.court}
 Attorney: ${formData.attorney}
 Client: ${formData.client}
 Case Type: ${formData.caseType}
-${formData.jurisdiction ? `Jurisdiction: ${formData.jurisdiction}` : ''}
+${formData.jurisdiction ? `Jurisdiction: ${formData.jurisdiction}` : ''}`;
+
+    const body = { use_webscraping: false, workload: "closing_statement" };
+    if (sessionId) {
+      // the server already holds the conversation and its cases
+      prompt += `\n\nUse the cases and points from our conversation so far.`;
+      body.session_id = sessionId;
+    } else {
+      const chatContext = extractChatContext();
+      prompt += `
 
 Chat Context:
 ${chatContext.relevantCases.length > 0 ? `Relevant Cases: ${JSON.stringify(chatContext.relevantCases)}` : ''}
 ${chatContext.keyLegalPoints.length > 0 ? `Key Legal Points: ${chatContext.keyLegalPoints.join(' ')}` : ''}
 ${chatContext.institutions.length > 0 ? `Institutions: ${chatContext.institutions.join(', ')}` : ''}`;
+    }
+    body.question = prompt;
 
-      // Send to your API
-      const response = await fetch("http://localhost:8080/openai/query", {
+    return fetch("http://localhost:8080/openai/query", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body)
+    });
+  };
+
+  const generateStatement = async () => {
+    setIsGenerating(true);
+    
+    try {
+      // Long-form endpoint: summarizes the full decision texts, then writes the statement
+      let response = await fetch("http://localhost:8080/openai/closing-statement", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ question: prompt, use_webscraping: false })
+        body: JSON.stringify({ details: formData, session_id: sessionId })
       });
+      if (response.status === 404 || response.status === 503) {
+        response = await queryStatement();
+      }
+
+      if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || 'a few';
+        alert(`The server is busy generating other statements. Please try again in ${retryAfter} seconds.`);
+        return;
+      }
 
       const data = await response.json();
       
       // Extract the statement from response
-      const statement = typeof data.answer === 'string' ? data.answer : 
+      const statement = typeof data.statement === 'string' ? data.statement :
+                       typeof data.answer === 'string' ? data.answer : 
                        typeof data.answer === 'object' && data.answer.answer ? data.answer.answer :
                        'Error generating closing statement. Please try again.';
 
@@ -17,6 +17,7 @@ export default function ChatPage() {
     }
   ]);
   const [isTyping, setIsTyping] = useState(false);
+  const [sessionId, setSessionId] = useState(null); // server-side conversation (openai mode only)
   const messagesEndRef = useRef(null);
 
   const scrollToBottom = () => {
@@ -43,13 +44,21 @@ export default function ChatPage() {
           ? "http://localhost:8080/query"
           : "http://localhost:8080/openai/query";
 
+        const payload = { question: message, use_webscraping: false }; // default no webscraping
+        if (!devMode) {
+          // the server keeps earlier turns and retrieved cases, so only the new question is sent
+          if (sessionId) payload.session_id = sessionId;
+          else payload.session = true;
+        }
+
         const response = await fetch(endpoint, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ question: message, use_webscraping: false }) // default no webscraping
+        body: JSON.stringify(payload)
         });
 
         const data = await response.json();
+        if (data.session_id) setSessionId(data.session_id);
 
         // Fallback data if answer is missing or empty
         const fallbackAnswer = {
@@ -202,6 +211,7 @@ export default function ChatPage() {
         isOpen={showClosingModal}
         onClose={() => setShowClosingModal(false)}
         chatMessages={messages}
+        sessionId={sessionId}
       />
     </div>
   );
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from decision_passages import group_by_decision
+from handle_rag import get_openai_client
+from metrics import record_cache, record_tokens, timed
+from request_profiler import ProfiledThreadPoolExecutor
+
+MAP_SYSTEM = "You are an arbitration lawyer's research assistant. Summarize only what the given decision excerpts state; never add facts."
+REDUCE_SYSTEM = "You are an experienced arbitration advocate. Write persuasive, formal closing statements grounded only in the decision summaries provided, citing them."
+
+# form fields of the closing statement modal, in the order they are shown to the model
+DETAIL_FIELDS = [
+    ("caseTitle", "Case"),
+    ("caseNumber", "Case Number"),
+    ("court", "Court"),
+    ("attorney", "Attorney"),
+    ("client", "Client"),
+    ("caseType", "Case Type"),
+    ("jurisdiction", "Jurisdiction"),
+]
+
+class SummaryCache:
+    """
+    Per-decision summaries persisted as a JSON-lines log, keyed by model and
+    the exact passages summarized, so regenerating a statement over the same
+    decisions skips the map step. A miss appends one line; once the log holds
+    twice max_entries lines it is rewritten with only the most recently used
+    max_entries entries.
+    """
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.log_lines = 0
+        damaged = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        damaged = True  # a line cut short by a crash
+                        continue
+                    self.entries[record["key"]] = {"summary": record["summary"], "used_at": record["used_at"]}
+                    self.log_lines += 1
+        if damaged:
+            # rewrite, so the next append doesn't land on the end of the cut line
+            self._compact()
+
+    @staticmethod
+    def key(model, passages):
+        digest = hashlib.sha1(model.encode("utf-8"))
+        for passage in passages:
+            digest.update(b"\0" + passage['id'].encode("utf-8") + b"\0" + passage['document'].encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                # kept in memory only; written out with the next compaction
+                entry["used_at"] = time.time()
+            return entry["summary"] if entry else None
+
+    @staticmethod
+    def _line(key, entry):
+        return json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n"
+
+    def _compact(self):
+        newest = sorted(self.entries.items(), key=lambda item: item[1]["used_at"])[-self.max_entries:]
+        self.entries = dict(newest)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._line(key, entry) for key, entry in self.entries.items())
+        os.replace(tmp_path, self.path)
+        self.log_lines = len(self.entries)
+
+    def put(self, key, summary):
+        with self.lock:
+            self.entries[key] = {"summary": summary, "used_at": time.time()}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if self.log_lines + 1 > 2 * self.max_entries:
+                self._compact()
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(self._line(key, self.entries[key]))
+            self.log_lines += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+def _complete(model, system, prompt, max_tokens, stage):
+    with timed(stage):
+        response = get_openai_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2
+        )
+    usage = getattr(response, "usage", None)
+    if usage:
+        record_tokens(model, usage.prompt_tokens, usage.completion_tokens)
+    return response.choices[0].message.content
+
+class ClosingStatementWriter:
+    """
+    Long-form closing statements over the full decision texts, map-reduce style.
+
+    Retrieve: the decision passages closest to the case details and instructions.
+    Map: each decision's passages are summarized on their own, in parallel, with
+    summaries cached (see SummaryCache). Reduce: one completion composes the
+    statement from the case details and the decision summaries. Each completion
+    stays small no matter how long the underlying awards are.
+    """
+
+    def __init__(self, passages, summary_cache, map_concurrency=4, map_tokens=350, reduce_tokens=1800):
+        self.passages = passages
+        self.summary_cache = summary_cache
+        self.map_tokens = map_tokens
+        self.reduce_tokens = reduce_tokens
+        self.executor = ProfiledThreadPoolExecutor(max_workers=map_concurrency, thread_name_prefix="closing-map")
+
+    def _summarize(self, model, passages):
+        key = SummaryCache.key(model, passages)
+        summary = self.summary_cache.get(key)
+        record_cache("decision_summary", summary is not None)
+        if summary is not None:
+            return summary, True
+
+        meta = passages[0]['metadata']
+        excerpts = "\n\n".join(f"[Excerpt {i}]\n{passage['document']}" for i, passage in enumerate(passages, 1))
+        prompt = f"""Decision: {meta['decision_title']} ({meta['decision_type']}, {meta['decision_date'][:10] or 'undated'})
+Case: {meta['case_id']} - {meta['title']}
+
+EXCERPTS:
+{excerpts}
+
+Summarize in at most 150 words what these excerpts establish: holdings, findings of fact, the tribunal's reasoning, and any amounts awarded. Only use the excerpts."""
+        summary = _complete(model, MAP_SYSTEM, prompt, self.map_tokens, "closing_map")
+        self.summary_cache.put(key, summary)
+        return summary, False
+
+    def write(self, details, model, instructions="", case_ids=None, max_decisions=6, passages_per_decision=4):
+        """
+        details holds the modal's form fields (caseTitle, caseNumber, ...).
+        Returns {"statement", "decisions": [...], "cached_summaries", "timings"}.
+        """
+        timings = {}
+        detail_lines = [f"{label}: {details[field]}" for field, label in DETAIL_FIELDS if details.get(field)]
+        query = " ".join(detail_lines + [instructions]).strip()
+
+        started = time.perf_counter()
+        found = self.passages.search(query, n_results=max_decisions * passages_per_decision * 2, case_ids=case_ids)
+        groups = group_by_decision(found, max_decisions=max_decisions, passages_per_decision=passages_per_decision)
+        timings["retrieve_s"] = round(time.perf_counter() - started, 3)
+        if not groups:
+            return {"statement": None, "decisions": [], "cached_summaries": 0, "timings": timings}
+
+        started = time.perf_counter()
+        futures = [self.executor.submit(self._summarize, model, group) for group in groups.values()]
+        decisions = []
+        cached = 0
+        for group, future in zip(groups.values(), futures):
+            summary, hit = future.result()
+            cached += hit
+            meta = group[0]['metadata']
+            decisions.append({
+                "case_id": meta['case_id'],
+                "title": meta['title'],
+                "institution": meta['institution'],
+                "decision": meta['decision_title'],
+                "type": meta['decision_type'],
+                "date": meta['decision_date'][:10],
+                "summary": summary
+            })
+        timings["map_s"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        summaries = "\n\n".join(
+            f"[{i}] {d['case_id']} - {d['title']}, {d['decision']} ({d['type']}, {d['date'] or 'undated'})\n{d['summary']}"
+            for i, d in enumerate(decisions, 1)
+        )
+        prompt = f"""Write a closing statement for this case.
+
+{chr(10).join(detail_lines)}
+{f"Instructions: {instructions}" if instructions else ""}
+
+DECISION SUMMARIES:
+{summaries}
+
+Structure it as: introduction, summary of the facts, legal argument supported by the decisions above (cite them as [Case ID, Decision]), response to the opposing party's likely arguments, and the relief requested. Use a formal register."""
+        statement = _complete(model, REDUCE_SYSTEM, prompt, self.reduce_tokens, "closing_reduce")
+        timings["reduce_s"] = round(time.perf_counter() - started, 3)
+
+        return {"statement": statement, "decisions": decisions, "cached_summaries": cached, "timings": timings}
@@ -0,0 +1,171 @@
+import re
+
+import tiktoken
+
+from metrics import registry
+
+CONTEXT_TOKENS = registry.histogram(
+    "legaltech_context_tokens", "Tokens of retrieved context packed into a prompt", ["model"],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192)
+)
+
+# how much each document field is worth in a prompt; 0 drops the field entirely
+FIELD_WEIGHTS = {
+    "Case ID": 1.0,
+    "Title": 1.0,
+    "Case Number": 0.9,
+    "Institution": 0.9,
+    "Status": 0.9,
+    "Decisions": 0.7,
+    "Summary": 0.8,
+    "Industries": 0.6,
+    "Applicable Treaties": 0.5,
+    "Party Nationalities": 0.5,
+    "Rules of Arbitration": 0.4,
+}
+DEFAULT_FIELD_WEIGHT = 0.3
+
+# cap on a single field value, so one long decision list can't eat the budget
+MAX_FIELD_TOKENS = 160
+
+# passages at least this long are compared for overlap with passages already packed
+DEDUPE_MIN_TOKENS = 20
+DEDUPE_OVERLAP = 0.8
+
+def tiktoken_encoding(model):
+    """tiktoken encoding for an OpenAI model name (fine-tuned names fall back to their base family)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base" if "gpt-4o" in model else "cl100k_base")
+
+def tiktoken_counter(model):
+    """Token counter for an OpenAI model name."""
+    encoding = tiktoken_encoding(model)
+    return lambda text: len(encoding.encode(text))
+
+def hf_counter(tokenizer):
+    """Token counter for a Hugging Face tokenizer (the local model)."""
+    return lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+def _shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _overlap(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+class ContextBuilder:
+    """
+    Pack retrieved cases into a prompt context under a token budget.
+
+    Each case document is split into its "Field: value" lines. Every line is
+    scored by the case's retrieval similarity times the field's weight, long
+    values are trimmed, and near-duplicate passages are dropped. The best lines
+    are then packed greedily until the budget is used up, and written back out
+    grouped by case in retrieval order, each with its citation line.
+    """
+
+    def __init__(self, count_tokens, budget_tokens=1500, field_weights=None, max_field_tokens=MAX_FIELD_TOKENS):
+        self.count_tokens = count_tokens
+        self.budget_tokens = budget_tokens
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.max_field_tokens = max_field_tokens
+
+    def _trim(self, text):
+        if self.count_tokens(text) <= self.max_field_tokens:
+            return text
+        # cut by words and re-measure; cheap enough for a handful of fields
+        words = text.split()
+        keep = len(words)
+        while keep > 1 and self.count_tokens(" ".join(words[:keep]) + " ...") > self.max_field_tokens:
+            keep = int(keep * 0.8)
+        return " ".join(words[:keep]) + " ..."
+
+    def _passages(self, rank, case):
+        # prefer the cross-encoder score when the cases were reranked
+        if case.get('relevance') is not None:
+            similarity = case['relevance']
+        elif case.get('distance') is not None:
+            similarity = 1 - case['distance']
+        else:
+            similarity = 1.0
+        # rank breaks ties and still orders cases when distances are missing
+        case_score = max(similarity, 0.0) + 1e-3 / (rank + 1)
+        for order, line in enumerate(case['document'].splitlines()):
+            line = line.strip()
+            if not line:
+                continue
+            field = line.split(":", 1)[0] if ":" in line else ""
+            weight = self.field_weights.get(field, DEFAULT_FIELD_WEIGHT)
+            if weight <= 0:
+                continue
+            text = self._trim(line)
+            yield {
+                "rank": rank,
+                "order": order,
+                "text": text,
+                "tokens": self.count_tokens(text) + 1,
+                "score": case_score * weight
+            }
+
+    @staticmethod
+    def _header(index):
+        return f"CASE {index}:"
+
+    @staticmethod
+    def _citation(case):
+        meta = case['metadata']
+        return f"[Citation Source: Case ID {meta.get('case_id')}, {meta.get('institution')}]"
+
+    def build(self, cases):
+        """
+        Returns a dict with the context text, the tokens it uses, the cases that
+        made it in (in retrieval order) and how many passages were left out.
+        """
+        passages = [p for rank, case in enumerate(cases) for p in self._passages(rank, case)]
+        passages.sort(key=lambda p: p["score"], reverse=True)
+
+        used_tokens = 0
+        packed = {}
+        packed_shingles = []
+        dropped = 0
+
+        for passage in passages:
+            cost = passage["tokens"]
+            if passage["rank"] not in packed:
+                # first line of a case also pays for its header and citation
+                case = cases[passage["rank"]]
+                cost += self.count_tokens(self._header(len(packed) + 1)) + self.count_tokens(self._citation(case)) + 2
+
+            if used_tokens + cost > self.budget_tokens:
+                dropped += 1
+                continue
+
+            if passage["tokens"] >= DEDUPE_MIN_TOKENS:
+                shingles = _shingles(passage["text"])
+                if any(_overlap(shingles, other) >= DEDUPE_OVERLAP for other in packed_shingles):
+                    dropped += 1
+                    continue
+                packed_shingles.append(shingles)
+
+            packed.setdefault(passage["rank"], []).append(passage)
+            used_tokens += cost
+
+        blocks = []
+        used_cases = []
+        for index, rank in enumerate(sorted(packed), 1):
+            case = cases[rank]
+            lines = [p["text"] for p in sorted(packed[rank], key=lambda p: p["order"])]
+            blocks.append(f"{self._header(index)}\n" + "\n".join(lines) + f"\n{self._citation(case)}")
+            used_cases.append(case)
+
+        text = "\n\n".join(blocks)
+        return {
+            "text": text,
+            "tokens": self.count_tokens(text),
+            "cases": used_cases,
+            "dropped_passages": dropped
+        }
@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import registry, record_cache, timed
+
+ACTIVE_SESSIONS = registry.gauge(
+    "legaltech_sessions_active", "Conversation sessions held in memory"
+)
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+class Session:
+    """One conversation: its turns, the cases retrieved so far (with embeddings) and a running topic vector."""
+
+    def __init__(self, max_turns=20, max_cases=24):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.max_turns = max_turns
+        self.max_cases = max_cases
+        self.turns = []
+        # case id -> {"id", "document", "metadata", "embedding"}, most recently used last
+        self.cases = OrderedDict()
+        self.topic = None
+        self.lock = threading.Lock()
+
+    def add_turn(self, question, answer, case_ids):
+        self.turns.append({"question": question, "answer": answer, "case_ids": case_ids, "at": time.time()})
+        del self.turns[:-self.max_turns]
+
+    def remember_cases(self, cases):
+        for case in cases:
+            self.cases[case['id']] = case
+            self.cases.move_to_end(case['id'])
+        while len(self.cases) > self.max_cases:
+            self.cases.popitem(last=False)
+
+    def update_topic(self, question_vector, weight=0.5):
+        # exponential moving average, so the topic follows the conversation as it drifts
+        self.topic = question_vector if self.topic is None else _unit((1 - weight) * self.topic + weight * question_vector)
+
+    def history(self, turns=3, max_answer_chars=600):
+        """The last few turns, answers shortened, for the prompt."""
+        return [
+            {"question": turn["question"], "answer": (turn["answer"] or "")[:max_answer_chars]}
+            for turn in self.turns[-turns:]
+        ]
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "turns": [{"question": t["question"], "case_ids": t["case_ids"]} for t in self.turns],
+            "cached_cases": list(self.cases)
+        }
+
+class SessionStore:
+    """In-memory sessions, evicted after ttl_s of inactivity or least recently used past max_sessions."""
+
+    def __init__(self, ttl_s=1800, max_sessions=1000):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if now - oldest.last_used <= self.ttl_s and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[oldest.id]
+        ACTIVE_SESSIONS.set(len(self.sessions))
+
+    def create(self):
+        session = Session()
+        with self.lock:
+            self.sessions[session.id] = session
+            self._evict(time.time())
+        return session
+
+    def get(self, session_id):
+        """The live session for an id (touched), or None if unknown or expired."""
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id):
+        return (self.get(session_id) if session_id else None) or self.create()
+
+    def delete(self, session_id):
+        with self.lock:
+            removed = self.sessions.pop(session_id, None) is not None
+            ACTIVE_SESSIONS.set(len(self.sessions))
+            return removed
+
+def retrieve_for_session(rag, session, question, n_results=3, reuse_similarity=0.8, topic_weight=0.35):
+    """
+    Retrieve cases for a follow-up question using what the session already has.
+
+    Only the new question is embedded. If it is close to the conversation's
+    topic, the cached cases are rescored against it and reused without a
+    vector search. Otherwise the index is searched with the question blended
+    towards the topic, and the results are merged with the cached cases.
+    Distances are cosine distances against the query used.
+    """
+    with timed("query_embedding"):
+        question_vector = _unit(rag.embedding_function([question])[0])
+
+    reuse = (
+        session.topic is not None
+        and len(session.cases) >= n_results
+        and float(question_vector @ session.topic) >= reuse_similarity
+    )
+    record_cache("session_retrieval", reuse)
+
+    if session.topic is not None:
+        query_vector = _unit((1 - topic_weight) * question_vector + topic_weight * session.topic)
+    else:
+        query_vector = question_vector
+
+    candidates = dict(session.cases)
+    if not reuse:
+        for case in rag.search_by_embedding(query_vector.tolist(), n_results=n_results * 2, include_embeddings=True):
+            candidates[case['id']] = case
+
+    scored = []
+    for case in candidates.values():
+        similarity = float(_unit(case['embedding']) @ query_vector)
+        scored.append(dict(case, distance=1 - similarity))
+    scored.sort(key=lambda case: case['distance'])
+
+    session.update_topic(question_vector)
+    session.remember_cases(scored[:n_results * 2])
+    return scored[:n_results], reuse
@@ -0,0 +1,207 @@
+import re
+from collections import OrderedDict
+
+from metrics import timed
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def split_passages(text, max_words=180, overlap_words=30):
+    """
+    Split a decision's text into passages of up to max_words words.
+
+    Paragraphs are packed together until the next one would overflow; a
+    paragraph longer than max_words is cut into overlapping windows. 180 words
+    stays inside the embedding model's 256 word-piece limit.
+    """
+    passages = []
+    current = []
+    for paragraph in PARAGRAPH_BREAK.split(text or ""):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(words) > max_words:
+            if current:
+                passages.append(" ".join(current))
+                current = []
+            step = max_words - overlap_words
+            for start in range(0, len(words) - overlap_words, step):
+                passages.append(" ".join(words[start:start + max_words]))
+            continue
+        if len(current) + len(words) > max_words:
+            passages.append(" ".join(current))
+            current = []
+        current.extend(words)
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+class DecisionPassageIndex:
+    """
+    Passages of the full decision texts (awards, orders, opinions), in a second
+    collection next to the case collection and with the same backend.
+
+    Passage ids are decision_<Identifier>_<n>, numbered across all of a case's
+    decisions; passage 0 records how many the case has, so a case's passages can
+    be found and deleted without metadata filters (which the numpy store lacks).
+    """
+
+    def __init__(self, client, embedding_function, collection_name, missing_collection_errors=(ValueError,)):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        try:
+            self.collection = client.get_collection(name=collection_name, embedding_function=embedding_function)
+        except missing_collection_errors:
+            self.collection = self._create()
+
+    def _create(self):
+        return self.client.create_collection(
+            name=self.collection_name,
+            embedding_function=self.embedding_function,
+            metadata={"description": "Arbitration decision passages"}
+        )
+
+    @staticmethod
+    def _passage_id(identifier, n):
+        return f"decision_{identifier}_{n}"
+
+    def build_passages(self, case_data):
+        """(ids, documents, metadatas) for every passage of every decision of a case"""
+        identifier = case_data.get('Identifier', 'Unknown')
+        ids, documents, metadatas = [], [], []
+        for decision_index, decision in enumerate(case_data.get('Decisions') or []):
+            texts = [decision.get('Content') or ""]
+            texts.extend(opinion.get('Content') or "" for opinion in decision.get('Opinions') or [] if isinstance(opinion, dict))
+            for text in texts:
+                for passage in split_passages(text):
+                    ids.append(self._passage_id(identifier, len(ids)))
+                    documents.append(passage)
+                    metadatas.append({
+                        "case_id": identifier,
+                        "title": case_data.get('Title', 'Unknown'),
+                        "institution": case_data.get('Institution', 'Unknown'),
+                        "decision_key": f"{identifier}#{decision_index}",
+                        "decision_title": decision.get('Title', 'Unknown'),
+                        "decision_type": decision.get('Type', 'Unknown'),
+                        "decision_date": decision.get('Date') or "",
+                        "case_passages": 0
+                    })
+        if metadatas:
+            metadatas[0]["case_passages"] = len(ids)
+        return ids, documents, metadatas
+
+    def indexed(self, identifiers):
+        """The identifiers among these that already have passages"""
+        first_ids = {self._passage_id(identifier, 0): identifier for identifier in identifiers}
+        if not first_ids:
+            return set()
+        found = self.collection.get(ids=list(first_ids), include=[])['ids']
+        return {first_ids[passage_id] for passage_id in found}
+
+    def index_cases(self, cases, batch_size=256):
+        """Add passages for the cases not indexed yet. Returns the number of passages added."""
+        already = self.indexed([case_data.get('Identifier', 'Unknown') for case_data in cases])
+        added = 0
+        for case_data in cases:
+            if case_data.get('Identifier', 'Unknown') in already:
+                continue
+            ids, documents, metadatas = self.build_passages(case_data)
+            with timed("decision_indexing"):
+                for start in range(0, len(ids), batch_size):
+                    stop = start + batch_size
+                    self.collection.add(ids=ids[start:stop], documents=documents[start:stop], metadatas=metadatas[start:stop])
+            added += len(ids)
+        return added
+
+    def delete_case(self, identifier):
+        first = self.collection.get(ids=[self._passage_id(identifier, 0)], include=["metadatas"])
+        if not first['ids']:
+            return 0
+        count = first['metadatas'][0].get("case_passages") or 1
+        self.collection.delete(ids=[self._passage_id(identifier, n) for n in range(count)])
+        return count
+
+    def replace_case(self, case_data):
+        self.delete_case(case_data.get('Identifier', 'Unknown'))
+        return self.index_cases([case_data])
+
+    def reset(self):
+        self.client.delete_collection(self.collection_name)
+        self.collection = self._create()
+
+    def count(self):
+        return self.collection.count()
+
+    def search(self, query, n_results=24, case_ids=None):
+        """
+        Passages most relevant to query, as {"id", "document", "metadata", "distance"}.
+
+        With case_ids, passages from those cases are preferred: the search is
+        widened and their passages are returned first.
+        """
+        total = self.collection.count()
+        if total == 0:
+            return []
+        with timed("query_embedding"):
+            query_embeddings = self.embedding_function([query])
+        n_candidates = min(n_results * 4 if case_ids else n_results, total)
+        with timed("decision_search"):
+            results = self.collection.query(query_embeddings=query_embeddings, n_results=n_candidates,
+                                            include=["documents", "metadatas", "distances"])
+        passages = [
+            {"id": passage_id, "document": document, "metadata": metadata, "distance": distance}
+            for passage_id, document, metadata, distance in zip(
+                results['ids'][0], results['documents'][0], results['metadatas'][0], results['distances'][0])
+        ]
+        if case_ids:
+            wanted = set(case_ids)
+            passages.sort(key=lambda passage: passage['metadata'].get('case_id') not in wanted)
+        return passages[:n_results]
+
+def group_by_decision(passages, max_decisions=6, passages_per_decision=4):
+    """Passages grouped by decision, best decision first, each group in document order"""
+    groups = OrderedDict()
+    for passage in passages:
+        key = passage['metadata']['decision_key']
+        if key not in groups:
+            if len(groups) >= max_decisions:
+                continue
+            groups[key] = []
+        if len(groups[key]) < passages_per_decision:
+            groups[key].append(passage)
+    for group in groups.values():
+        group.sort(key=lambda passage: int(passage['id'].rsplit("_", 1)[1]))
+    return groups
+
+class DecisionSummaryIndex:
+    """
+    Precomputed decision summaries (see summarize_decisions.py) in their own
+    collection, at three levels: summary_<Identifier>_<d>_s<n> per section,
+    summary_<Identifier>_<d> per decision, and summary_<Identifier> per case,
+    whose document is one line per decision so prompts can fetch a case's
+    summaries by id.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def store(self, records, batch_size=256):
+        """Upsert records of {"id", "document", "metadata"}"""
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            self.collection.upsert(
+                ids=[record["id"] for record in batch],
+                documents=[record["document"] for record in batch],
+                metadatas=[record["metadata"] for record in batch]
+            )
+
+    def for_cases(self, identifiers):
+        """Case identifier -> list of its decision summary lines"""
+        found = self.collection.get(ids=[f"summary_{identifier}" for identifier in identifiers], include=["documents", "metadatas"])
+        return {
+            metadata['case_id']: [line for line in document.splitlines() if line.strip()]
+            for document, metadata in zip(found['documents'], found['metadatas'])
+        }
+
+    def count(self):
+        return self.collection.count()
@@ -2,6 +2,9 @@ import torch
 import json
 import logging
 import os
+import shutil
+import argparse
+from datetime import datetime
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
@@ -17,6 +20,11 @@ import accelerate
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# each training run gets its own directory under RUNS_DIR; only a finished
+# adapter is ever promoted into SERVING_DIR (the path app.py loads)
+RUNS_DIR = "./runs/"
+SERVING_DIR = "./model/"
+
 def check_gpu_setup():
     """Verify GPU is available and ready for training."""
     print("GPU SETUP CHECK")
@@ -162,18 +170,152 @@ def setup_deepseek_lora():
     )
     return lora_config
 
-def train_deepseek_model(jsonl_file, output_dir="./model/"):
-    """Train DeepSeek model with safetensors and save to ./model/"""
-    
-    # Create model directory
-    os.makedirs(output_dir, exist_ok=True)
+def create_run_dir(runs_dir=RUNS_DIR, run_id=None):
+    """Create a new versioned run directory, e.g. ./runs/run-20250101-120000/"""
+    run_id = run_id or datetime.now().strftime("run-%Y%m%d-%H%M%S")
+    run_dir = os.path.join(runs_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    return run_dir
+
+def load_run_info(run_dir):
+    """Read run_info.json for a run, or an empty dict if it has none yet."""
+    info_path = os.path.join(run_dir, "run_info.json")
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_run_info(run_dir, **updates):
+    """Merge updates into run_info.json (written via a temp file so it is never half-written)."""
+    info = load_run_info(run_dir)
+    info.update(updates)
+    info_path = os.path.join(run_dir, "run_info.json")
+    tmp_path = info_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, info_path)
+    return info
+
+def find_latest_checkpoint(run_dir):
+    """Return the highest-step complete checkpoint-N directory in a run, or None."""
+    if not os.path.isdir(run_dir):
+        return None
+
+    checkpoints = []
+    for name in os.listdir(run_dir):
+        path = os.path.join(run_dir, name)
+        if not name.startswith("checkpoint-") or not os.path.isdir(path):
+            continue
+        # a checkpoint is only usable once the trainer state has been written
+        if not os.path.exists(os.path.join(path, "trainer_state.json")):
+            continue
+        try:
+            checkpoints.append((int(name.split("-")[-1]), path))
+        except ValueError:
+            continue
+
+    if not checkpoints:
+        return None
+    return max(checkpoints)[1]
+
+def find_resumable_run(runs_dir=RUNS_DIR):
+    """Return the most recent run that has not finished, or None."""
+    if not os.path.isdir(runs_dir):
+        return None
+
+    run_dirs = sorted(
+        (os.path.join(runs_dir, name) for name in os.listdir(runs_dir)),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for run_dir in run_dirs:
+        if os.path.isdir(run_dir) and load_run_info(run_dir).get("status") != "completed":
+            return run_dir
+    return None
+
+def promote_adapter(adapter_dir, serving_dir=SERVING_DIR, keep_versions=2, move=False):
+    """
+    Swap a finished adapter into the serving path.
+
+    Each promotion is copied into its own directory under <serving_dir>.versions/,
+    and serving_dir is a symlink to the current one, replaced by a single rename:
+    a server starting or reloading sees either the previous model or the new
+    one, never a partial copy or a missing path. The newest keep_versions
+    versions are kept for rollback. With move=True, adapter_dir is renamed into
+    the versions directory instead of copied (it must be on the same filesystem).
+
+    Where symlinks can't be created (Windows without developer mode),
+    serving_dir stays a plain directory swapped by two renames, and is briefly
+    missing in between.
+    """
+    serving_dir = os.path.normpath(serving_dir)
+    versions_dir = f"{serving_dir}.versions"
+    os.makedirs(versions_dir, exist_ok=True)
+    version_dir = os.path.join(versions_dir, datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+    if move:
+        os.replace(adapter_dir, version_dir)
+    else:
+        shutil.copytree(adapter_dir, version_dir)
+
+    link_path = f"{serving_dir}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    try:
+        # relative, so the model directory can be moved as a whole
+        os.symlink(os.path.relpath(version_dir, os.path.dirname(serving_dir) or "."), link_path, target_is_directory=True)
+    except OSError as e:
+        logger.warning(f"Cannot create symlinks here ({e}), replacing {serving_dir} by two renames")
+        previous_dir = f"{serving_dir}.previous"
+        shutil.rmtree(previous_dir, ignore_errors=True)
+        if os.path.exists(serving_dir):
+            os.replace(serving_dir, previous_dir)
+        os.replace(version_dir, serving_dir)
+        print(f"Promoted {adapter_dir} -> {serving_dir} (previous model kept at {previous_dir})")
+        return serving_dir
+
+    if os.path.isdir(serving_dir) and not os.path.islink(serving_dir):
+        # a serving directory from before versioning: keep it as a version, once
+        os.replace(serving_dir, os.path.join(versions_dir, "unversioned"))
+    os.replace(link_path, serving_dir)
+    print(f"Promoted {adapter_dir} -> {serving_dir} ({os.path.basename(version_dir)})")
+
+    current = os.path.realpath(serving_dir)
+    # version names are timestamps; "unversioned" sorts as the oldest
+    versions = sorted(os.listdir(versions_dir), key=lambda name: name if name[0].isdigit() else "", reverse=True)
+    for old_dir in (os.path.join(versions_dir, name) for name in versions[keep_versions:]):
+        if os.path.realpath(old_dir) != current:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    return serving_dir
+
+def train_deepseek_model(jsonl_file, serving_dir=SERVING_DIR, runs_dir=RUNS_DIR, run_id=None, resume=True, promote=True):
+    """
+    Train DeepSeek LoRA adapter in its own run directory and promote it to serving_dir.
+
+    With resume=True an unfinished run (the given run_id, or the most recent
+    incomplete run) is continued from its latest checkpoint instead of step zero.
+    """
+    
+    # Pick the run directory: resume an unfinished run or start a new one
+    run_dir = None
+    if run_id:
+        run_dir = create_run_dir(runs_dir, run_id)
+    elif resume:
+        run_dir = find_resumable_run(runs_dir)
+    if run_dir is None:
+        run_dir = create_run_dir(runs_dir)
+
+    resume_checkpoint = find_latest_checkpoint(run_dir) if resume else None
+    adapter_dir = os.path.join(run_dir, "adapter")
     
     # Check GPU availability
     use_gpu = check_gpu_setup()
     
     print("\nSTARTING DEEPSEEK FINE-TUNING")
     print("=" * 50)
-    print(f"Model will be saved to: {output_dir}")
+    print(f"Run directory: {run_dir}")
+    if resume_checkpoint:
+        print(f"Resuming from checkpoint: {resume_checkpoint}")
+    print(f"Adapter will be promoted to: {serving_dir}")
     
     # Load DeepSeek model with safetensors
     model, tokenizer, model_name = setup_deepseek_model(use_gpu)
@@ -211,16 +353,23 @@ def train_deepseek_model(jsonl_file, output_dir="./model/"):
         bf16 = False
         print("Using CPU training settings")
     
+    # CPU steps are slow, so checkpoint more often to lose less on a crash.
+    # Checkpoints of a PEFT model only hold the adapter weights plus optimizer
+    # state for the trainable params, so frequent saves stay cheap.
+    save_steps = 200 if use_gpu else 50
+    
     training_args = TrainingArguments(
-        output_dir=output_dir,
-        overwrite_output_dir=True,
+        output_dir=run_dir,
+        overwrite_output_dir=False,
         num_train_epochs=epochs,
         per_device_train_batch_size=batch_size,
         gradient_accumulation_steps=grad_accum,
         warmup_steps=50,
         logging_steps=10,
-        save_steps=200,
+        save_steps=save_steps,
         save_strategy="steps",
+        save_total_limit=3,
+        save_safetensors=True,
         eval_strategy="no",  # Changed from evaluation_strategy
         load_best_model_at_end=False,
         dataloader_pin_memory=use_gpu,
@@ -256,27 +405,41 @@ def train_deepseek_model(jsonl_file, output_dir="./model/"):
     print(f"Epochs: {epochs}")
     print(f"Device: {'GPU' if use_gpu else 'CPU'}")
     print(f"Precision: {'BF16' if bf16 else 'FP16' if fp16 else 'FP32'}")
-    print(f"Output directory: {output_dir}")
+    print(f"Run directory: {run_dir}")
+    print(f"Checkpoint every {save_steps} steps")
     
     model.print_trainable_parameters()
     
+    save_run_info(
+        run_dir,
+        status="running",
+        base_model=model_name,
+        training_file=os.path.abspath(jsonl_file),
+        started_at=load_run_info(run_dir).get("started_at") or datetime.now().isoformat()
+    )
+    
     # Start training
     print("\nSTARTING TRAINING...")
     if use_gpu:
         print("Monitor GPU usage with: nvidia-smi")
         
     try:
-        trainer.train()
+        trainer.train(resume_from_checkpoint=resume_checkpoint)
         print("Training completed successfully!")
         
     except Exception as e:
         print(f"Training failed: {e}")
+        save_run_info(run_dir, status="failed", error=str(e))
+        latest = find_latest_checkpoint(run_dir)
+        if latest:
+            print(f"Latest checkpoint: {latest}")
+            print("Re-run with the same settings to resume from it.")
         return None
     
-    # Save model and tokenizer
-    print(f"Saving model to {output_dir}...")
-    trainer.save_model(output_dir)
-    tokenizer.save_pretrained(output_dir)
+    # Save adapter and tokenizer into the run directory
+    print(f"Saving adapter to {adapter_dir}...")
+    trainer.save_model(adapter_dir)
+    tokenizer.save_pretrained(adapter_dir)
     
     # Save model info file
     model_info = {
@@ -286,15 +449,21 @@ def train_deepseek_model(jsonl_file, output_dir="./model/"):
         "batch_size": batch_size,
         "learning_rate": 2e-4,
         "lora_rank": 16,
-        "device": "GPU" if use_gpu else "CPU"
+        "device": "GPU" if use_gpu else "CPU",
+        "run_id": os.path.basename(os.path.normpath(run_dir))
     }
     
-    with open(os.path.join(output_dir, "model_info.json"), "w") as f:
+    with open(os.path.join(adapter_dir, "model_info.json"), "w") as f:
         json.dump(model_info, f, indent=2)
     
+    save_run_info(run_dir, status="completed", finished_at=datetime.now().isoformat())
     print("Model saved successfully!")
-    print(f"Model files location: {output_dir}")
-    return output_dir
+    
+    if not promote:
+        print(f"Adapter files location: {adapter_dir}")
+        return adapter_dir
+    
+    return promote_adapter(adapter_dir, serving_dir)
 
 def test_deepseek_model(model_dir):
     """Test the fine-tuned DeepSeek model."""
@@ -369,8 +538,23 @@ def main():
     print("=" * 60)
     
     # Configuration
-    jsonl_file = "arbitration_fine_tuning.jsonl"
-    output_dir = "./model/"
+    parser = argparse.ArgumentParser(description="Fine-tune DeepSeek on arbitration cases")
+    parser.add_argument("--data", default="arbitration_fine_tuning.jsonl", help="training JSONL file")
+    parser.add_argument("--run-id", default=None, help="run to create or resume (default: latest unfinished run)")
+    parser.add_argument("--fresh", action="store_true", help="start a new run instead of resuming")
+    parser.add_argument("--no-promote", action="store_true", help="keep the adapter in the run directory only")
+    parser.add_argument("--promote-run", default=None, help="promote a finished run's adapter and exit")
+    args = parser.parse_args()
+    
+    jsonl_file = args.data
+    
+    if args.promote_run:
+        adapter_dir = os.path.join(RUNS_DIR, args.promote_run, "adapter")
+        if not os.path.isdir(adapter_dir):
+            print(f"No finished adapter found at {adapter_dir}")
+            return
+        promote_adapter(adapter_dir, SERVING_DIR)
+        return
     
     # Check if training file exists
     if not os.path.exists(jsonl_file):
@@ -379,7 +563,12 @@ def main():
         return
     
     # Train model
-    trained_model_dir = train_deepseek_model(jsonl_file, output_dir)
+    trained_model_dir = train_deepseek_model(
+        jsonl_file,
+        run_id=args.run_id,
+        resume=not args.fresh,
+        promote=not args.no_promote
+    )
     
     if trained_model_dir:
         # Test the model
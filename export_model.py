@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from deepseek_model_training import SERVING_DIR, promote_adapter
+from serving_manifest import MANIFEST_FILE, SERVING_DTYPES, load_serving_manifest
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_MODEL = "deepseek-ai/deepseek-coder-1.3b-instruct"
+
+DTYPES = {name: getattr(torch, name) for name in SERVING_DTYPES}
+
+def hash_adapter(adapter_dir):
+    """sha256 over the adapter config and weights, so a manifest pins the exact adapter."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(adapter_dir)):
+        if not (name.startswith("adapter_") and name.endswith((".json", ".safetensors", ".bin"))):
+            continue
+        digest.update(name.encode("utf-8"))
+        with open(os.path.join(adapter_dir, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def resolve_base_model(adapter_dir):
+    """Find the base model an adapter was trained on."""
+    config_path = os.path.join(adapter_dir, "adapter_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            base_model = json.load(f).get("base_model_name_or_path")
+        if base_model:
+            return base_model
+
+    info_path = os.path.join(adapter_dir, "model_info.json")
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as f:
+            base_model = json.load(f).get("base_model")
+        if base_model:
+            return base_model
+
+    return DEFAULT_BASE_MODEL
+
+def list_weight_files(model_dir):
+    """Weight files written by save_pretrained (one file, or the shards of an index)."""
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            return sorted(set(json.load(f)["weight_map"].values()))
+    return [name for name in sorted(os.listdir(model_dir)) if name.endswith(".safetensors")]
+
+def export_merged_model(adapter_dir, output_dir=SERVING_DIR, dtype="float16", max_shard_size="500MB", promote=True):
+    """
+    Merge a LoRA adapter into its base weights and save a serving artifact.
+
+    The result is plain sharded safetensors in the serving dtype, so the server
+    loads it with AutoModelForCausalLM directly and there is no LoRA math left
+    in the forward pass. A serving_manifest.json records where it came from.
+    """
+    from peft import PeftModel
+
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected one of {list(DTYPES)}")
+
+    base_model_name = resolve_base_model(adapter_dir)
+    adapter_hash = hash_adapter(adapter_dir)
+
+    print(f"Loading base model {base_model_name} in {dtype}...")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_name,
+        torch_dtype=DTYPES[dtype],
+        trust_remote_code=True,
+        use_safetensors=True,
+        low_cpu_mem_usage=True
+    )
+
+    print(f"Merging adapter from {adapter_dir}...")
+    model = PeftModel.from_pretrained(base_model, adapter_dir)
+    model = model.merge_and_unload()
+    model.eval()
+
+    tokenizer = AutoTokenizer.from_pretrained(adapter_dir)
+
+    # write next to the destination first, then swap it in by rename
+    staging_dir = os.path.normpath(output_dir) + ".export"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    print(f"Saving merged weights to {staging_dir} (shards of {max_shard_size})...")
+    model.save_pretrained(staging_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(staging_dir)
+
+    manifest = {
+        "format": "merged",
+        "base_model": base_model_name,
+        "adapter_sha256": adapter_hash,
+        "adapter_dir": os.path.abspath(adapter_dir),
+        "dtype": dtype,
+        "weights": list_weight_files(staging_dir),
+        "exported_at": datetime.now().isoformat()
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    if not promote:
+        print(f"Export written to {staging_dir}")
+        return staging_dir
+
+    # the staging dir is renamed into place, not copied again
+    promote_adapter(staging_dir, output_dir, move=True)
+    return output_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter into its base model for serving")
+    parser.add_argument("adapter_dir", help="adapter directory, e.g. ./runs/<run-id>/adapter")
+    parser.add_argument("--output", default=SERVING_DIR, help="serving directory to write")
+    parser.add_argument("--dtype", default="float16", choices=sorted(DTYPES))
+    parser.add_argument("--max-shard-size", default="500MB")
+    parser.add_argument("--no-promote", action="store_true", help="leave the export in a staging directory")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.adapter_dir, "adapter_config.json")):
+        print(f"No adapter found in {args.adapter_dir}")
+        return
+
+    export_dir = export_merged_model(
+        args.adapter_dir,
+        output_dir=args.output,
+        dtype=args.dtype,
+        max_shard_size=args.max_shard_size,
+        promote=not args.no_promote
+    )
+    manifest = load_serving_manifest(export_dir)
+    print(f"Exported {manifest['base_model']} + adapter {manifest['adapter_sha256'][:12]} ({manifest['dtype']})")
+    print(f"Serving artifact: {export_dir}")
+
+if __name__ == "__main__":
+    main()
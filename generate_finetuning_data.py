@@ -3,16 +3,28 @@ import os
 from pathlib import Path
 import tiktoken
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable
+from case_store import CaseStore, stream_cases
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class FineTuningDataGenerator:
-    def __init__(self):
-        """Initialize the fine-tuning data generator."""
+    def __init__(self, summaries_dir: str = None):
+        """
+        Initialize the fine-tuning data generator.
+        
+        summaries_dir: output of summarize_decisions.py; its decision summaries
+        replace the truncated decision content in training examples.
+        """
         self.encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.decision_summaries = {}
+        if summaries_dir and os.path.isdir(summaries_dir):
+            from summarize_decisions import load_progress
+            _, decisions = load_progress(summaries_dir)
+            self.decision_summaries = {key: record["summary"] for key, record in decisions.items()}
+            logger.info(f"Loaded {len(self.decision_summaries)} decision summaries from {summaries_dir}")
         
     def load_documents_from_folder(self, folder_path: str) -> List[Dict[str, Any]]:
         """Load all JSON documents from a folder."""
@@ -30,6 +42,13 @@ class FineTuningDataGenerator:
                 
         return documents
     
+    def load_documents(self, source: str, with_text: bool = True) -> Iterable[Dict[str, Any]]:
+        """Cases from a case store (streamed, see case_store.py) or a folder of JSON files."""
+        if CaseStore.is_store(source):
+            logger.info(f"Reading cases from case store {source}")
+            return stream_cases(source, with_text=with_text)
+        return self.load_documents_from_folder(source)
+    
     def create_training_examples(self, doc: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Create multiple training examples from a single arbitration case."""
         examples = []
@@ -97,7 +116,7 @@ class FineTuningDataGenerator:
         
         # Example 6: Decision-based examples (if decisions exist)
         if "Decisions" in doc and doc["Decisions"]:
-            for decision in doc["Decisions"]:
+            for decision_index, decision in enumerate(doc["Decisions"]):
                 decision_title = decision.get("Title", "")
                 decision_type = decision.get("Type", "")
                 decision_date = decision.get("Date", "").split("T")[0] if decision.get("Date") else "unknown date"
@@ -110,9 +129,10 @@ class FineTuningDataGenerator:
                     ]
                 })
                 
-                # If there's content, create a content-based example (truncated)
-                if decision.get("Content"):
-                    content_preview = decision["Content"][:300] + "..." if len(decision["Content"]) > 300 else decision["Content"]
+                # If there's content, create a content-based example (its precomputed summary, else truncated)
+                summary = self.decision_summaries.get(f"{case_id}#{decision_index}")
+                if summary or decision.get("Content"):
+                    content_preview = summary or (decision["Content"][:300] + "..." if len(decision["Content"]) > 300 else decision["Content"])
                     examples.append({
                         "messages": [
                             {"role": "system", "content": system_msg},
@@ -161,18 +181,20 @@ class FineTuningDataGenerator:
         
         return valid_examples
     
-    def generate_fine_tuning_data(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def generate_fine_tuning_data(self, documents: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Generate all fine-tuning examples from documents."""
         all_examples = []
+        document_count = 0
         
         for doc in documents:
             case_examples = self.create_training_examples(doc)
             all_examples.extend(case_examples)
+            document_count += 1
         
         # Validate all examples
         valid_examples = self.validate_and_filter_examples(all_examples)
         
-        logger.info(f"Generated {len(valid_examples)} valid training examples from {len(documents)} documents")
+        logger.info(f"Generated {len(valid_examples)} valid training examples from {document_count} documents")
         return valid_examples
     
     def save_fine_tuning_file(self, examples: List[Dict[str, Any]], output_file: str = "arbitration_fine_tuning.jsonl"):
@@ -213,24 +235,24 @@ class FineTuningDataGenerator:
 
 def main():
     # Initialize generator
-    generator = FineTuningDataGenerator()
+    generator = FineTuningDataGenerator(summaries_dir="./decision_summaries")
     
-    # Folder containing your JSON files
-    documents_folder = "./case_data_clean"
+    # Case store built by case_store.py, or the folder containing your JSON files
+    documents_source = "./case_data.db" if os.path.exists("./case_data.db") else "./case_data_clean"
     
-    # Load documents
+    # Load documents (streamed one case at a time from a case store)
     print("loading documents...")
-    documents = generator.load_documents_from_folder(documents_folder)
-    
-    if not documents:
-        print(f"No documents found in {documents_folder}")
-        print("Please ensure your JSON files are in the correct folder.")
-        return
+    documents = generator.load_documents(documents_source)
     
     # Generate training examples
     print("Generating training examples...")
     training_examples = generator.generate_fine_tuning_data(documents)
     
+    if not training_examples:
+        print(f"No documents found in {documents_source}")
+        print("Please ensure your JSON files are in the correct folder, or run case_store.py import.")
+        return
+    
     # Preview examples
     generator.preview_examples(training_examples)
     
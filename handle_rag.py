@@ -1,47 +1,172 @@
-import chromadb
 import openai
 import json
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 import os
-from sentence_transformers import SentenceTransformer
+import time
+from itertools import islice
+from concurrent.futures import as_completed
+from vector_store import NumpyVectorClient, SentenceTransformerEmbedding
+from sharded_store import ShardedClient
+from case_stats import CaseStatsStore, LIST_SEPARATOR, join_values
+from case_store import CaseStore, stream_cases
+from decision_passages import DecisionPassageIndex, DecisionSummaryIndex
+from metrics import timed, record_tokens
+from request_profiler import ProfiledThreadPoolExecutor
+from context_builder import ContextBuilder, tiktoken_counter, tiktoken_encoding, CONTEXT_TOKENS
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+_openai_client = None
+
+def get_openai_client():
+    """
+    Shared OpenAI client, created on first use.
+
+    OPENAI_API_KEY and OPENAI_BASE_URL are read from the environment, so the
+    client can be pointed at a local stand-in for load tests.
+    """
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+VECTOR_BACKENDS = ("chroma", "numpy")
+EMBEDDING_BACKENDS = ("torch", "onnx")
+# how often a missing decision summaries collection is looked up again
+SUMMARY_LOOKUP_RETRY_S = 60
 
 class ArbitrationRAGChroma:
-    def __init__(self, collection_name="arbitration_cases", persist_directory="./chroma_db"):
-        """Initialize ChromaDB client and collection"""
+    def __init__(self, collection_name="arbitration_cases", persist_directory="./chroma_db", context_token_budget=1500,
+                 backend="chroma", vector_dtype="float16", shard_by=None, shard_count=4, shard_processes=True,
+                 index_decisions=False, embedding_backend="torch", onnx_model_dir="./onnx_embedder"):
+        """
+        Initialize the vector store client and collection.
+        
+        backend="chroma" uses a ChromaDB PersistentClient; backend="numpy" uses the
+        memory-mapped store in vector_store.py (vector_dtype float16 or int8), which
+        exposes the same collection API.
+        
+        shard_by="institution" or "hash" partitions the collection into shards of that
+        backend, each served by its own worker process (see sharded_store.py).
+        
+        index_decisions=True also indexes passages of the full decision texts in a
+        second collection (see decision_passages.py), used for closing statements.
         
-        # Initialize ChromaDB with persistence
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        embedding_backend="onnx" embeds with the int8 ONNX export in onnx_model_dir
+        (see onnx_embedder.py) instead of the PyTorch model, for every backend.
+        """
         
-        # Initialize embedding model
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Max tokens of case context packed into each prompt (see context_builder.py)
+        self.context_token_budget = context_token_budget
+        self._context_builders = {}
+        
+        # Optional second-stage reranker (see enable_reranker)
+        self.reranker = None
+        self.rerank_candidates = 20
+        
+        if backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown vector backend {backend}, expected one of {VECTOR_BACKENDS}")
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend {embedding_backend}, expected one of {EMBEDDING_BACKENDS}")
+        self.backend = backend
+        self.embedding_model_name = EMBEDDING_MODEL
+        self.onnx_model_dir = onnx_model_dir if embedding_backend == "onnx" else None
+        
+        if backend == "chroma":
+            # imported here so the numpy backend doesn't pay for chromadb's import
+            import chromadb
+            from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction, register_embedding_function
+            if self.onnx_model_dir:
+                # so chroma can check (and rebuild) the embedding function stored with the collection
+                from onnx_embedder import OnnxEmbedding
+                register_embedding_function(OnnxEmbedding)
+            
+        if self.onnx_model_dir:
+            self.embedding_function = self.load_onnx_embedding(self.onnx_model_dir)
+        elif backend == "chroma":
+            # One embedding function shared by the collection and explicit query embedding
+            self.embedding_function = SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
+        else:
+            self.embedding_function = SentenceTransformerEmbedding(EMBEDDING_MODEL)
+        
+        missing_collection_errors = (ValueError,)
+        if shard_by:
+            self.client = ShardedClient(
+                persist_directory,
+                backend=backend,
+                dtype=vector_dtype,
+                shard_by=shard_by,
+                shard_count=shard_count,
+                processes=shard_processes,
+                embedding_model=EMBEDDING_MODEL,
+                onnx_model_dir=self.onnx_model_dir
+            )
+        elif backend == "chroma":
+            # Initialize ChromaDB with persistence
+            self.client = chromadb.PersistentClient(path=persist_directory)
+            # not ValueError: chroma raises that when the collection was built with another embedding function
+            missing_collection_errors = (chromadb.errors.NotFoundError,)
+        else:
+            self.client = NumpyVectorClient(persist_directory, dtype=vector_dtype)
         
         # Create or get collection
         try:
             self.collection = self.client.get_collection(
                 name=collection_name,
-                embedding_function=chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
-                    model_name="all-MiniLM-L6-v2"
-                )
+                embedding_function=self.embedding_function
             )
             print(f"Loaded existing collection: {collection_name}")
             print(f"Current collection size: {self.collection.count()} documents")
-        except (ValueError, chromadb.errors.NotFoundError):
+        except missing_collection_errors:
             # Collection doesn't exist, create it
             self.collection = self.client.create_collection(
                 name=collection_name,
-                embedding_function=chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
-                    model_name="all-MiniLM-L6-v2"
-                ),
+                embedding_function=self.embedding_function,
                 metadata={"description": "Arbitration legal cases database"}
             )
             print(f"🆕 Created new collection: {collection_name}")
+        
+        # Precomputed decision summaries, looked up on first use (see summaries)
+        self.collection_name = collection_name
+        self.missing_collection_errors = missing_collection_errors
+        self._summaries = None
+        self._summaries_checked_at = None
+        
+        # Full decision texts, split into passages (not needed for case search)
+        self.decisions = None
+        if index_decisions:
+            self.decisions = DecisionPassageIndex(
+                self.client, self.embedding_function, f"{collection_name}_decisions", missing_collection_errors
+            )
+            print(f"Decision passages: {self.decisions.count()}")
+        
+        # Facet counts kept up to date on every write (see case_stats.py)
+        self.stats = CaseStatsStore(os.path.join(persist_directory, f"{collection_name}_stats.json"))
+        if not self.stats.exists and self.collection.count() > 0:
+            print("No case statistics found, rebuilding from collection...")
+            self.stats.rebuild(self.collection)
     
-    def add_arbitration_case(self, case_data: Dict):
-        """Add arbitration case from your JSON format to ChromaDB"""
+    @staticmethod
+    def load_onnx_embedding(model_dir):
+        """The ONNX embedder, checked to be an export of EMBEDDING_MODEL that passed validation"""
+        from onnx_embedder import OnnxEmbedding, read_manifest
+        embedder = OnnxEmbedding(model_dir)
+        # vectors in the collection must come from the same model, whatever runs it
+        if embedder.model_name.split("/")[-1] != EMBEDDING_MODEL:
+            raise ValueError(f"{model_dir} is an export of {embedder.model_name}, the collection uses {EMBEDDING_MODEL}")
+        validation = read_manifest(model_dir).get("validation")
+        if validation is None:
+            print(f"⚠️ ONNX embedder in {model_dir} has not been validated (python onnx_embedder.py validate)")
+        elif not validation["passed"]:
+            raise ValueError(f"ONNX embedder in {model_dir} failed validation (min cosine {validation['min_cosine']})")
+        print(f"ONNX embedder: {embedder.model_name}, {'int8' if embedder.quantized else 'float32'}, {embedder.threads} threads")
+        return embedder
+    
+    @staticmethod
+    def build_case_record(case_data: Dict):
+        """Turn a case from your JSON format into (id, document, metadata) for ChromaDB"""
         
         # Extract key information
         identifier = case_data.get('Identifier', 'Unknown')
@@ -56,10 +181,13 @@ class ArbitrationRAGChroma:
         
         # Extract decision information
         decisions_info = []
+        decision_types = []
         if case_data.get('Decisions'):
             for decision in case_data['Decisions']:
                 decision_text = f"{decision.get('Title', 'Unknown')} ({decision.get('Type', 'Unknown')}) - {decision.get('Date', 'Unknown')}"
                 decisions_info.append(decision_text)
+                if decision.get('Type') and decision['Type'] not in decision_types:
+                    decision_types.append(decision['Type'])
         
         decisions_text = '; '.join(decisions_info) if decisions_info else 'No decisions recorded'
         
@@ -84,38 +212,204 @@ Decisions: {decisions_text}
             "case_number": case_number,
             "institution": institution,
             "status": status,
-            "industries": industries,
-            "nationalities": nationalities,
+            "industries": join_values(case_data.get('Industries', [])),
+            "nationalities": join_values(case_data.get('PartyNationalities', [])),
+            "decision_types": join_values(decision_types),
+            "list_separator": LIST_SEPARATOR,
             "source": "Arbitration Database"
         }
         
+        return f"case_{identifier}", document_text, metadata
+    
+    def summary_index(self, create: bool = False) -> Optional[DecisionSummaryIndex]:
+        """The decision summaries collection, or None if it doesn't exist (and create is False)"""
+        name = f"{self.collection_name}_summaries"
+        try:
+            collection = self.client.get_collection(name=name, embedding_function=self.embedding_function)
+        except self.missing_collection_errors:
+            if not create:
+                return None
+            collection = self.client.create_collection(
+                name=name,
+                embedding_function=self.embedding_function,
+                metadata={"description": "Arbitration decision summaries"}
+            )
+        return DecisionSummaryIndex(collection)
+    
+    @property
+    def summaries(self) -> Optional[DecisionSummaryIndex]:
+        """
+        The decision summaries index, if summarize_decisions.py has stored one.
+        While it is missing it is looked up again at most every
+        SUMMARY_LOOKUP_RETRY_S, so summaries stored after startup are picked up.
+        """
+        now = time.monotonic()
+        if self._summaries is None and (self._summaries_checked_at is None or now - self._summaries_checked_at >= SUMMARY_LOOKUP_RETRY_S):
+            self._summaries_checked_at = now
+            self._summaries = self.summary_index()
+        return self._summaries
+    
+    def reset_summary_index(self):
+        """Drop the decision summaries collection, if there is one"""
+        if self.summary_index() is not None:
+            self.client.delete_collection(f"{self.collection_name}_summaries")
+        self._summaries = None
+        self._summaries_checked_at = None
+    
+    def with_decision_summaries(self, cases: List[Dict]) -> List[Dict]:
+        """Copies of cases with their precomputed decision summaries appended as "Summary:" lines"""
+        if self.summaries is None or not cases:
+            return cases
+        try:
+            found = self.summaries.for_cases([case['metadata'].get('case_id') for case in cases])
+        except Exception as e:
+            print(f"Summary lookup error: {str(e)}")
+            return cases
+        return [
+            dict(case, document=case['document'] + "".join(f"\nSummary: {line}" for line in found[case['metadata'].get('case_id')]))
+            if case['metadata'].get('case_id') in found else case
+            for case in cases
+        ]
+    
+    def _get_metadata(self, case_id: str) -> Optional[Dict]:
+        """Stored metadata for a case id, or None if it is not in the collection"""
+        existing = self.collection.get(ids=[case_id], include=["metadatas"])
+        return existing['metadatas'][0] if existing['ids'] else None
+    
+    def add_arbitration_case(self, case_data: Dict):
+        """Add arbitration case from your JSON format to ChromaDB"""
+        
+        case_id, document_text, metadata = self.build_case_record(case_data)
+        
         # Add to ChromaDB
         try:
+            # Chroma ignores adds for existing ids, so skip them (and their embedding) up front
+            if self._get_metadata(case_id) is not None:
+                print(f"Case {metadata['case_id']} already exists, skipping")
+                return
+            
             self.collection.add(
                 documents=[document_text],
                 metadatas=[metadata],
-                ids=[f"case_{identifier}"]
+                ids=[case_id]
+            )
+            self.stats.add(metadata)
+            if self.decisions is not None:
+                self.decisions.index_cases([case_data])
+            print(f"Added Case {metadata['case_id']}: {metadata['title']}")
+        except Exception as e:
+            print(f"❌ Error adding case {metadata['case_id']}: {str(e)}")
+    
+    def upsert_arbitration_case(self, case_data: Dict):
+        """Add a case, or replace it if the same Identifier is already stored"""
+        
+        case_id, document_text, metadata = self.build_case_record(case_data)
+        
+        try:
+            old_metadata = self._get_metadata(case_id)
+            self.collection.upsert(
+                documents=[document_text],
+                metadatas=[metadata],
+                ids=[case_id]
             )
-            print(f"Added Case {identifier}: {title}")
+            self.stats.replace(old_metadata, metadata)
+            if self.decisions is not None:
+                self.decisions.replace_case(case_data)
+            print(f"{'Updated' if old_metadata else 'Added'} Case {metadata['case_id']}: {metadata['title']}")
         except Exception as e:
-            print(f"❌ Error adding case {identifier}: {str(e)}")
+            print(f"❌ Error upserting case {metadata['case_id']}: {str(e)}")
     
-    def load_cases_from_json(self, filename: str):
-        """Load cases from JSON file"""
+    def delete_case(self, identifier: str) -> bool:
+        """Delete a single case by its Identifier"""
+        
+        case_id = f"case_{identifier}"
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            old_metadata = self._get_metadata(case_id)
+            if old_metadata is None:
+                print(f"Case {identifier} not found")
+                return False
             
-            cases_added = 0
+            self.collection.delete(ids=[case_id])
+            self.stats.remove(old_metadata)
+            if self.decisions is not None:
+                self.decisions.delete_case(identifier)
+            print(f"Deleted Case {identifier}")
+            return True
+        except Exception as e:
+            print(f"❌ Error deleting case {identifier}: {str(e)}")
+            return False
+    
+    def add_arbitration_cases(self, cases: List[Dict]) -> Dict:
+        """Add a batch of cases with one existence check and one (batched) embedding call"""
+        
+        records = {}
+        for case_data in cases:
+            case_id, document_text, metadata = self.build_case_record(case_data)
+            records.setdefault(case_id, (document_text, metadata))
+        
+        result = {"added": 0, "skipped": len(cases) - len(records), "errors": []}
+        if not records:
+            return result
+        
+        try:
+            existing = set(self.collection.get(ids=list(records), include=[])['ids'])
+            new_ids = [case_id for case_id in records if case_id not in existing]
+            result["skipped"] += len(existing)
             
-            # Handle both single case and array of cases
-            if isinstance(data, list):
-                for case in data:
-                    self.add_arbitration_case(case)
-                    cases_added += 1
-            else:
-                self.add_arbitration_case(data)
-                cases_added = 1
+            if new_ids:
+                self.collection.add(
+                    documents=[records[case_id][0] for case_id in new_ids],
+                    metadatas=[records[case_id][1] for case_id in new_ids],
+                    ids=new_ids
+                )
+                with self.stats.batch():
+                    for case_id in new_ids:
+                        self.stats.add(records[case_id][1])
+                result["added"] = len(new_ids)
+        except Exception as e:
+            result["errors"].append(f"Error adding batch of {len(records)} cases: {str(e)}")
+        
+        # also covers cases loaded before decision indexing was turned on
+        if self.decisions is not None:
+            try:
+                self.decisions.index_cases(cases)
+            except Exception as e:
+                result["errors"].append(f"Error indexing decisions of {len(cases)} cases: {str(e)}")
+        
+        return result
+    
+    def read_cases_from_json(self, filename: str) -> List[Dict]:
+        """Read a JSON file holding a single case or an array of cases"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else [data]
+    
+    def open_cases(self, source: str):
+        """
+        (case count, iterator of cases) for a JSON file or a case store (see case_store.py).
+        A case store is streamed, and decision texts are only read if decision passages are indexed.
+        """
+        if CaseStore.is_store(source):
+            with CaseStore(source) as store:
+                count = store.count()
+            return count, stream_cases(source, with_text=self.decisions is not None)
+        cases = self.read_cases_from_json(source)
+        return len(cases), iter(cases)
+    
+    def load_cases_from_json(self, filename: str, batch_size: int = 32):
+        """Load cases from a JSON file or a case store"""
+        try:
+            _, cases = self.open_cases(filename)
+            
+            cases_added = 0
+            while True:
+                batch = list(islice(cases, batch_size))
+                if not batch:
+                    break
+                result = self.add_arbitration_cases(batch)
+                cases_added += result["added"]
+                for error in result["errors"]:
+                    print(f"❌ {error}")
                 
             print(f"Successfully loaded {cases_added} cases from {filename}")
             
@@ -124,45 +418,122 @@ Decisions: {decisions_text}
         except json.JSONDecodeError:
             print(f"Invalid JSON format in {filename}")
     
-    def search_cases(self, query: str, n_results: int = 3) -> List[Dict]:
-        """Search for relevant cases using ChromaDB"""
+    def enable_reranker(self, reranker, candidates: int = 20):
+        """Rerank a larger candidate set with a cross-encoder before keeping the top results"""
+        self.reranker = reranker
+        self.rerank_candidates = candidates
+    
+    def search_by_embeddings(self, query_embeddings, n_results: int = 3, include_embeddings: bool = False) -> List[List[Dict]]:
+        """Nearest cases to each of several already computed query embeddings, in one collection call"""
         
-        if self.collection.count() == 0:
+        total_cases = self.collection.count()
+        if total_cases == 0:
             print("No cases in database")
-            return []
+            return [[] for _ in query_embeddings]
         
-        try:
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
+        
+        with timed("chroma_search"):
             results = self.collection.query(
-                query_texts=[query],
-                n_results=min(n_results, self.collection.count())
+                query_embeddings=list(query_embeddings),
+                n_results=min(n_results, total_cases),
+                include=include
             )
+        
+        # Format results, one list per query
+        formatted_results = []
+        for q in range(len(results['documents'])):
+            cases = []
+            for i in range(len(results['documents'][q])):
+                case = {
+                    'document': results['documents'][q][i],
+                    'metadata': results['metadatas'][q][i],
+                    'distance': results['distances'][q][i] if 'distances' in results else None,
+                    'id': results['ids'][q][i]
+                }
+                if include_embeddings:
+                    case['embedding'] = results['embeddings'][q][i]
+                cases.append(case)
+            formatted_results.append(cases)
+        
+        return formatted_results
+    
+    def search_by_embedding(self, query_embedding, n_results: int = 3, include_embeddings: bool = False) -> List[Dict]:
+        """Nearest cases to an already computed query embedding"""
+        return self.search_by_embeddings([query_embedding], n_results, include_embeddings)[0]
+    
+    def search_cases(self, query: str, n_results: int = 3, rerank: bool = True) -> List[Dict]:
+        """Search for relevant cases in the vector store"""
+        
+        use_reranker = rerank and self.reranker is not None
+        n_candidates = max(n_results, self.rerank_candidates) if use_reranker else n_results
+        
+        try:
+            # Embed explicitly so embedding and index search are timed separately
+            with timed("query_embedding"):
+                query_embedding = self.embedding_function([query])[0]
             
-            # Format results
-            formatted_results = []
-            for i in range(len(results['documents'][0])):
-                formatted_results.append({
-                    'document': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None,
-                    'id': results['ids'][0][i]
-                })
+            formatted_results = self.search_by_embedding(query_embedding, n_results=n_candidates)
             
+            if use_reranker and formatted_results:
+                return self.reranker.rerank(query, formatted_results, n_results)
             return formatted_results
             
         except Exception as e:
             print(f"Search error: {str(e)}")
             return []
     
-    def answer_question(self, question: str, model: str = "gpt-3.5-turbo") -> str:
-        """Answer question using retrieved cases with proper citations"""
+    def search_cases_batch(self, queries: List[str], n_results: int = 3) -> List[List[Dict]]:
+        """
+        Candidate cases for many queries: all queries are embedded in one pass
+        and searched with one multi-query collection call. Candidates are not
+        reranked here; see answer_questions.
+        """
+        use_reranker = self.reranker is not None
+        n_candidates = max(n_results, self.rerank_candidates) if use_reranker else n_results
         
-        print(f"\n🔍 Searching ChromaDB for: '{question}'")
+        try:
+            with timed("query_embedding"):
+                query_embeddings = self.embedding_function(list(queries))
+            
+            return self.search_by_embeddings(query_embeddings, n_results=n_candidates)
+            
+        except Exception as e:
+            print(f"Search error: {str(e)}")
+            return [[] for _ in queries]
+    
+    def get_context_builder(self, model: str) -> ContextBuilder:
+        """Context builder counting tokens with the given model's tokenizer"""
+        # one per encoding, not per model name, so arbitrary names can't grow the cache
+        encoding_name = tiktoken_encoding(model).name
+        if encoding_name not in self._context_builders:
+            self._context_builders[encoding_name] = ContextBuilder(tiktoken_counter(model), budget_tokens=self.context_token_budget)
+        return self._context_builders[encoding_name]
+    
+    def answer_question_with_context(self, question: str, model: str = "gpt-3.5-turbo", n_results: int = 3,
+                                     cases: Optional[List[Dict]] = None, history: Optional[List[Dict]] = None) -> Dict:
+        """
+        Answer question using retrieved cases with proper citations.
         
-        # Search for relevant cases
-        relevant_cases = self.search_cases(question, n_results=3)
+        Pass cases to skip retrieval (e.g. cases a conversation session already has),
+        and history (earlier {"question", "answer"} turns) for follow-up questions.
+        
+        Returns the answer along with the cases that made it into the prompt
+        and the number of context tokens used.
+        """
+        
+        if cases is None:
+            print(f"\n🔍 Searching ChromaDB for: '{question}'")
+            
+            # Search for relevant cases
+            relevant_cases = self.search_cases(question, n_results=n_results)
+        else:
+            relevant_cases = cases
         
         if not relevant_cases:
-            return "No relevant cases found in the arbitration database."
+            return {"answer": "No relevant cases found in the arbitration database.", "cases": [], "context_tokens": 0}
         
         print("Most relevant cases found:")
         for i, case in enumerate(relevant_cases, 1):
@@ -172,11 +543,19 @@ Decisions: {decisions_text}
             print(f"      Institution: {meta.get('institution')}")
             print(f"      Status: {meta.get('status')}")
         
-        # Format context for the AI
-        context = "\n\n".join([
-            f"CASE {i+1}:\n{case['document']}\n[Citation Source: Case ID {case['metadata'].get('case_id')}, {case['metadata'].get('institution')}]"
-            for i, case in enumerate(relevant_cases)
-        ])
+        # Pack the best passages into the token budget
+        with timed("context_build"):
+            built = self.get_context_builder(model).build(self.with_decision_summaries(relevant_cases))
+        context = built["text"]
+        CONTEXT_TOKENS.observe(built["tokens"], model=model)
+        print(f"Context: {built['tokens']} tokens from {len(built['cases'])} cases ({built['dropped_passages']} passages dropped)")
+        
+        # Earlier turns of the conversation, so follow-ups like "what about the second one?" make sense
+        conversation = ""
+        if history:
+            conversation = "\nEARLIER IN THIS CONVERSATION:\n" + "\n".join(
+                f"Q: {turn['question']}\nA: {turn['answer']}" for turn in history
+            ) + "\n"
         
         # Create comprehensive prompt
         prompt = f"""You are an expert arbitration database assistant. Answer the question using ONLY the provided case information.
@@ -189,59 +568,85 @@ CITATION REQUIREMENTS:
 
 AVAILABLE CASES:
 {context}
-
+{conversation}
 QUESTION: {question}
 
 Provide a comprehensive answer with proper citations:"""
 
         try:
-            response = openai.ChatCompletion.create(
-                model=model,  # Can swap with fine-tuned model: "ft:gpt-3.5-turbo:org:name:id"
-                messages=[
-                    {"role": "system", "content": "You are an expert arbitration legal assistant. Always provide accurate case citations and only use information from the provided cases. Never make up or hallucinate case information."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=700,
-                temperature=0.1
-            )
+            with timed("openai_completion"):
+                response = get_openai_client().chat.completions.create(
+                    model=model,  # Can swap with fine-tuned model: "ft:gpt-3.5-turbo:org:name:id"
+                    messages=[
+                        {"role": "system", "content": "You are an expert arbitration legal assistant. Always provide accurate case citations and only use information from the provided cases. Never make up or hallucinate case information."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=700,
+                    temperature=0.1
+                )
+            
+            usage = getattr(response, "usage", None)
+            if usage:
+                record_tokens(model, usage.prompt_tokens, usage.completion_tokens)
             
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
             
         except Exception as e:
-            return f"❌ Error generating response: {str(e)}"
+            answer = f"❌ Error generating response: {str(e)}"
+        
+        return {"answer": answer, "cases": built["cases"], "context_tokens": built["tokens"]}
     
-    def get_database_stats(self) -> str:
-        """Get statistics about the loaded cases"""
+    def answer_question(self, question: str, model: str = "gpt-3.5-turbo") -> str:
+        """Answer question using retrieved cases with proper citations"""
+        return self.answer_question_with_context(question, model=model)["answer"]
+    
+    def answer_questions(self, questions: List[str], model: str = "gpt-3.5-turbo", n_results: int = 3,
+                         max_concurrency: int = 4):
+        """
+        Answer many questions, yielding (index, result) as each answer finishes.
         
-        if self.collection.count() == 0:
-            return "Database is empty. Add some cases first!"
+        Retrieval for the whole batch is one embedding pass and one collection
+        call; reranking and completions then run on up to max_concurrency threads.
+        Results have the same shape as answer_question_with_context's.
+        """
+        questions = list(questions)
+        candidates = self.search_cases_batch(questions, n_results=n_results)
         
+        def answer(question, cases):
+            if self.reranker is not None and cases:
+                cases = self.reranker.rerank(question, cases, n_results)
+            return self.answer_question_with_context(question, model=model, n_results=n_results, cases=cases[:n_results])
+        
+        executor = ProfiledThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-answer")
         try:
-            # Get all metadata to analyze
-            all_data = self.collection.get()
-            metadatas = all_data['metadatas']
-            
-            # Analyze statistics
-            total_cases = len(metadatas)
-            institutions = set()
-            statuses = set()
-            case_ids = []
-            
-            for meta in metadatas:
-                institutions.add(meta.get('institution', 'Unknown'))
-                statuses.add(meta.get('status', 'Unknown'))
-                case_ids.append(meta.get('case_id', 'Unknown'))
-            
-            stats = f"""
-                Total Cases: {total_cases}
-                Institutions: {len(institutions)}
-                Case Statuses: {len(statuses)}
-            """
-            
-            return stats
-            
-        except Exception as e:
-            return f"Error getting stats: {str(e)}"
+            futures = {
+                executor.submit(answer, question, cases): index
+                for index, (question, cases) in enumerate(zip(questions, candidates))
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"answer": f"❌ Error generating response: {str(e)}", "cases": [], "context_tokens": 0}
+                yield futures[future], result
+        finally:
+            # a consumer that stops early (e.g. a disconnected client) shouldn't keep paying for completions
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def get_database_stats(self) -> Dict:
+        """Get facet counts for the loaded cases (institution, status, industry, nationality, decision type)"""
+        stats = self.stats.snapshot()
+        if hasattr(self.collection, "shard_counts"):
+            stats["shards"] = self.collection.shard_counts()
+        if self.decisions is not None:
+            stats["decision_passages"] = self.decisions.count()
+        if self.summaries is not None:
+            stats["decision_summaries"] = self.summaries.count()
+        return stats
+    
+    def rebuild_stats(self) -> Dict:
+        """Recount the case statistics from the collection (recovery if the stats file is lost or stale)"""
+        return self.stats.rebuild(self.collection)
     
     def delete_all_cases(self):
         """Clear all cases from the database (use with caution!)"""
@@ -253,11 +658,12 @@ Provide a comprehensive answer with proper citations:"""
             # Recreate empty collection
             self.collection = self.client.create_collection(
                 name=self.collection.name,
-                embedding_function=chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
-                    model_name="all-MiniLM-L6-v2"
-                ),
+                embedding_function=self.embedding_function,
                 metadata={"description": "Arbitration legal cases database"}
             )
+            self.stats.reset()
+            if self.decisions is not None:
+                self.decisions.reset()
             print("🆕 Empty collection recreated")
             
         except Exception as e:
@@ -320,7 +726,7 @@ def test_chromadb_rag():
         rag.add_arbitration_case(case)
     
     # Show database statistics
-    print(rag.get_database_stats())
+    print(json.dumps(rag.get_database_stats(), indent=2))
     
     # Test questions
     test_questions = [
@@ -338,9 +744,9 @@ def test_chromadb_rag():
     print("TESTING CHROMADB CASE RETRIEVAL AND CITATIONS")
     print(f"{'='*70}")
     
-    for question in test_questions:
-        answer = rag.answer_question(question)
-        print(f"\n💬 Answer:\n{answer}")
+    for index, result in rag.answer_questions(test_questions):
+        print(f"\n❓ {test_questions[index]}")
+        print(f"\n💬 Answer:\n{result['answer']}")
         print(f"\n{'-'*70}")
     
     print("\nChromaDB RAG test completed!")
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 2
+# the case collection, and the decision passages and summaries built from its cases
+PARTS = ("cases", "decisions", "summaries")
+
+def _to_bytes_array(text):
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+def _from_bytes_array(array):
+    return array.tobytes().decode("utf-8")
+
+def _checksum(vectors):
+    return hashlib.sha256(vectors.tobytes()).hexdigest()
+
+def _part_collections(rag):
+    collections = {"cases": rag.collection}
+    if rag.decisions is not None:
+        collections["decisions"] = rag.decisions.collection
+    if rag.summaries is not None:
+        collections["summaries"] = rag.summaries.collection
+    return collections
+
+def _read_collection(collection, page_size, dtype):
+    ids, documents, metadatas, embeddings = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    vectors = np.concatenate(embeddings).astype(dtype) if embeddings else np.zeros((0, 0), dtype=dtype)
+    return ids, {"documents": documents, "metadatas": metadatas}, vectors
+
+def export_snapshot(rag, path, page_size=1000, dtype="float32"):
+    """
+    Write every case (ids, documents, metadata, embeddings) to one compressed
+    .npz file, with the decision passages and decision summaries when rag has
+    them. A JSON manifest inside it records the format version, the embedding
+    model and dimension, and each collection's row count and vector checksum.
+    """
+    arrays = {}
+    collections = {}
+    dimension = None
+    for part, collection in _part_collections(rag).items():
+        ids, records, vectors = _read_collection(collection, page_size, dtype)
+        arrays[f"{part}_ids"] = np.array(ids, dtype=str)
+        arrays[f"{part}_records"] = _to_bytes_array(json.dumps(records))
+        arrays[f"{part}_embeddings"] = vectors
+        collections[part] = {"collection": collection.name, "count": len(ids), "vectors_sha256": _checksum(vectors)}
+        if len(vectors):
+            dimension = int(vectors.shape[1])
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT,
+        "created_at": datetime.now().isoformat(),
+        "collection": rag.collection.name,
+        "embedding_model": rag.embedding_model_name,
+        "dimension": dimension,
+        "dtype": dtype,
+        "count": collections["cases"]["count"],
+        "collections": collections
+    }
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, manifest=_to_bytes_array(json.dumps(manifest)), **arrays)
+    os.replace(tmp_path, path)
+    return manifest
+
+def read_manifest(path):
+    with np.load(path, allow_pickle=False) as snapshot:
+        return json.loads(_from_bytes_array(snapshot["manifest"]))
+
+def _read_parts(snapshot, manifest):
+    """{part: (ids, records, vectors)}, checksums verified"""
+    if manifest["format_version"] == 1:
+        # cases only, stored without a prefix
+        stored = {"cases": ("", manifest["vectors_sha256"])}
+    else:
+        stored = {part: (f"{part}_", info["vectors_sha256"]) for part, info in manifest["collections"].items()}
+    parts = {}
+    for part, (prefix, checksum) in stored.items():
+        vectors = snapshot[f"{prefix}embeddings"]
+        if _checksum(vectors) != checksum:
+            raise ValueError(f"Snapshot {part} vectors do not match the manifest checksum")
+        parts[part] = (
+            snapshot[f"{prefix}ids"].tolist(),
+            json.loads(_from_bytes_array(snapshot[f"{prefix}records"])),
+            vectors
+        )
+    return parts
+
+def _add(collection, ids, records, vectors, batch_size):
+    vectors = vectors.astype(np.float32)
+    for start in range(0, len(ids), batch_size):
+        stop = start + batch_size
+        collection.add(
+            ids=ids[start:stop],
+            documents=records["documents"][start:stop],
+            metadatas=records["metadatas"][start:stop],
+            embeddings=vectors[start:stop].tolist()
+        )
+
+def import_snapshot(rag, path, replace=False, batch_size=2000):
+    """
+    Bulk-load a snapshot into rag's collections without re-embedding.
+
+    Refuses snapshots from another embedding model or dimension, and refuses a
+    non-empty collection unless replace=True (which clears it first). Decision
+    passages (when rag indexes them) and decision summaries are replaced with
+    the snapshot's; whatever the snapshot lacks is left empty, to be rebuilt.
+    """
+    with np.load(path, allow_pickle=False) as snapshot:
+        manifest = json.loads(_from_bytes_array(snapshot["manifest"]))
+        if manifest["format_version"] not in (1, SNAPSHOT_FORMAT):
+            raise ValueError(f"Unsupported snapshot format {manifest['format_version']}")
+
+        expected_model = rag.embedding_model_name
+        if manifest["embedding_model"] != expected_model:
+            raise ValueError(f"Snapshot was embedded with {manifest['embedding_model']}, this server uses {expected_model}")
+
+        parts = _read_parts(snapshot, manifest)
+        if manifest["dimension"] is not None:
+            dimension = len(rag.embedding_function(["dimension probe"])[0])
+            if manifest["dimension"] != dimension:
+                raise ValueError(f"Snapshot dimension {manifest['dimension']} does not match embedding dimension {dimension}")
+
+    if rag.collection.count() > 0:
+        if not replace:
+            raise ValueError("Collection is not empty, pass replace=True to overwrite it")
+        rag.delete_all_cases()
+
+    started = time.time()
+    ids, records, vectors = parts["cases"]
+    _add(rag.collection, ids, records, vectors, batch_size)
+    rag.rebuild_stats()
+    print(f"Imported {len(ids)} cases in {time.time() - started:.1f}s")
+
+    if rag.decisions is not None:
+        rag.decisions.reset()
+        if "decisions" in parts:
+            _add(rag.decisions.collection, *parts["decisions"], batch_size)
+            print(f"Imported {len(parts['decisions'][0])} decision passages")
+        else:
+            print("⚠️ No decision passages in the snapshot; load the cases again to index them")
+    elif "decisions" in parts:
+        print("Skipped the snapshot's decision passages (decision indexing is off)")
+
+    # summaries of cases that may no longer match are dropped rather than kept
+    rag.reset_summary_index()
+    if "summaries" in parts:
+        _add(rag.summary_index(create=True).collection, *parts["summaries"], batch_size)
+        print(f"Imported {len(parts['summaries'][0])} decision summaries")
+    else:
+        print("⚠️ No decision summaries in the snapshot; run summarize_decisions.py --store-only to restore them")
+    return manifest
+
+def main():
+    from handle_rag import ArbitrationRAGChroma
+
+    parser = argparse.ArgumentParser(
+        description="Export or import a portable case index snapshot: the cases, plus the decision passages "
+                    "(with --index-decisions) and decision summaries when they exist"
+    )
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("path", help="Snapshot file (.npz)")
+    parser.add_argument("--persist-dir", default=os.getenv("CHROMA_PERSIST_DIR", "./chroma_db"))
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "numpy"])
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Embedding precision on export")
+    parser.add_argument("--replace", action="store_true", help="Clear a non-empty collection before importing")
+    parser.add_argument("--index-decisions", action="store_true",
+                        help="Export/import the decision passage collection too (as the server's INDEX_DECISIONS=1)")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(read_manifest(args.path), indent=2))
+        return
+
+    rag = ArbitrationRAGChroma(persist_directory=args.persist_dir, backend=args.backend, index_decisions=args.index_decisions)
+    if args.command == "export":
+        manifest = export_snapshot(rag, args.path, dtype=args.dtype)
+        print(f"Exported {manifest['count']} cases to {args.path}")
+    else:
+        import_snapshot(rag, args.path, replace=args.replace)
+
+if __name__ == "__main__":
+    main()
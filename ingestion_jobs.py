@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from admission import AdmissionRejected
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CASES_INGESTED = registry.counter(
+    "legaltech_ingestion_cases_total", "Cases processed by background ingestion", ["result"]
+)
+
+class IngestionJob:
+    """Progress of one background load of a case file."""
+
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.total = None
+        self.processed = 0
+        self.added = 0
+        self.skipped = 0
+        self.errors = []
+        self.error_count = 0
+        self.created_at = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    def record_errors(self, errors, keep=20):
+        self.error_count += len(errors)
+        # keep only the most recent messages so a bad file can't grow the job without bound
+        self.errors = (self.errors + errors)[-keep:]
+
+    def to_dict(self):
+        elapsed = None
+        rate = None
+        eta = None
+        if self.started:
+            elapsed = (self.finished or time.time()) - self.started
+            if elapsed > 0 and self.processed:
+                rate = self.processed / elapsed
+                if self.total is not None and self.status == "running":
+                    eta = (self.total - self.processed) / rate
+
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "added": self.added,
+            "skipped": self.skipped,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "cases_per_second": round(rate, 2) if rate else None,
+            "elapsed_s": round(elapsed, 2) if elapsed is not None else None,
+            "eta_s": round(eta, 1) if eta is not None else None,
+            "created_at": self.created_at,
+        }
+
+class IngestionJobManager:
+    """
+    Run case-file loads in a background thread, one job at a time.
+
+    Work is done in small batches. Before each batch the job takes a "bulk"
+    slot from the admission controller, so interactive queries always get the
+    model and embedding capacity first. It also waits while interactive
+    requests are in flight, and an optional max_cases_per_s caps throughput.
+    """
+
+    def __init__(self, rag_system, admission=None, batch_size=16, max_cases_per_s=None, max_interactive_wait_s=2.0, max_jobs_kept=100,
+                 on_finished=None):
+        self.rag_system = rag_system
+        # called with each job once it stops, whatever its status
+        self.on_finished = on_finished
+        self.admission = admission
+        self.batch_size = batch_size
+        self.max_cases_per_s = max_cases_per_s
+        self.max_interactive_wait_s = max_interactive_wait_s
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion")
+
+    def submit(self, filename):
+        job = IngestionJob(filename)
+        with self.lock:
+            self.jobs[job.id] = job
+            # forget the oldest finished jobs
+            while len(self.jobs) > self.max_jobs_kept:
+                oldest_id = next(iter(self.jobs))
+                if self.jobs[oldest_id].status in ("queued", "running"):
+                    break
+                del self.jobs[oldest_id]
+        self.executor.submit(self._run, job)
+        logger.info(f"Queued ingestion job {job.id} for {filename}")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished = time.time()
+        return job
+
+    def _yield_to_interactive(self, job):
+        """Wait (bounded) while interactive requests are running or queued."""
+        if self.admission is None:
+            return
+        waited = 0.0
+        while waited < self.max_interactive_wait_s and self.admission.busy("interactive") > 0:
+            if job.cancel_event.wait(0.05):
+                return
+            waited += 0.05
+
+    def _add_batch(self, job, batch):
+        while not job.cancel_event.is_set():
+            self._yield_to_interactive(job)
+            if self.admission is None:
+                return self.rag_system.add_arbitration_cases(batch)
+            try:
+                with self.admission.admit("bulk"):
+                    return self.rag_system.add_arbitration_cases(batch)
+            except AdmissionRejected as e:
+                # no free slot for background work right now, try again shortly
+                job.cancel_event.wait(min(e.retry_after, 5))
+        return None
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            return
+
+        job.status = "running"
+        job.started = time.time()
+        try:
+            job.total, cases = self.rag_system.open_cases(job.filename)
+
+            while not job.cancel_event.is_set():
+                batch_started = time.time()
+                batch = list(islice(cases, self.batch_size))
+                if not batch:
+                    break
+                result = self._add_batch(job, batch)
+                if result is None:
+                    break
+
+                job.processed += len(batch)
+                job.added += result["added"]
+                job.skipped += result["skipped"]
+                job.record_errors(result["errors"])
+                CASES_INGESTED.inc(result["added"], result="added")
+                CASES_INGESTED.inc(result["skipped"], result="skipped")
+
+                if self.max_cases_per_s:
+                    min_duration = len(batch) / self.max_cases_per_s
+                    remaining = min_duration - (time.time() - batch_started)
+                    if remaining > 0:
+                        job.cancel_event.wait(remaining)
+
+            job.status = "cancelled" if job.processed < job.total else "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.record_errors([str(e)])
+            logger.error(f"Ingestion job {job.id} failed: {str(e)}")
+        finally:
+            job.finished = time.time()
+            logger.info(f"Ingestion job {job.id} {job.status}: {job.added} added, {job.skipped} skipped, {job.error_count} errors")
+            if self.on_finished is not None:
+                try:
+                    self.on_finished(job)
+                except Exception as e:
+                    logger.error(f"Ingestion job {job.id} finish hook failed: {str(e)}")
@@ -0,0 +1,401 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# ----------------------------
+# synthetic case corpus
+# ----------------------------
+INSTITUTIONS = [
+    "ICSID - International Centre for Settlement of Investment Disputes",
+    "PCA - Permanent Court of Arbitration",
+    "ICC - International Chamber of Commerce",
+    "SCC - Arbitration Institute of the Stockholm Chamber of Commerce",
+]
+STATUSES = ["Pending", "Decided in favor of investor", "Decided in favor of State", "Settled", "Discontinued"]
+INDUSTRIES = ["Energy", "Electric Power", "Mining", "Banking institutions", "Telecommunications", "Construction", "Oil and gas"]
+COUNTRIES = ["Argentina", "Spain", "Germany", "Bahrain", "Iran", "Canada", "Venezuela", "Egypt", "India", "Peru"]
+DECISION_TYPES = ["Award (Final)", "Procedural Order", "Decision on Jurisdiction", "Decision on Annulment"]
+
+def make_synthetic_case(index, rng):
+    """One case in the same shape as the files in ./case_data_clean"""
+    claimant, respondent = rng.sample(COUNTRIES, 2)
+    institution = rng.choice(INSTITUTIONS)
+    prefix = institution.split(" - ")[0]
+    decisions = [
+        {
+            "Title": f"{decision_type} {n + 1}",
+            "Type": decision_type,
+            "Date": f"20{rng.randint(10, 24)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T00:00:00Z",
+            "Opinions": [],
+            "Content": f"{decision_type} in the dispute between a {claimant} investor and {respondent}. " * 5
+        }
+        for n, decision_type in enumerate(rng.sample(DECISION_TYPES, rng.randint(0, 2)))
+    ]
+    return {
+        "Identifier": f"SYN-{index:06d}",
+        "Title": f"{claimant} Holdings {index} v. {respondent}",
+        "CaseNumber": f"{prefix} Case No. {2000 + index % 25}/{index}",
+        "Industries": rng.sample(INDUSTRIES, 2),
+        "Status": rng.choice(STATUSES),
+        "PartyNationalities": [claimant, respondent],
+        "Institution": institution,
+        "RulesOfArbitration": [f"{prefix} Arbitration Rules"],
+        "ApplicableTreaties": [f"{claimant}-{respondent} BIT"],
+        "Decisions": decisions
+    }
+
+def make_questions(cases, rng, count=200):
+    templates = [
+        "What is case {Identifier} about?",
+        "Which institution handled the {Title} case?",
+        "What was the outcome of {Title}?",
+        "Tell me about cases involving {PartyNationalities[0]}",
+        "Which cases used {RulesOfArbitration[0]}?",
+    ]
+    return [rng.choice(templates).format(**rng.choice(cases)) for _ in range(count)]
+
+# ----------------------------
+# tiny random-weight causal LM
+# ----------------------------
+def build_tiny_model(model_dir, corpus_texts, vocab_size=2000, seed=0):
+    """
+    Save a 2-layer random Llama and a BPE tokenizer trained on the synthetic corpus.
+
+    It loads through the same AutoModelForCausalLM/AutoTokenizer path as the real
+    model, so the server code under test is unchanged; only the weights are tiny.
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    special_tokens = ["<unk>", "<|begin_of_sentence|>", "<|endoftext|>"]
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=special_tokens,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(corpus_texts, trainer)
+
+    hf_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="<unk>",
+        bos_token="<|begin_of_sentence|>",
+        eos_token="<|endoftext|>",
+        pad_token="<|endoftext|>"
+    )
+    hf_tokenizer.save_pretrained(model_dir)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(hf_tokenizer),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=4096,
+        bos_token_id=hf_tokenizer.bos_token_id,
+        eos_token_id=hf_tokenizer.eos_token_id,
+        pad_token_id=hf_tokenizer.pad_token_id
+    )
+    LlamaForCausalLM(config).save_pretrained(model_dir, safe_serialization=True)
+    return model_dir
+
+# ----------------------------
+# fake upstream servers
+# ----------------------------
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            body = {}
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        status, payload = self.server.respond(self.path, body)
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def fake_openai_response(path, body):
+    if not path.rstrip("/").endswith("/chat/completions"):
+        return 404, {"error": {"message": f"Unknown path {path}"}}
+    prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+    answer = "Based on the provided cases [Case ID: SYN-000000, Institution: ICSID], the answer is synthetic."
+    return 200, {
+        "id": "chatcmpl-loadtest",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(answer.split()),
+            "total_tokens": len(prompt.split()) + len(answer.split())
+        }
+    }
+
+def fake_tavily_response(path, body):
+    query = body.get("query", "")
+    return 200, {
+        "query": query,
+        "content": f"Synthetic search context for '{query}'. The tribunal found jurisdiction under the BIT.",
+        "results": [{"title": "Synthetic result", "url": "http://localhost/result", "content": "Synthetic snippet."}]
+    }
+
+def start_fake_server(respond, latency=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstreamHandler)
+    server.daemon_threads = True
+    server.respond = respond
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# ----------------------------
+# app under test
+# ----------------------------
+LAUNCHER = """
+import os
+import app
+
+app.initialize_rag()
+seed_file = os.environ.get("LOAD_TEST_SEED_FILE")
+if seed_file and app.rag_system.collection.count() == 0:
+    app.rag_system.load_cases_from_json(seed_file)
+app.app.run(host="127.0.0.1", port=int(os.environ["LOAD_TEST_PORT"]), threaded=True)
+"""
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(env, log_path):
+    log_file = open(log_path, "w", encoding="utf-8")
+    process = subprocess.Popen(
+        [sys.executable, "-c", LAUNCHER],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT
+    )
+    return process, log_file
+
+def wait_for_app(base_url, process, expected_cases, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} during startup")
+        try:
+            response = requests.get(f"{base_url}/openai/stats", timeout=5)
+            if response.ok and response.json().get("total_cases", 0) >= expected_cases:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"App was not ready after {timeout}s")
+
+# ----------------------------
+# load generation
+# ----------------------------
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def run_scenario(base_url, name, path, make_payload, concurrency, total_requests, timeout=120):
+    """Send total_requests POSTs with `concurrency` workers and summarise latency and throughput."""
+    session_local = threading.local()
+
+    def send(i):
+        if not hasattr(session_local, "session"):
+            session_local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session_local.session.post(f"{base_url}{path}", json=make_payload(i), timeout=timeout)
+            status = response.status_code
+        except requests.RequestException:
+            status = "error"
+        return status, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(total_requests)))
+    duration = time.perf_counter() - started
+
+    # /openai/load-cases answers 202 once the job is queued
+    latencies = [latency for status, latency in results if isinstance(status, int) and 200 <= status < 300]
+    status_counts = {}
+    for status, _ in results:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+
+    return {
+        "scenario": name,
+        "path": path,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "ok": len(latencies),
+        "status_counts": status_counts,
+        "duration_s": duration,
+        "rps": len(latencies) / duration if duration else None,
+        "latency_mean_s": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p90_s": percentile(latencies, 90),
+        "latency_p99_s": percentile(latencies, 99),
+        "latency_max_s": max(latencies) if latencies else None,
+    }
+
+def print_report(results):
+    print("\nLOAD TEST RESULTS")
+    print("=" * 86)
+    print(f"{'scenario':<14}{'conc':>6}{'ok/req':>12}{'rps':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for r in results:
+        fmt = lambda v: f"{v * 1000:.0f}ms" if v is not None else "-"
+        print(
+            f"{r['scenario']:<14}{r['concurrency']:>6}{r['ok']:>6}/{r['requests']:<5}"
+            f"{(r['rps'] or 0):>10.1f}{fmt(r['latency_p50_s']):>10}{fmt(r['latency_p90_s']):>10}"
+            f"{fmt(r['latency_p99_s']):>10}{fmt(r['latency_max_s']):>10}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the Flask API against local stand-ins")
+    parser.add_argument("--cases", type=int, default=500, help="synthetic cases seeded into the index")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and concurrency level")
+    parser.add_argument("--scenarios", nargs="+", default=["openai_query", "query", "query_web", "query_rag", "load_cases"],
+                        choices=["openai_query", "query", "query_web", "query_rag", "load_cases"])
+    parser.add_argument("--load-batch", type=int, default=20, help="cases per /openai/load-cases request")
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="seconds added by the fake OpenAI server")
+    parser.add_argument("--tavily-latency", type=float, default=0.3, help="seconds added by the fake Tavily server")
+    parser.add_argument("--startup-timeout", type=int, default=900)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write results JSON here")
+    parser.add_argument("--keep-temp", action="store_true", help="keep the temp dir (index, model, server log)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="legaltech-loadtest-")
+    print(f"Working directory: {work_dir}")
+
+    cases = [make_synthetic_case(i, rng) for i in range(args.cases)]
+    seed_file = os.path.join(work_dir, "seed_cases.json")
+    with open(seed_file, "w", encoding="utf-8") as f:
+        json.dump(cases, f)
+
+    print("Building tiny random-weight model...")
+    model_dir = build_tiny_model(
+        os.path.join(work_dir, "model"),
+        [json.dumps(case) for case in cases] + make_questions(cases, rng),
+        seed=args.seed
+    )
+
+    openai_server, openai_url = start_fake_server(fake_openai_response, args.openai_latency)
+    tavily_server, tavily_url = start_fake_server(fake_tavily_response, args.tavily_latency)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        MODEL_PATH=model_dir,
+        CHROMA_PERSIST_DIR=os.path.join(work_dir, "chroma_db"),
+        OPENAI_BASE_URL=f"{openai_url}/v1",
+        OPENAI_API_KEY="load-test",
+        TAVILY_API_URL=f"{tavily_url}/search",
+        TAVILY_API_KEY="load-test",
+        LOAD_TEST_SEED_FILE=seed_file,
+        LOAD_TEST_PORT=str(port)
+    )
+
+    log_path = os.path.join(work_dir, "server.log")
+    print(f"Starting app on {base_url} (log: {log_path}), seeding {args.cases} cases...")
+    process, log_file = start_app(env, log_path)
+
+    results = []
+    try:
+        wait_for_app(base_url, process, args.cases, args.startup_timeout)
+        questions = make_questions(cases, rng, count=max(args.requests, 200))
+
+        # each load-cases request gets its own file of new cases
+        batch_counter = itertools.count()
+        batch_lock = threading.Lock()
+
+        def load_cases_payload(_):
+            with batch_lock:
+                batch = next(batch_counter)
+            batch_cases = [make_synthetic_case(args.cases + batch * args.load_batch + i, random.Random(batch)) for i in range(args.load_batch)]
+            path = os.path.join(work_dir, f"load_batch_{batch}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(batch_cases, f)
+            return {"filename": path}
+
+        scenarios = {
+            "openai_query": ("/openai/query", lambda i: {"question": questions[i % len(questions)]}),
+            "query": ("/query", lambda i: {"question": questions[i % len(questions)]}),
+            "query_web": ("/query", lambda i: {"question": questions[i % len(questions)], "use_webscraping": True}),
+            "query_rag": ("/query", lambda i: {"question": questions[i % len(questions)], "use_rag": True}),
+            "load_cases": ("/openai/load-cases", load_cases_payload),
+        }
+
+        for name in args.scenarios:
+            path, make_payload = scenarios[name]
+            for concurrency in args.concurrency:
+                print(f"Running {name} at concurrency {concurrency}...")
+                results.append(run_scenario(base_url, name, path, make_payload, concurrency, args.requests))
+
+        print_report(results)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({
+                    "created_at": datetime.now().isoformat(),
+                    "config": vars(args),
+                    "results": results
+                }, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log_file.close()
+        openai_server.shutdown()
+        tavily_server.shutdown()
+        if args.keep_temp:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
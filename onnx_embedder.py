@@ -0,0 +1,320 @@
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from metrics import timed
+
+MANIFEST = "manifest.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+# the sentence-transformers tokenizer inputs, in the order the graph takes them
+TOKENIZER_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+def read_manifest(model_dir):
+    with open(os.path.join(model_dir, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_manifest(model_dir, manifest):
+    path = os.path.join(model_dir, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def export_onnx(model_name, output_dir, quantize=True, opset=17):
+    """
+    Export a sentence-transformers model to ONNX, mean pooling and L2
+    normalisation included, so the graph returns the same vectors as
+    SentenceTransformer.encode(..., normalize_embeddings=True). With quantize,
+    the weights of the MatMul/Gemm ops are also dynamically quantized to int8
+    (activations stay float and are quantized per batch at run time).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    tokenizer = model.tokenizer
+    encoder = model[0].auto_model.eval()
+
+    class PooledEncoder(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = tokenizer(["dimension probe", "a somewhat longer sentence to trace the export with"], padding=True, return_tensors="pt")
+    input_names = [name for name in TOKENIZER_INPUTS if name in sample]
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            PooledEncoder(encoder),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["embeddings"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names}, "embeddings": {0: "batch"}},
+            opset_version=opset,
+            dynamo=False
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+
+    manifest = {
+        "model_name": model_name,
+        "max_length": model.max_seq_length,
+        "dimension": len(model.encode(["dimension probe"])[0]),
+        "inputs": input_names,
+        "quantized": quantize,
+        "opset": opset,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "intra_op_threads": None,
+        "validation": None
+    }
+    _write_manifest(output_dir, manifest)
+    return manifest
+
+def _session(path, threads):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    # one graph runs at a time per call; parallelism comes from the intra-op pool
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+class OnnxEmbedding:
+    """
+    Embeddings from a model exported by export_onnx, run with onnxruntime on CPU.
+    Implements Chroma's embedding function interface, so it can be passed wherever
+    SentenceTransformerEmbedding or Chroma's SentenceTransformerEmbeddingFunction is.
+
+    Inputs are tokenized once, sorted by length and batched, so each batch is
+    only padded to its own longest text; results come back in input order.
+    The intra-op thread count defaults to the one tune_threads picked.
+    """
+
+    def __init__(self, model_dir, threads=None, batch_size=32, quantized=True):
+        from transformers import AutoTokenizer
+        manifest = read_manifest(model_dir)
+        self.model_dir = model_dir
+        self.model_name = manifest["model_name"]
+        self.max_length = manifest["max_length"]
+        self.dimension = manifest["dimension"]
+        self.input_names = manifest["inputs"]
+        self.batch_size = batch_size
+        self.threads = threads or manifest.get("intra_op_threads") or os.cpu_count() or 1
+        self.quantized = quantized and manifest["quantized"]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.pad_token_id = self.tokenizer.pad_token_id or 0
+        self.session = _session(os.path.join(model_dir, INT8_FILE if self.quantized else FP32_FILE), self.threads)
+
+    def _batch(self, encoded, indices):
+        longest = max(len(encoded["input_ids"][i]) for i in indices)
+        feed = {}
+        for name in self.input_names:
+            pad = self.pad_token_id if name == "input_ids" else 0
+            values = np.full((len(indices), longest), pad, dtype=np.int64)
+            for row, i in enumerate(indices):
+                tokens = encoded[name][i]
+                values[row, :len(tokens)] = tokens
+            feed[name] = values
+        return feed
+
+    def embed(self, texts):
+        """float32 array of normalised embeddings, one row per text"""
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return embeddings
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        order = np.argsort([len(ids) for ids in encoded["input_ids"]], kind="stable")
+        for start in range(0, len(texts), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            embeddings[indices] = self.session.run(["embeddings"], self._batch(encoded, indices))[0]
+        return embeddings
+
+    def __call__(self, input):
+        with timed("onnx_embedding"):
+            return self.embed(input).tolist()
+
+    # Chroma's EmbeddingFunction interface: chroma (>= 1.0) stores the name and
+    # config with a collection and checks them when the collection is reopened.
+    # The class has to be registered with chromadb first (see handle_rag.py).
+    @staticmethod
+    def name():
+        return "onnx_sentence_transformer"
+
+    def get_config(self):
+        return {"model_dir": self.model_dir, "batch_size": self.batch_size, "quantized": self.quantized}
+
+    @staticmethod
+    def build_from_config(config):
+        return OnnxEmbedding(config["model_dir"], batch_size=config.get("batch_size", 32), quantized=config.get("quantized", True))
+
+    @staticmethod
+    def validate_config(config):
+        return
+
+    def validate_config_update(self, old_config, new_config):
+        return
+
+    def is_legacy(self):
+        return False
+
+    def default_space(self):
+        # the vectors are normalised, like SentenceTransformerEmbeddingFunction's
+        return "cosine"
+
+    def supported_spaces(self):
+        return ["cosine", "l2", "ip"]
+
+def _texts_per_second(embedder, texts):
+    started = time.perf_counter()
+    embedder(texts)
+    return len(texts) / (time.perf_counter() - started)
+
+def tune_threads(model_dir, texts, candidates=None):
+    """
+    Time the model on texts at each intra-op thread count and record the
+    fastest in the manifest. Returns {threads: texts per second}.
+    """
+    cpus = os.cpu_count() or 1
+    if candidates is None:
+        candidates = sorted({1, 2, 4, 8, 16, cpus} & set(range(1, cpus + 1)))
+    results = {}
+    for threads in candidates:
+        embedder = OnnxEmbedding(model_dir, threads=threads)
+        embedder(texts[:embedder.batch_size])  # warm-up
+        results[threads] = round(_texts_per_second(embedder, texts), 1)
+        print(f"  {threads:>3} threads: {results[threads]} texts/s")
+    manifest = read_manifest(model_dir)
+    manifest["intra_op_threads"] = max(results, key=results.get)
+    _write_manifest(model_dir, manifest)
+    return results
+
+def validate(model_dir, texts, min_cosine=0.98):
+    """
+    Compare the ONNX embeddings with the original sentence-transformers model
+    on texts, record the result in the manifest and return it. Both are
+    normalised, so the cosine is the row-wise dot product.
+    """
+    from vector_store import SentenceTransformerEmbedding
+    embedder = OnnxEmbedding(model_dir)
+    reference = SentenceTransformerEmbedding(embedder.model_name, device="cpu")
+
+    started = time.perf_counter()
+    expected = np.asarray(reference(texts), dtype=np.float32)
+    reference_s = time.perf_counter() - started
+    started = time.perf_counter()
+    actual = embedder.embed(texts)
+    onnx_s = time.perf_counter() - started
+
+    cosines = (expected * actual).sum(axis=1)
+    # agreement of the nearest neighbours within the sample, the thing retrieval depends on
+    neighbours = []
+    for vectors in (expected, actual):
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        neighbours.append(similarities.argmax(axis=1))
+    same_neighbour = (neighbours[0] == neighbours[1]).mean()
+    result = {
+        "samples": len(texts),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "min_cosine": round(float(cosines.min()), 5),
+        "nearest_neighbour_agreement": round(float(same_neighbour), 4),
+        "reference_texts_per_s": round(len(texts) / reference_s, 1),
+        "onnx_texts_per_s": round(len(texts) / onnx_s, 1),
+        "min_cosine_required": min_cosine,
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+    manifest = read_manifest(model_dir)
+    manifest["validation"] = result
+    _write_manifest(model_dir, manifest)
+    return result
+
+def _iter_cases(source):
+    from case_store import CaseStore, stream_cases
+    if CaseStore.is_store(source):
+        yield from stream_cases(source, with_text=True)
+        return
+    paths = sorted(glob.glob(os.path.join(source, "*.json"))) if os.path.isdir(source) else [source]
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data if isinstance(data, list) else [data]
+
+def sample_texts(source, n_samples=256, seed=0):
+    """
+    A fixed random sample of what actually gets embedded: case documents (as
+    built for the case collection) and decision passages, about half each.
+    """
+    from decision_passages import split_passages
+    from handle_rag import ArbitrationRAGChroma
+
+    documents, passages = [], []
+    for case_data in _iter_cases(source):
+        documents.append(ArbitrationRAGChroma.build_case_record(case_data)[1])
+        for decision in case_data.get('Decisions') or []:
+            passages.extend(split_passages(decision.get('Content') or ""))
+    rng = random.Random(seed)
+    passages = rng.sample(passages, min(len(passages), n_samples // 2))
+    documents = rng.sample(documents, min(len(documents), n_samples - len(passages)))
+    return documents + passages
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model to int8 ONNX, tune it and check it against the original")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export, quantize, tune threads and validate")
+    export_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    export_parser.add_argument("--no-quantize", action="store_true", help="keep float32 weights")
+    subparsers.add_parser("tune", help="re-pick the intra-op thread count on this machine")
+    subparsers.add_parser("validate", help="compare with the original model on sample cases")
+    subparsers.add_parser("info", help="print the manifest")
+    for name, sub in subparsers.choices.items():
+        sub.add_argument("--dir", default=os.getenv("ONNX_EMBEDDER_DIR", "./onnx_embedder"))
+        if name != "info":
+            sub.add_argument("--cases", default=os.getenv("CASE_STORE", "./case_data.db"), help="case store, JSON file or folder of case JSON files")
+            sub.add_argument("--samples", type=int, default=256)
+            sub.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(read_manifest(args.dir), indent=2))
+        return
+
+    if args.command == "export":
+        started = time.time()
+        manifest = export_onnx(args.model, args.dir, quantize=not args.no_quantize)
+        print(f"Exported {manifest['model_name']} ({'int8' if manifest['quantized'] else 'float32'}) to {args.dir} in {time.time() - started:.1f}s")
+
+    texts = sample_texts(args.cases, args.samples)
+    if not texts:
+        raise SystemExit(f"No cases found in {args.cases}")
+    if args.command in ("export", "tune"):
+        print(f"Tuning intra-op threads on {len(texts)} texts:")
+        tune_threads(args.dir, texts)
+        print(f"Using {read_manifest(args.dir)['intra_op_threads']} threads")
+    if args.command in ("export", "validate"):
+        result = validate(args.dir, texts, min_cosine=args.min_cosine)
+        print(json.dumps(result, indent=2))
+        if not result["passed"]:
+            raise SystemExit(f"Minimum cosine {result['min_cosine']} is below {args.min_cosine}; don't serve with this export")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def frame_label(frame):
+    """'torch/nn/modules/module.py:_call_impl' style label for one stack frame."""
+    path = frame.f_code.co_filename.replace("\\", "/")
+    # keep library paths short but recognisable (torch/..., chromadb/..., httpx/...)
+    if "site-packages/" in path:
+        path = path.split("site-packages/", 1)[1]
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{frame.f_code.co_name}"
+
+# thread id -> the sampler profiling the work that thread is doing
+_samplers_by_thread = {}
+_samplers_lock = threading.Lock()
+
+def current_sampler():
+    """The sampler of the request the calling thread is working for, if it is being profiled."""
+    return _samplers_by_thread.get(threading.get_ident())
+
+class StackSampler:
+    """
+    Sample the Python stacks of one request's threads from a background thread.
+
+    Every `interval` seconds the stacks of the request thread, and of any pool
+    threads currently running tasks it submitted (see ProfiledThreadPoolExecutor),
+    are walked and counted in "folded" form (root;caller;callee), which is what
+    flamegraph.pl, speedscope and similar tools read. Each stack is rooted at
+    its thread's name, so retrieval or Tavily calls show up under their pool.
+    Native code (torch ops, tokenizers, chromadb's Rust core) shows up as time
+    in its Python caller.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.thread_ids = {thread_id}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self.started_at = None
+        self.duration = 0.0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        with _samplers_lock:
+            _samplers_by_thread[self.thread_id] = self
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stop.is_set():
+            return self.samples
+        self._stop.set()
+        self._thread.join()
+        with _samplers_lock:
+            for thread_id in list(self.thread_ids):
+                if _samplers_by_thread.get(thread_id) is self:
+                    del _samplers_by_thread[thread_id]
+            self.thread_ids = set()
+        self.duration = time.perf_counter() - self.started_at
+        return self.samples
+
+    def wrap(self, fn):
+        """fn, sampled as part of this profile while it runs on another thread"""
+        def run(*args, **kwargs):
+            thread_id = threading.get_ident()
+            with _samplers_lock:
+                attach = not self._stop.is_set()
+                if attach:
+                    self.thread_ids.add(thread_id)
+                    _samplers_by_thread[thread_id] = self
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if attach:
+                    with _samplers_lock:
+                        self.thread_ids.discard(thread_id)
+                        if _samplers_by_thread.get(thread_id) is self:
+                            del _samplers_by_thread[thread_id]
+        return run
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with _samplers_lock:
+                thread_ids = list(self.thread_ids)
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                root = "request" if thread_id == self.thread_id else names.get(thread_id, "thread")
+                self.samples[";".join([f"[{root}]"] + stack[::-1])] += 1
+            self.sample_count += 1
+
+class ProfiledThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks are profiled along with the request that submitted them."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        sampler = current_sampler()
+        if sampler is not None:
+            fn = sampler.wrap(fn)
+        return super().submit(fn, *args, **kwargs)
+
+class ProfileStore:
+    """Folded-stack profiles on disk, newest kept, oldest pruned past max_profiles."""
+
+    def __init__(self, directory="./profiles", max_profiles=200):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def save(self, sampler, meta, profile_id=None):
+        profile_id = profile_id or self.new_id()
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, f"{profile_id}.folded"), "w", encoding="utf-8") as f:
+            for stack, count in sampler.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        meta = dict(
+            meta,
+            id=profile_id,
+            created_at=datetime.now().isoformat(),
+            duration_s=sampler.duration,
+            samples=sampler.sample_count,
+            interval_s=sampler.interval
+        )
+        with open(os.path.join(self.directory, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        self._prune()
+        return profile_id
+
+    def _prune(self):
+        with self.lock:
+            profiles = self.list()
+            for meta in profiles[self.max_profiles:]:
+                for ext in (".folded", ".json"):
+                    try:
+                        os.remove(os.path.join(self.directory, meta["id"] + ext))
+                    except OSError:
+                        pass
+
+    def list(self):
+        """Metadata of stored profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda meta: meta.get("created_at", ""), reverse=True)
+
+    def folded_path(self, profile_id):
+        """Path of a profile's .folded file, or None for unknown/invalid ids."""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.folded")
+        return path if os.path.exists(path) else None
+
+def should_profile(requested, sample_rate):
+    """Profile when explicitly requested by an admin, or for a random sample of requests."""
+    return requested or (sample_rate > 0 and random.random() < sample_rate)
@@ -0,0 +1,144 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from sentence_transformers import CrossEncoder
+
+from metrics import registry, timed, record_cache
+
+RERANK_SKIPPED = registry.counter(
+    "legaltech_rerank_skipped_total", "Rerank passes skipped to protect latency", ["reason"]
+)
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# a case-sized pair for timing the model at startup (same shape as build_case_record's documents)
+CALIBRATION_QUERY = "investment treaty arbitration over an expropriated mining concession"
+CALIBRATION_DOCUMENT = """Case ID: ICSID-ARB-00-0
+Title: Example Mining Corporation v. Republic of Example
+Case Number: ICSID Case No. ARB/00/0
+Institution: ICSID - International Centre for Settlement of Investment Disputes
+Industries: Mining | Oil, Gas & Mining
+Status: Concluded
+Party Nationalities: Canada | Example
+Rules of Arbitration: ICSID Arbitration Rules
+Applicable Treaties: Canada - Example BIT (1996)
+Decisions: Award (Award) - 2015-06-30; Decision on Jurisdiction (Decision) - 2013-02-14"""
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+class CrossEncoderReranker:
+    """
+    Re-score retrieved cases against the query with a small cross-encoder.
+
+    All uncached (query, document) pairs are scored in one batched forward
+    pass on CPU. Scores are cached by case id and query hash. The stage has a
+    latency budget: per-pair cost is measured once at startup (see calibrate),
+    then tracked as a moving average, and the rerank is skipped (keeping the
+    embedding order) when the predicted time is over budget or when
+    `overloaded()` says the server is busy.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, budget_ms=150, overloaded=None, cache_size=5000, max_length=512, device="cpu",
+                 calibration_pairs=20):
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.budget_ms = budget_ms
+        self.overloaded = overloaded
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # guards the cache and pair_seconds, which request threads update
+        self.lock = threading.Lock()
+        # seconds per scored pair, measured on this machine rather than guessed
+        self.pair_seconds = self.calibrate(calibration_pairs)
+
+    def calibrate(self, pairs=20):
+        """Time one batch of `pairs` case-sized pairs, after a warm-up pass; returns seconds per pair."""
+        batch = [(CALIBRATION_QUERY, CALIBRATION_DOCUMENT)] * max(1, pairs)
+        self.model.predict(batch[:2], batch_size=2, show_progress_bar=False)
+        started = time.perf_counter()
+        self.model.predict(batch, batch_size=len(batch), show_progress_bar=False)
+        return (time.perf_counter() - started) / len(batch)
+
+    @staticmethod
+    def _query_hash(query):
+        return hashlib.sha1(query.strip().lower().encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self.lock:
+            score = self.cache.get(key)
+            if score is not None:
+                self.cache.move_to_end(key)
+            return score
+
+    def _store(self, key, score):
+        with self.lock:
+            self.cache[key] = score
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def rerank(self, query, cases, top_k):
+        """
+        Return the top_k cases by cross-encoder relevance, each with a
+        'relevance' score in [0, 1]. Falls back to the first top_k cases
+        unchanged when the stage is skipped.
+        """
+        if len(cases) <= 1:
+            return cases[:top_k]
+
+        if self.overloaded is not None and self.overloaded():
+            RERANK_SKIPPED.inc(reason="overloaded")
+            return cases[:top_k]
+
+        query_hash = self._query_hash(query)
+        scores = {}
+        pending = []
+        for case in cases:
+            score = self._cached((case['id'], query_hash))
+            record_cache("rerank", score is not None)
+            if score is None:
+                pending.append(case)
+            else:
+                scores[case['id']] = score
+
+        if pending:
+            with self.lock:
+                over_budget = len(pending) * self.pair_seconds * 1000 > self.budget_ms
+                if over_budget:
+                    # decay the estimate so one slow batch doesn't disable reranking for good
+                    self.pair_seconds *= 0.95
+            if over_budget:
+                RERANK_SKIPPED.inc(reason="budget")
+                return cases[:top_k]
+
+            started = time.perf_counter()
+            with timed("rerank"):
+                logits = self.model.predict(
+                    [(query, case['document']) for case in pending],
+                    batch_size=len(pending),
+                    show_progress_bar=False
+                )
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.pair_seconds = 0.8 * self.pair_seconds + 0.2 * elapsed / len(pending)
+
+            for case, logit in zip(pending, logits):
+                score = _sigmoid(float(logit))
+                scores[case['id']] = score
+                self._store((case['id'], query_hash), score)
+
+        ranked = sorted(cases, key=lambda case: scores[case['id']], reverse=True)
+        return [dict(case, relevance=scores[case['id']]) for case in ranked[:top_k]]
+
+    def describe(self):
+        with self.lock:
+            return {
+                "model": self.model_name,
+                "budget_ms": self.budget_ms,
+                "estimated_ms_per_pair": round(self.pair_seconds * 1000, 3),
+                "cached_scores": len(self.cache)
+            }
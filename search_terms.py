@@ -0,0 +1,208 @@
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from case_stats import split_values
+
+logger = logging.getLogger(__name__)
+
+# ICSID Case No. ARB/23/1, PCA Case No. 2017-25, ICC Case No. 2024/05, IDS-817, ICSID-2023-01
+CASE_ID_PATTERNS = [
+    re.compile(r"\b(?:ICSID|PCA|ICC|SCC|LCIA|UNCITRAL)\s+Case\s+No\.?\s*[A-Z]*/?[\w/-]+", re.IGNORECASE),
+    re.compile(r"\bARB(?:\(AF\))?/\d{2}/\d+\b", re.IGNORECASE),
+    re.compile(r"\b[A-Z]{2,6}-\d{2,4}(?:-\d{1,4})?\b"),
+]
+# "X v. Y" / "X v Y" party names, each a run of capitalised words ("Republic of Peru" allowed)
+_PARTY = r"[A-Z][\w&'-]*\.?(?:\s+(?:[A-Z][\w&'-]*\.?|of|de|del|and|&))*"
+PARTIES_PATTERN = re.compile(rf"\b({_PARTY})\s+v\.?\s+({_PARTY})")
+
+STOPWORDS = set("""
+a an the and or of in on at to for from by with about into over under between is are was were be been being
+what which who whom whose when where why how do does did can could should would will shall may might must
+this that these those it its it's as if than then there their they them we our you your i me my
+any all some such tell show give list find me please case cases arbitration dispute disputes tribunal
+involving involve involved against regarding related happened went know
+""".split())
+
+# terms that carry weight in arbitration searches
+LEGAL_TERMS = set("""
+award annulment jurisdiction admissibility expropriation compensation damages treaty bit fet
+fair equitable treatment umbrella clause denial justice discrimination enforcement set-aside
+provisional measures procedural order dissent dissenting costs interest counterclaim
+""".split())
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'&-]+")
+
+class Gazetteer:
+    """Multi-word phrase lookup keyed by first token; matches the longest phrase at each position."""
+
+    def __init__(self):
+        self.phrases = defaultdict(dict)
+
+    def add(self, phrase, kind):
+        tokens = tuple(token.lower() for token in WORD_PATTERN.findall(phrase))
+        if not tokens or (len(tokens) == 1 and (len(tokens[0]) < 4 or tokens[0] in STOPWORDS)):
+            return
+        self.phrases[tokens[0]][tokens] = (phrase, kind)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.phrases.values())
+
+    def find(self, tokens):
+        lowered = [token.lower() for token in tokens]
+        found = []
+        i = 0
+        while i < len(lowered):
+            best = None
+            for phrase_tokens, entry in self.phrases.get(lowered[i], {}).items():
+                if tuple(lowered[i:i + len(phrase_tokens)]) == phrase_tokens and (best is None or len(phrase_tokens) > len(best[0])):
+                    best = (phrase_tokens, entry)
+            if best:
+                found.append((i, best[1]))
+                i += len(best[0])
+            else:
+                i += 1
+        return found
+
+class SearchTermExtractor:
+    """
+    Turn a question into web search queries without calling a model.
+
+    Case numbers and party names are pulled out with regexes, then
+    institutions, countries, industries and party names known from the case
+    metadata are matched from a gazetteer. Whatever is left is scored as
+    keywords (legal terms and capitalised words first). The gazetteer is
+    rebuilt from the collection when its size changes, on one background
+    thread; extraction keeps using the previous gazetteer meanwhile.
+    """
+
+    def __init__(self, collection=None, refresh_interval_s=60.0, max_keywords=4):
+        self.collection = collection
+        self.refresh_interval_s = refresh_interval_s
+        self.max_keywords = max_keywords
+        self.gazetteer = Gazetteer()
+        self.built_for_count = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.refresh_again = False
+
+    def _institution_names(self, institution):
+        # "ICSID - International Centre for ..." -> both the code and the full name
+        return [part.strip() for part in institution.split(" - ") if part.strip()]
+
+    def rebuild(self, page_size=1000):
+        gazetteer = Gazetteer()
+        count = self.collection.count()
+        offset = 0
+        while offset < count:
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["metadatas"]:
+                break
+            for metadata in page["metadatas"]:
+                for name in self._institution_names(metadata.get("institution") or ""):
+                    gazetteer.add(name, "institution")
+                for field, kind in (("nationalities", "country"), ("industries", "industry")):
+                    for value in split_values(metadata, field):
+                        gazetteer.add(value, kind)
+                for party in re.split(r"\s+v\.?\s+|\s+and\s+", metadata.get("title") or ""):
+                    gazetteer.add(party.strip(), "party")
+            offset += len(page["metadatas"])
+        with self.lock:
+            self.gazetteer = gazetteer
+            self.built_for_count = count
+
+    def request_refresh(self):
+        """
+        Rebuild the gazetteer in the background if the collection's size has
+        changed (e.g. when an ingestion job finishes). Only one rebuild runs at
+        a time; a request during one makes it check again when it's done.
+        """
+        if self.collection is None:
+            return
+        with self.lock:
+            self.checked_at = time.monotonic()
+            if self.refreshing:
+                self.refresh_again = True
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, name="gazetteer-refresh", daemon=True).start()
+
+    def _refresh(self):
+        while True:
+            try:
+                if self.collection.count() != self.built_for_count:
+                    self.rebuild()
+            except Exception as e:
+                logger.error(f"Gazetteer rebuild failed: {str(e)}")
+            with self.lock:
+                if not self.refresh_again:
+                    self.refreshing = False
+                    return
+                self.refresh_again = False
+
+    def _maybe_refresh(self):
+        with self.lock:
+            due = self.checked_at is None or time.monotonic() - self.checked_at >= self.refresh_interval_s
+        if due:
+            self.request_refresh()
+
+    def _keywords(self, tokens, skip):
+        scored = []
+        for position, token in enumerate(tokens):
+            lowered = token.lower()
+            if position in skip or lowered in STOPWORDS or len(lowered) < 3:
+                continue
+            score = 1.0
+            if lowered in LEGAL_TERMS:
+                score += 2.0
+            if token[0].isupper() and position > 0:
+                score += 1.0
+            score += min(len(lowered), 12) / 12
+            scored.append((score, position, token))
+        best = sorted(scored, reverse=True)[:self.max_keywords]
+        return [token for _, _, token in sorted(best, key=lambda item: item[1])]
+
+    def extract(self, question, max_queries=3):
+        """
+        Returns {"queries": [...], "case_ids": [...], "entities": [...], "keywords": [...]}.
+        The first query combines everything; the rest focus on single case ids or entities.
+        """
+        self._maybe_refresh()
+
+        # matched spans are blanked out so their pieces don't come back as keywords
+        remaining = question
+        case_ids = []
+        for pattern in CASE_ID_PATTERNS:
+            for match in pattern.findall(remaining):
+                case_ids.append(match.strip())
+                remaining = remaining.replace(match, " ")
+
+        entities = []
+        for match in PARTIES_PATTERN.finditer(remaining):
+            entities.append(f"{match.group(1).strip()} v. {match.group(2).strip()}")
+        remaining = PARTIES_PATTERN.sub(" ", remaining)
+
+        tokens = WORD_PATTERN.findall(remaining)
+        skip = set()
+        with self.lock:
+            gazetteer = self.gazetteer
+        for position, (phrase, kind) in gazetteer.find(tokens):
+            if not any(phrase.lower() in entity.lower() for entity in entities) and phrase not in entities:
+                entities.append(phrase)
+            skip.update(range(position, position + len(WORD_PATTERN.findall(phrase))))
+
+        keywords = self._keywords(tokens, skip)
+
+        main_query = " ".join(dict.fromkeys(case_ids + entities + keywords)) or question.strip()
+        queries = [main_query]
+        for focus in case_ids + entities:
+            if len(queries) >= max_queries:
+                break
+            query = " ".join(dict.fromkeys([focus] + [k for k in keywords if k.lower() in LEGAL_TERMS] + ["arbitration"]))
+            if query not in queries:
+                queries.append(query)
+
+        return {"queries": queries, "case_ids": case_ids, "entities": entities, "keywords": keywords}
@@ -0,0 +1,49 @@
+import json
+import os
+
+# written by export_model.py next to the merged weights; read by the server
+# at startup, so this module only needs the standard library
+MANIFEST_FILE = "serving_manifest.json"
+SERVING_DTYPES = ("float32", "float16", "bfloat16")
+
+def load_serving_manifest(model_dir):
+    """
+    Read and validate serving_manifest.json for a model directory.
+
+    Returns the manifest, or None if the directory has no manifest (e.g. a raw
+    adapter). Raises ValueError if the manifest does not match the files on disk.
+    """
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    for field in ("format", "base_model", "adapter_sha256", "dtype"):
+        if not manifest.get(field):
+            raise ValueError(f"Serving manifest is missing '{field}'")
+
+    if manifest["format"] != "merged":
+        raise ValueError(f"Unsupported serving format: {manifest['format']}")
+
+    if manifest["dtype"] not in SERVING_DTYPES:
+        raise ValueError(f"Unsupported serving dtype: {manifest['dtype']}")
+
+    config_path = os.path.join(model_dir, "config.json")
+    if not os.path.exists(config_path):
+        raise ValueError(f"No config.json in {model_dir}")
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config_dtype = config.get("torch_dtype") or config.get("dtype")
+    if config_dtype and config_dtype != manifest["dtype"]:
+        raise ValueError(f"Manifest dtype {manifest['dtype']} does not match config dtype {config_dtype}")
+
+    missing = [name for name in manifest.get("weights", []) if not os.path.exists(os.path.join(model_dir, name))]
+    if missing:
+        raise ValueError(f"Missing weight files: {', '.join(missing)}")
+
+    if os.path.exists(os.path.join(model_dir, "adapter_config.json")):
+        raise ValueError("Merged model directory still contains an adapter_config.json")
+
+    return manifest
@@ -0,0 +1,389 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import threading
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("institution", "hash")
+RESULT_KEYS = ("ids", "documents", "metadatas", "distances")
+
+def institution_shard(metadata):
+    """'ICSID - International Centre ...' -> 'ICSID'; cases without an institution go to 'other'."""
+    institution = (metadata or {}).get("institution") or ""
+    code = institution.split(" - ")[0].strip()
+    code = re.sub(r"[^A-Za-z0-9_-]+", "_", code).strip("_")
+    return code or "other"
+
+def hash_shard(case_id, shard_count):
+    return f"shard_{zlib.crc32(case_id.encode('utf-8')) % shard_count}"
+
+def _open_collection(backend, directory, name, dtype, dimension, embedding_model):
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=directory)
+        # embeddings always arrive precomputed (see _ShardHandler), so no embedding function here,
+        # and without one chroma would default to l2: set the cosine space the unsharded collection gets
+        collection = client.get_or_create_collection(name=name, embedding_function=None, configuration={"hnsw": {"space": "cosine"}})
+        space = (collection.configuration_json.get("hnsw") or {}).get("space")
+        if space != "cosine":
+            logger.warning(f"Shard {directory} was created with {space} distances; rebuild it for cosine distances")
+        return collection
+
+    from vector_store import NumpyVectorClient
+    client = NumpyVectorClient(directory, dtype=dtype)
+    try:
+        return client.get_collection(name)
+    except ValueError:
+        return client.create_collection(name, dimension=dimension, embedding_model=embedding_model)
+
+class _ShardHandler:
+    """Runs collection calls for one shard, embedding documents itself when the caller didn't."""
+
+    def __init__(self, backend, directory, name, dtype, dimension, embedding_model, onnx_model_dir=None):
+        self.collection = _open_collection(backend, directory, name, dtype, dimension, embedding_model)
+        self.embedding_model = embedding_model
+        self.onnx_model_dir = onnx_model_dir
+        self.embedder = None
+
+    def _embed(self, documents):
+        if self.embedder is None:
+            if self.onnx_model_dir:
+                from onnx_embedder import OnnxEmbedding
+                self.embedder = OnnxEmbedding(self.onnx_model_dir)
+            else:
+                from vector_store import SentenceTransformerEmbedding
+                self.embedder = SentenceTransformerEmbedding(self.embedding_model)
+        return self.embedder(documents)
+
+    def call(self, method, kwargs):
+        if method in ("add", "upsert") and kwargs.get("embeddings") is None:
+            kwargs = dict(kwargs, embeddings=self._embed(kwargs["documents"]))
+        if method == "query":
+            count = self.collection.count()
+            if count == 0:
+                return {key: [[] for _ in kwargs["query_embeddings"]] for key in ["ids"] + list(kwargs.get("include", RESULT_KEYS))}
+            kwargs = dict(kwargs, n_results=min(kwargs["n_results"], count))
+        result = getattr(self.collection, method)(**kwargs)
+        if isinstance(result, dict):
+            # chroma returns numpy arrays for embeddings, send plain lists back
+            result = {key: value.tolist() if hasattr(value, "tolist") else value for key, value in result.items()}
+        return result
+
+def _shard_worker(conn, handler_args):
+    try:
+        handler = _ShardHandler(*handler_args)
+        conn.send(("ok", None))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        method, kwargs = message
+        try:
+            conn.send(("ok", handler.call(method, kwargs)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+@contextmanager
+def _without_main_module():
+    """
+    Spawned processes re-import the parent's __main__, and app.py loads the
+    language model at import time, so hide it while starting shard workers.
+    """
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+class ProcessShard:
+    """A shard served by its own worker process, talking over a pipe."""
+
+    def __init__(self, name, handler_args):
+        self.name = name
+        self.lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_shard_worker, args=(child_conn, handler_args), name=f"shard-{name}", daemon=True)
+        with _without_main_module():
+            self.process.start()
+        self._receive()
+
+    def _receive(self):
+        status, value = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(f"Shard {self.name}: {value}")
+        return value
+
+    def call(self, method, **kwargs):
+        with self.lock:
+            self.conn.send((method, kwargs))
+            return self._receive()
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        self.process.join(timeout=5)
+
+class LocalShard:
+    """A shard served in this process (for development and single-core machines)."""
+
+    def __init__(self, name, handler_args):
+        self.name = name
+        self.lock = threading.Lock()
+        self.handler = _ShardHandler(*handler_args)
+
+    def call(self, method, **kwargs):
+        with self.lock:
+            return self.handler.call(method, kwargs)
+
+    def close(self):
+        pass
+
+class ShardedCollection:
+    """
+    A case collection partitioned into shards, with the collection API the
+    rest of the project uses.
+
+    Rows are routed by institution (one shard per institution code, created on
+    first use) or by a hash of the id over a fixed number of shards. Writes go
+    to each shard in parallel, and each shard embeds its own documents, so
+    ingestion scales with the shard count. Queries are sent to every shard at
+    once and the per-shard top-k are merged by distance.
+    """
+
+    def __init__(self, client, name, config, embedding_function=None):
+        self.client = client
+        self.name = name
+        self.config = config
+        self.embedding_function = embedding_function
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix=f"{name}-shards")
+        for shard_name in config["shards"]:
+            self._shard(shard_name)
+
+    def _shard(self, shard_name):
+        with self.shards_lock:
+            if shard_name not in self.shards:
+                handler_args = (
+                    self.config["backend"],
+                    os.path.join(self.client.directory(self.name), shard_name),
+                    self.name,
+                    self.config["dtype"],
+                    self.config["dimension"],
+                    self.config["embedding_model"],
+                    self.client.onnx_model_dir
+                )
+                shard_class = ProcessShard if self.client.processes else LocalShard
+                self.shards[shard_name] = shard_class(shard_name, handler_args)
+                if shard_name not in self.config["shards"]:
+                    self.config["shards"].append(shard_name)
+                    self.client.save_config(self.name, self.config)
+            return self.shards[shard_name]
+
+    def _route(self, case_id, metadata):
+        if self.config["shard_by"] == "institution":
+            return institution_shard(metadata)
+        return hash_shard(case_id, self.config["shard_count"])
+
+    def _fan_out(self, calls):
+        """Run {shard_name: (method, kwargs)} in parallel; returns {shard_name: result}."""
+        futures = {
+            shard_name: self.executor.submit(self._shard(shard_name).call, method, **kwargs)
+            for shard_name, (method, kwargs) in calls.items()
+        }
+        return {shard_name: future.result() for shard_name, future in futures.items()}
+
+    def _broadcast(self, method, **kwargs):
+        return self._fan_out({shard_name: (method, kwargs) for shard_name in list(self.shards)})
+
+    def _group(self, ids, documents, metadatas, embeddings):
+        groups = {}
+        for i, case_id in enumerate(ids):
+            metadata = metadatas[i] if metadatas else None
+            group = groups.setdefault(self._route(case_id, metadata), {"ids": [], "documents": [], "metadatas": [], "embeddings": []})
+            group["ids"].append(case_id)
+            group["documents"].append(documents[i])
+            group["metadatas"].append(metadata)
+            group["embeddings"].append(embeddings[i] if embeddings is not None else None)
+        for group in groups.values():
+            if embeddings is None:
+                group["embeddings"] = None
+            if not metadatas:
+                group["metadatas"] = None
+        return groups
+
+    def add(self, ids, documents, metadatas=None, embeddings=None):
+        with timed("shard_ingest"):
+            self._fan_out({shard_name: ("add", group) for shard_name, group in self._group(ids, documents, metadatas, embeddings).items()})
+
+    def upsert(self, ids, documents, metadatas=None, embeddings=None):
+        groups = self._group(ids, documents, metadatas, embeddings)
+        if self.config["shard_by"] == "institution":
+            # a changed institution moves the case, so drop it from every other shard
+            target = {case_id: shard_name for shard_name, group in groups.items() for case_id in group["ids"]}
+            self._fan_out({
+                shard_name: ("delete", {"ids": [case_id for case_id in ids if target[case_id] != shard_name]})
+                for shard_name in list(self.shards)
+            })
+        self._fan_out({shard_name: ("upsert", group) for shard_name, group in groups.items()})
+
+    def delete(self, ids):
+        if self.config["shard_by"] == "hash":
+            by_shard = {}
+            for case_id in ids:
+                by_shard.setdefault(hash_shard(case_id, self.config["shard_count"]), []).append(case_id)
+            self._fan_out({shard_name: ("delete", {"ids": shard_ids}) for shard_name, shard_ids in by_shard.items()})
+        else:
+            self._broadcast("delete", ids=ids)
+
+    def shard_counts(self):
+        return self._broadcast("count")
+
+    def count(self):
+        return sum(self.shard_counts().values())
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=0):
+        include = list(include)
+        merged = {"ids": [], **{key: [] for key in include}}
+
+        if ids is not None:
+            for result in self._broadcast("get", ids=ids, include=include).values():
+                for key in merged:
+                    merged[key].extend(result.get(key) or [])
+            return merged
+
+        # page through the shards in a fixed order so offsets stay stable
+        for shard_name, shard_count in sorted(self.shard_counts().items()):
+            if limit is not None and len(merged["ids"]) >= limit:
+                break
+            if offset >= shard_count:
+                offset -= shard_count
+                continue
+            remaining = None if limit is None else limit - len(merged["ids"])
+            result = self._shard(shard_name).call("get", include=include, limit=remaining, offset=offset)
+            offset = 0
+            for key in merged:
+                merged[key].extend(result.get(key) or [])
+        return merged
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, include=("documents", "metadatas", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        query_embeddings = [list(map(float, embedding)) for embedding in query_embeddings]
+        include = list(include) if "distances" in include else list(include) + ["distances"]
+
+        with timed("shard_scatter_gather"):
+            results = self._broadcast("query", query_embeddings=query_embeddings, n_results=n_results, include=include)
+
+        keys = ["ids"] + include
+        merged = {key: [] for key in keys}
+        for query_index in range(len(query_embeddings)):
+            rows = []
+            for result in results.values():
+                for i, distance in enumerate(result["distances"][query_index]):
+                    rows.append((distance, {key: result[key][query_index][i] for key in keys if result.get(key)}))
+            rows.sort(key=lambda row: row[0])
+            for key in keys:
+                merged[key].append([row.get(key) for _, row in rows[:n_results]])
+        return merged
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+        self.shards = {}
+        self.executor.shutdown(wait=False)
+
+class ShardedClient:
+    """
+    Drop-in for chromadb.PersistentClient whose collections are ShardedCollections.
+
+    Each shard is a chroma or numpy collection under
+    <path>/<name>.shards/<shard>/, served by a worker process unless
+    processes=False.
+    """
+
+    def __init__(self, path, backend="chroma", dtype="float16", shard_by="institution", shard_count=4, processes=True, embedding_model=None,
+                 onnx_model_dir=None):
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"shard_by must be one of {SHARD_STRATEGIES}")
+        self.path = path
+        self.backend = backend
+        self.dtype = dtype
+        self.shard_by = shard_by
+        self.shard_count = shard_count
+        self.processes = processes
+        self.embedding_model = embedding_model
+        # shard workers embed with the ONNX export in this directory instead of PyTorch (see onnx_embedder.py)
+        self.onnx_model_dir = onnx_model_dir
+        self.collections = {}
+        os.makedirs(path, exist_ok=True)
+
+    def directory(self, name):
+        return os.path.join(self.path, f"{name}.shards")
+
+    def _config_path(self, name):
+        return os.path.join(self.directory(name), "shards.json")
+
+    def save_config(self, name, config):
+        tmp_path = self._config_path(name) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        os.replace(tmp_path, self._config_path(name))
+
+    def get_collection(self, name, embedding_function=None):
+        if name in self.collections:
+            return self.collections[name]
+        if not os.path.exists(self._config_path(name)):
+            raise ValueError(f"Collection {name} does not exist")
+        with open(self._config_path(name), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if config["shard_by"] != self.shard_by or config["backend"] != self.backend:
+            logger.warning(f"Collection {name} was created with shard_by={config['shard_by']}, backend={config['backend']}; using those")
+        self.collections[name] = ShardedCollection(self, name, config, embedding_function)
+        return self.collections[name]
+
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        dimension = len(embedding_function(["dimension probe"])[0]) if embedding_function is not None else None
+        config = {
+            "backend": self.backend,
+            "dtype": self.dtype,
+            "shard_by": self.shard_by,
+            "shard_count": self.shard_count,
+            "dimension": dimension,
+            "embedding_model": self.embedding_model,
+            "metadata": metadata or {},
+            "shards": [f"shard_{i}" for i in range(self.shard_count)] if self.shard_by == "hash" else []
+        }
+        os.makedirs(self.directory(name), exist_ok=True)
+        self.save_config(name, config)
+        self.collections[name] = ShardedCollection(self, name, config, embedding_function)
+        return self.collections[name]
+
+    def delete_collection(self, name):
+        collection = self.collections.pop(name, None)
+        if collection is not None:
+            collection.close()
+        shutil.rmtree(self.directory(name), ignore_errors=True)
@@ -0,0 +1,134 @@
+import time
+
+import torch
+from transformers import DynamicCache
+
+from metrics import registry
+
+SPECULATIVE_TOKENS = registry.counter(
+    "legaltech_speculative_tokens_total", "Draft tokens proposed and accepted by the target model", ["result"]
+)
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding with a small draft model.
+
+    Each round the draft model greedily proposes up to draft_tokens tokens,
+    then the target model scores the last known token plus the whole proposal
+    in one forward pass. Proposed tokens are kept while they match the
+    target's own greedy choice, and the target's choice at the first mismatch
+    (or after a fully accepted proposal) is appended, so the output matches
+    plain greedy decoding of the target. Both models keep a KV cache that is
+    cropped back to the accepted prefix after every round.
+
+    The draft model must use the target's tokenizer.
+    """
+
+    def __init__(self, draft_model, vocab_size, draft_tokens=4):
+        self.draft_model = draft_model
+        self.vocab_size = vocab_size
+        self.draft_tokens = draft_tokens
+        # seconds per token of plain greedy decoding, measured by calibrate()
+        self.baseline_token_s = None
+
+    @staticmethod
+    def _crop(cache, length):
+        excess = cache.get_seq_length() - length
+        if excess > 0:
+            cache.crop(-excess)
+
+    def _forward(self, model, tokens, cache):
+        input_ids = torch.tensor([tokens], device=model.device)
+        return model(input_ids=input_ids, past_key_values=cache, use_cache=True).logits
+
+    @torch.no_grad()
+    def calibrate(self, model, input_ids, steps=16):
+        """Time plain greedy decode steps of the target, used for the per-request speedup estimate."""
+        tokens = input_ids[0].tolist()
+        cache = DynamicCache()
+        logits = self._forward(model, tokens, cache)
+        started = time.perf_counter()
+        for _ in range(steps):
+            next_id = int(logits[0, -1].argmax())
+            logits = self._forward(model, [next_id], cache)
+        self.baseline_token_s = (time.perf_counter() - started) / steps
+        return self.baseline_token_s
+
+    def _draft(self, tokens, cache, count, eos_ids):
+        proposal = []
+        feed = tokens[cache.get_seq_length():]
+        for _ in range(count):
+            logits = self._forward(self.draft_model, feed, cache)
+            next_id = int(logits[0, -1, :self.vocab_size].argmax())
+            proposal.append(next_id)
+            if next_id in eos_ids:
+                break
+            feed = [next_id]
+        return proposal
+
+    @torch.no_grad()
+    def generate(self, model, input_ids, max_new_tokens, eos_token_id=None):
+        """
+        Decode up to max_new_tokens after input_ids (batch size 1).
+
+        Returns (token ids including the prompt, stats dict).
+        """
+        prompt_length = input_ids.shape[1]
+        tokens = input_ids[0].tolist()
+        eos_ids = set(eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]) - {None}
+
+        # both caches always hold every token except the last one
+        target_cache = DynamicCache()
+        draft_cache = DynamicCache()
+        if len(tokens) > 1:
+            self._forward(model, tokens[:-1], target_cache)
+            self._forward(self.draft_model, tokens[:-1], draft_cache)
+
+        started = time.perf_counter()
+        drafted = 0
+        accepted = 0
+        target_passes = 0
+        finished = False
+
+        while not finished and len(tokens) - prompt_length < max_new_tokens:
+            # the target adds one token of its own every round, so leave room for it
+            remaining = max_new_tokens - (len(tokens) - prompt_length)
+            proposal = self._draft(tokens, draft_cache, min(self.draft_tokens, remaining - 1), eos_ids)
+
+            logits = self._forward(model, tokens[target_cache.get_seq_length():] + proposal, target_cache)
+            target_passes += 1
+            choices = logits[0, -(len(proposal) + 1):].argmax(dim=-1).tolist()
+
+            matched = 0
+            while matched < len(proposal) and proposal[matched] == choices[matched]:
+                matched += 1
+            new_tokens = proposal[:matched] + [choices[matched]]
+            drafted += len(proposal)
+            accepted += matched
+
+            for i, token_id in enumerate(new_tokens):
+                if token_id in eos_ids:
+                    new_tokens = new_tokens[:i + 1]
+                    finished = True
+                    break
+            tokens.extend(new_tokens)
+
+            self._crop(target_cache, len(tokens) - 1)
+            self._crop(draft_cache, len(tokens) - 1)
+
+        elapsed = time.perf_counter() - started
+        generated = len(tokens) - prompt_length
+        SPECULATIVE_TOKENS.inc(drafted, result="drafted")
+        SPECULATIVE_TOKENS.inc(accepted, result="accepted")
+
+        stats = {
+            "generated_tokens": generated,
+            "drafted_tokens": drafted,
+            "accepted_tokens": accepted,
+            "acceptance_rate": round(accepted / drafted, 3) if drafted else None,
+            "target_passes": target_passes,
+            "tokens_per_target_pass": round(generated / target_passes, 2) if target_passes else None,
+            "decode_seconds": round(elapsed, 3),
+            "speedup_estimate": round(self.baseline_token_s * generated / elapsed, 2) if self.baseline_token_s and elapsed > 0 else None
+        }
+        return torch.tensor([tokens], device=input_ids.device), stats
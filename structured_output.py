@@ -0,0 +1,124 @@
+import threading
+
+import torch
+
+# fields returned by /query in structured mode, in the order they are generated
+CASE_FIELDS = ("case_number", "title", "topics", "institution", "outcome")
+
+class StructuredCaseGenerator:
+    """
+    Greedy decoding constrained to a flat JSON object of string fields.
+
+    Keys, quotes and separators are forced into the sequence; the model only
+    chooses the string values. While inside a value, tokens that would break
+    out of the JSON string (quotes, backslashes, newlines, special tokens) are
+    masked, except a bare '"' which closes the value. Decoding stops as soon as
+    the last value is closed, so nothing beyond the object is ever generated.
+    """
+
+    def __init__(self, tokenizer, fields=CASE_FIELDS, max_field_tokens=48):
+        self.tokenizer = tokenizer
+        self.fields = tuple(fields)
+        self.max_field_tokens = max_field_tokens
+        self.content_mask, self.close_ids = self._build_vocab_masks()
+
+        # forced segments between values, tokenized once
+        self.segments = []
+        for i, field in enumerate(self.fields):
+            prefix = "{" if i == 0 else ", "
+            self.segments.append(self._encode(f'{prefix}"{field}": "'))
+
+    def _encode(self, text):
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _build_vocab_masks(self):
+        vocab_size = len(self.tokenizer)
+        content_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        close_ids = []
+        special_ids = set(self.tokenizer.all_special_ids)
+
+        for token_id in range(vocab_size):
+            if token_id in special_ids:
+                continue
+            text = self.tokenizer.decode([token_id])
+            if text == '"':
+                close_ids.append(token_id)
+            elif text and not any(ch in text for ch in '"\\\n\r\t'):
+                content_mask[token_id] = True
+
+        if not close_ids:
+            close_ids = self._encode('"')[-1:]
+
+        return content_mask, close_ids
+
+    @torch.no_grad()
+    def generate(self, model, prompt):
+        """
+        Generate the case object for a prompt.
+
+        Returns (fields dict, stats dict) where stats counts the tokens the
+        model actually chose versus the ones forced by the schema.
+        """
+        device = model.device
+        allowed = self.content_mask.clone()
+        allowed[self.close_ids] = True
+        blocked = ~allowed.to(device)
+        close_ids = torch.tensor(self.close_ids, device=device)
+
+        input_ids = torch.tensor([self._encode(prompt) + self.segments[0]], device=device)
+        # some tokenizers (DeepSeek included) expect the BOS token in front
+        if self.tokenizer.bos_token_id is not None:
+            input_ids = torch.cat([torch.tensor([[self.tokenizer.bos_token_id]], device=device), input_ids], dim=1)
+
+        outputs = model(input_ids=input_ids, use_cache=True)
+        past = outputs.past_key_values
+        logits = outputs.logits[0, -1]
+
+        values = {}
+        generated_tokens = 0
+        forced_tokens = input_ids.shape[1]
+
+        for i, field in enumerate(self.fields):
+            value_ids = []
+            while True:
+                if len(value_ids) >= self.max_field_tokens:
+                    next_id = self.close_ids[0]
+                else:
+                    next_id = int(logits.masked_fill(blocked, float("-inf")).argmax())
+
+                closed = bool((close_ids == next_id).any())
+                if not closed:
+                    value_ids.append(next_id)
+                generated_tokens += 1
+
+                # the object is complete once the last value is closed
+                if closed and i == len(self.fields) - 1:
+                    break
+
+                step_ids = [next_id]
+                if closed:
+                    step_ids += self.segments[i + 1]
+                    forced_tokens += len(self.segments[i + 1])
+
+                outputs = model(input_ids=torch.tensor([step_ids], device=device), past_key_values=past, use_cache=True)
+                past = outputs.past_key_values
+                logits = outputs.logits[0, -1]
+
+                if closed:
+                    break
+
+            values[field] = self.tokenizer.decode(value_ids, skip_special_tokens=True).strip()
+
+        stats = {"generated_tokens": generated_tokens, "forced_tokens": forced_tokens}
+        return values, stats
+
+_generator = None
+_generator_lock = threading.Lock()
+
+def get_structured_generator(tokenizer):
+    """Build the generator on first use; scanning the vocabulary takes a moment."""
+    global _generator
+    with _generator_lock:
+        if _generator is None or _generator.tokenizer is not tokenizer:
+            _generator = StructuredCaseGenerator(tokenizer)
+        return _generator
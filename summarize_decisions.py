@@ -0,0 +1,282 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+from decision_passages import split_passages
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SYSTEM = "You are an expert in international arbitration law. Summarize arbitration decisions accurately and concisely, using only the text given."
+
+# markdown headings: "# Heading" or a line underlined with --- / ===
+HEADING = re.compile(r"^(?:#{1,6}\s+(?P<hash>.+)|(?P<text>\S[^\n]*)\n(?:-{3,}|={3,}))\s*$", re.MULTILINE)
+
+SECTION_MAX_WORDS = 700
+SECTION_MIN_WORDS = 80
+# section summaries are combined in groups this size until the rest fits one award prompt
+REDUCE_GROUP = 8
+AWARD_INPUT_MAX_WORDS = 1500
+
+def split_sections(text, max_words=SECTION_MAX_WORDS, min_words=SECTION_MIN_WORDS):
+    """
+    Split a decision into (heading, text) sections on its markdown headings.
+    Sections shorter than min_words are merged into the next one, and sections
+    longer than max_words are cut into paragraph-aligned parts.
+    """
+    matches = list(HEADING.finditer(text))
+    raw = []
+    if not matches or matches[0].start() > 0:
+        raw.append(("Preamble", text[:matches[0].start()] if matches else text))
+    for i, match in enumerate(matches):
+        # headings carry markdown bold runs like "O****verview of the** **D****ispute"
+        heading = " ".join(re.sub(r"\*+", "", match.group("hash") or match.group("text")).split())
+        body = text[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(text)]
+        raw.append((heading, body))
+
+    sections = []
+    carry_heading, carry_text = None, ""
+    for heading, body in raw:
+        if carry_text:
+            heading, body = carry_heading, carry_text + "\n\n" + body
+        if len(body.split()) < min_words:
+            carry_heading, carry_text = heading, body
+            continue
+        carry_heading, carry_text = None, ""
+        parts = split_passages(body, max_words=max_words, overlap_words=0)
+        for n, part in enumerate(parts):
+            sections.append((heading if len(parts) == 1 else f"{heading} (part {n + 1})", part))
+    if carry_text.split():
+        sections.append((carry_heading, " ".join(carry_text.split())))
+    return sections
+
+def iter_decisions(documents):
+    """One work unit per decision with content: key, content hash and the fields stored with its summary"""
+    for case in documents:
+        identifier = case.get("Identifier", "Unknown")
+        for decision_index, decision in enumerate(case.get("Decisions") or []):
+            content = decision.get("Content") or ""
+            if not content.strip():
+                continue
+            yield {
+                "decision_key": f"{identifier}#{decision_index}",
+                "sha1": hashlib.sha1(content.encode("utf-8")).hexdigest(),
+                "case_id": identifier,
+                "title": case.get("Title", "Unknown"),
+                "institution": case.get("Institution", "Unknown"),
+                "decision_index": decision_index,
+                "decision_title": decision.get("Title", "Unknown"),
+                "decision_type": decision.get("Type", "Unknown"),
+                "decision_date": (decision.get("Date") or "").split("T")[0],
+                "content": content
+            }
+
+def load_progress(out_dir):
+    """Records already written by earlier runs, as (sections by (key, sha1, index), decisions by key)"""
+    sections, decisions = {}, {}
+    for path in sorted(glob.glob(os.path.join(out_dir, "part-*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a worker killed mid-write leaves a partial last line
+                    continue
+                if record["kind"] == "section":
+                    sections[(record["decision_key"], record["sha1"], record["section"])] = record
+                else:
+                    decisions[record["decision_key"]] = record
+    return sections, decisions
+
+class LocalSummarizer:
+    """Greedy, batched summaries from the local model in the training prompt layout"""
+
+    def __init__(self, model_dir, batch_size=4):
+        from benchmark_model import extract_answer, load_model
+
+        self.model, self.tokenizer, _, _ = load_model(model_dir)
+        self.extract_answer = extract_answer
+        self.batch_size = batch_size
+
+    def summarize(self, prompts, max_new_tokens):
+        import torch
+
+        outputs = []
+        for start in range(0, len(prompts), self.batch_size):
+            batch = [f"System: {SYSTEM}\nUser: {prompt}\nAssistant:" for prompt in prompts[start:start + self.batch_size]]
+            inputs = self.tokenizer(batch, return_tensors="pt", padding=True).to(self.model.device)
+            with torch.no_grad():
+                generated = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id
+                )
+            prompt_length = inputs["input_ids"].shape[1]
+            outputs.extend(
+                self.extract_answer(self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True))
+                for output in generated
+            )
+        return outputs
+
+def section_prompt(unit, heading, text):
+    return (f"Decision: {unit['decision_title']} in case {unit['case_id']} ({unit['title']})\n"
+            f"Section: {heading}\n\n{text}\n\n"
+            "Summarize this section in at most 80 words: findings, holdings and reasoning only.")
+
+def award_prompt(unit, summaries):
+    return (f"Section summaries of the {unit['decision_title']} ({unit['decision_type']}, {unit['decision_date'] or 'undated'}) "
+            f"in case {unit['case_id']} ({unit['title']}):\n\n{summaries}\n\n"
+            "Summarize the whole decision in at most 120 words: the outcome, the key holdings and any amounts awarded.")
+
+def summarize_decision(summarizer, unit, done_sections, write, section_tokens=128, award_tokens=192):
+    sections = split_sections(unit["content"])
+
+    pending = [n for n in range(len(sections)) if (unit["decision_key"], unit["sha1"], n) not in done_sections]
+    summaries = {n: done_sections[(unit["decision_key"], unit["sha1"], n)]["summary"] for n in range(len(sections)) if n not in pending}
+    for start in range(0, len(pending), summarizer.batch_size):
+        batch = pending[start:start + summarizer.batch_size]
+        results = summarizer.summarize([section_prompt(unit, *sections[n]) for n in batch], section_tokens)
+        for n, summary in zip(batch, results):
+            summaries[n] = summary
+            write({"kind": "section", "decision_key": unit["decision_key"], "sha1": unit["sha1"],
+                   "section": n, "heading": sections[n][0], "summary": summary})
+
+    # combine section summaries in groups until they fit one award-level prompt
+    layer = [f"{sections[n][0]}: {summaries[n]}" for n in range(len(sections))]
+    while len(" ".join(layer).split()) > AWARD_INPUT_MAX_WORDS and len(layer) > 1:
+        groups = ["\n".join(layer[i:i + REDUCE_GROUP]) for i in range(0, len(layer), REDUCE_GROUP)]
+        layer = summarizer.summarize([award_prompt(unit, group) for group in groups], section_tokens)
+    award = summarizer.summarize([award_prompt(unit, "\n".join(layer))], award_tokens)[0]
+
+    record = {key: value for key, value in unit.items() if key != "content"}
+    record.update({"kind": "decision", "summary": award, "sections": len(sections)})
+    write(record)
+
+def run_worker(rank, units, done_sections, model_dir, out_dir, batch_size):
+    """Summarize units (this worker's share) into part-<rank>.jsonl"""
+    summarizer = LocalSummarizer(model_dir, batch_size=batch_size)
+    path = os.path.join(out_dir, f"part-{rank}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        def write(record):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+        for i, unit in enumerate(units, 1):
+            started = time.time()
+            summarize_decision(summarizer, unit, done_sections, write)
+            logger.info(f"[worker {rank}] {i}/{len(units)} {unit['decision_key']} in {time.time() - started:.1f}s")
+
+def summary_records(out_dir):
+    """Index records (section, decision and case level) from the summaries written so far"""
+    sections, decisions = load_progress(out_dir)
+    records = []
+    cases = {}
+    for key, decision in sorted(decisions.items(), key=lambda item: (item[1]["case_id"], item[1]["decision_index"])):
+        identifier, decision_index = decision["case_id"], decision["decision_index"]
+        metadata = {field: decision[field] for field in (
+            "case_id", "title", "institution", "decision_index", "decision_title", "decision_type", "decision_date"
+        )}
+        records.append({
+            "id": f"summary_{identifier}_{decision_index}",
+            "document": decision["summary"],
+            "metadata": dict(metadata, level="decision", sections=decision["sections"])
+        })
+        for n in range(decision["sections"]):
+            section = sections.get((key, decision["sha1"], n))
+            if section:
+                records.append({
+                    "id": f"summary_{identifier}_{decision_index}_s{n}",
+                    "document": f"{section['heading']}: {section['summary']}",
+                    "metadata": dict(metadata, level="section", section=n)
+                })
+        date = f", {decision['decision_date']}" if decision["decision_date"] else ""
+        line = f"{decision['decision_title']} ({decision['decision_type']}{date}): {' '.join(decision['summary'].split())}"
+        cases.setdefault(identifier, (decision, []))[1].append(line)
+
+    for identifier, (decision, lines) in cases.items():
+        records.append({
+            "id": f"summary_{identifier}",
+            "document": "\n".join(lines),
+            "metadata": {"case_id": identifier, "title": decision["title"], "institution": decision["institution"],
+                         "level": "case", "decisions": len(lines)}
+        })
+    return records
+
+def store_summaries(out_dir, persist_dir, backend):
+    from handle_rag import ArbitrationRAGChroma
+
+    rag = ArbitrationRAGChroma(persist_directory=persist_dir, backend=backend)
+    records = summary_records(out_dir)
+    rag.summary_index(create=True).store(records)
+    print(f"Stored {len(records)} summary records")
+
+def main():
+    from generate_finetuning_data import FineTuningDataGenerator
+
+    parser = argparse.ArgumentParser(description="Precompute hierarchical decision summaries with the local model")
+    parser.add_argument("--cases", default="./case_data_clean", help="folder of case JSON files, or a case store (case_store.py)")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_PATH"), help="merged export or adapter directory")
+    parser.add_argument("--out", default="./decision_summaries", help="progress/output folder (re-run to resume)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, each with its own copy of the model")
+    parser.add_argument("--devices", default=None, help="comma-separated CUDA devices, assigned to workers round-robin")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--persist-dir", default=os.getenv("CHROMA_PERSIST_DIR", "./chroma_db"))
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "numpy"])
+    parser.add_argument("--store-only", action="store_true", help="skip summarizing, only load finished summaries into the index")
+    parser.add_argument("--no-store", action="store_true", help="summarize without loading the results into the index")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    if not args.store_only:
+        documents = FineTuningDataGenerator().load_documents(args.cases)
+        done_sections, done_decisions = load_progress(args.out)
+        units = [
+            unit for unit in iter_decisions(documents)
+            if done_decisions.get(unit["decision_key"], {}).get("sha1") != unit["sha1"]
+        ]
+        print(f"{len(units)} decisions to summarize ({len(done_decisions)} already done)")
+
+        if units:
+            if not args.model_dir:
+                parser.error("--model-dir (or MODEL_PATH) is required")
+            if args.workers == 1:
+                run_worker(0, units, done_sections, args.model_dir, args.out, args.batch_size)
+            else:
+                devices = args.devices.split(",") if args.devices else None
+                context = multiprocessing.get_context("spawn")
+                processes = []
+                for rank in range(args.workers):
+                    if devices:
+                        # spawned children read the environment as it is when they start
+                        os.environ["CUDA_VISIBLE_DEVICES"] = devices[rank % len(devices)]
+                    # spawn pickles the arguments into each child, so send only this worker's share
+                    share = units[rank::args.workers]
+                    share_keys = {unit["decision_key"] for unit in share}
+                    process = context.Process(
+                        target=run_worker,
+                        args=(rank, share, {key: value for key, value in done_sections.items() if key[0] in share_keys},
+                              args.model_dir, args.out, args.batch_size)
+                    )
+                    process.start()
+                    processes.append(process)
+                for process in processes:
+                    process.join()
+                failed = [rank for rank, process in enumerate(processes) if process.exitcode != 0]
+                if failed:
+                    print(f"Workers {failed} failed; re-run to resume")
+                    return
+
+    if not args.no_store:
+        store_summaries(args.out, args.persist_dir, args.backend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the words the tiny test model's vocabulary knows
+VOCABULARY = """
+mining concession expropriation compensation gas pipeline tariff solar telecom licence bank damages
+case id title award tribunal decision republic
+""".split()
+
+@pytest.fixture(scope="session")
+def onnx_model_dir(tmp_path_factory):
+    """A tiny random BERT exported like the real embedding model, so tests need no download"""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("sentence_transformers")
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    from handle_rag import EMBEDDING_MODEL
+    from onnx_embedder import export_onnx
+
+    root = tmp_path_factory.mktemp("onnx")
+    bert_dir = str(root / "bert")
+    os.makedirs(bert_dir)
+    vocab_path = os.path.join(bert_dir, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + VOCABULARY + ["dimension", "probe"]))
+    BertTokenizerFast(vocab_file=vocab_path).save_pretrained(bert_dir)
+    config = BertConfig(vocab_size=len(VOCABULARY) + 7, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                        intermediate_size=32, max_position_embeddings=128)
+    BertModel(config).save_pretrained(bert_dir)
+
+    # named like the serving model, which load_onnx_embedding checks
+    model_path = str(root / EMBEDDING_MODEL)
+    SentenceTransformer(modules=[models.Transformer(bert_dir, max_seq_length=64), models.Pooling(16)]).save(model_path)
+    output_dir = str(root / "export")
+    export_onnx(model_path, output_dir)
+    return output_dir
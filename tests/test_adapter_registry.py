@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("peft")
+
+from adapter_registry import AdapterError, AdapterRegistry
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    """A tiny random GPT-2 and two LoRA adapters trained (well, initialised) on it"""
+    from peft import LoraConfig, get_peft_model
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    root = tmp_path_factory.mktemp("adapters")
+    base_dir = str(root / "base")
+    torch.manual_seed(0)
+    GPT2LMHeadModel(GPT2Config(vocab_size=64, n_positions=32, n_embd=16, n_layer=1, n_head=2)).save_pretrained(base_dir)
+    for name in ("a", "b"):
+        peft_model = get_peft_model(
+            GPT2LMHeadModel.from_pretrained(base_dir),
+            LoraConfig(r=2, target_modules=["c_attn"], init_lora_weights=False)
+        )
+        peft_model.save_pretrained(str(root / name))
+    return root
+
+def load_registry(model_dir, **kwargs):
+    from transformers import GPT2LMHeadModel
+    base_dir = str(model_dir / "base")
+    return AdapterRegistry(GPT2LMHeadModel.from_pretrained(base_dir).eval(), base_model_path=base_dir, **kwargs)
+
+def logits(model):
+    with torch.no_grad():
+        return model(torch.tensor([[1, 2, 3]])).logits
+
+def test_adapters_switch_and_base_stays_plain(model_dir):
+    registry = load_registry(model_dir, max_loaded=1)
+    with registry.use() as model:
+        base = logits(model)
+    registry.register("a", str(model_dir / "a"))
+    registry.register("b", str(model_dir / "b"), load=False)
+    with registry.use("a") as model:
+        with_a = logits(model)
+    with registry.use("b") as model:
+        with_b = logits(model)
+    with registry.use() as model:
+        assert torch.allclose(logits(model), base)
+    assert not torch.allclose(with_a, base)
+    assert not torch.allclose(with_a, with_b)
+    # max_loaded=1: b evicted a
+    assert registry.describe()["lru_order"] == ["b"]
+    with registry.use("a") as model:
+        assert torch.allclose(logits(model), with_a)
+
+def test_rejects_adapter_for_another_base(model_dir, tmp_path):
+    registry = load_registry(model_dir)
+    path = tmp_path / "other"
+    path.mkdir()
+    with open(model_dir / "a" / "adapter_config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+    for filename in os.listdir(model_dir / "a"):
+        (path / filename).write_bytes((model_dir / "a" / filename).read_bytes())
+    (path / "adapter_config.json").write_text(json.dumps(dict(config, base_model_name_or_path="some/other-model")))
+    with pytest.raises(AdapterError, match="some/other-model"):
+        registry.register("other", str(path))
+    assert registry.describe()["adapters"] == []
+
+def test_same_adapter_generates_concurrently_and_switches_wait(model_dir):
+    registry = load_registry(model_dir)
+    registry.register("a", str(model_dir / "a"))
+    registry.register("b", str(model_dir / "b"))
+    inside = threading.Barrier(2, timeout=10)
+    switched = threading.Event()
+    errors = []
+
+    def use_a():
+        with registry.use("a"):
+            try:
+                # both get here only if they hold the adapter at the same time
+                inside.wait()
+                if switched.wait(0.2):
+                    errors.append("switched to b while a was generating")
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+
+    def use_b():
+        with registry.use("b"):
+            switched.set()
+
+    threads = [threading.Thread(target=use_a) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while registry.generating < 2:
+        pass
+    switch = threading.Thread(target=use_b)
+    switch.start()
+    for thread in threads + [switch]:
+        thread.join(timeout=10)
+    assert errors == []
+    assert switched.is_set()
+    assert registry.generating == 0 and registry.active == "b"
@@ -0,0 +1,83 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from conversation_sessions import Session, retrieve_for_session
+from handle_rag import ArbitrationRAGChroma
+from sharded_store import ShardedClient
+from vector_store import NumpyVectorClient
+
+DIMENSION = 32
+
+CASES = {
+    "case-1": "mining concession revoked expropriation compensation",
+    "case-2": "mining licence expropriation fair market value damages",
+    "case-3": "gas pipeline tariff dispute umbrella clause",
+    "case-4": "telecom licence fair and equitable treatment",
+    "case-5": "solar feed-in tariff legitimate expectations",
+    "case-6": "bank nationalisation denial of justice",
+}
+
+class HashEmbedding:
+    """Normalised bag-of-words vectors, so the tests don't need a model download."""
+
+    model_name = "test-hash"
+
+    def __call__(self, input):
+        vectors = np.zeros((len(input), DIMENSION), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode("utf-8")) % DIMENSION] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.tolist()
+
+@pytest.fixture(params=["numpy", "sharded-numpy"])
+def rag(request, tmp_path):
+    embedding_function = HashEmbedding()
+    if request.param == "numpy":
+        client = NumpyVectorClient(str(tmp_path))
+    else:
+        client = ShardedClient(str(tmp_path), backend="numpy", shard_by="hash", shard_count=2, processes=False,
+                               embedding_model=embedding_function.model_name)
+    # skip __init__, which loads the sentence-transformers model; the searches only need these two
+    rag = ArbitrationRAGChroma.__new__(ArbitrationRAGChroma)
+    rag.embedding_function = embedding_function
+    rag.collection = client.create_collection("arbitration_cases", embedding_function=embedding_function)
+    ids = list(CASES)
+    documents = list(CASES.values())
+    rag.collection.add(
+        ids=ids,
+        documents=documents,
+        metadatas=[{"case_id": case_id} for case_id in ids],
+        embeddings=embedding_function(documents)
+    )
+    yield rag
+    if hasattr(rag.collection, "close"):
+        rag.collection.close()
+
+def test_search_returns_stored_embeddings(rag):
+    cases = rag.search_by_embedding(rag.embedding_function(["mining expropriation"])[0], n_results=3, include_embeddings=True)
+    assert len(cases) == 3
+    expected = dict(zip(CASES, rag.embedding_function(list(CASES.values()))))
+    for case in cases:
+        # stored as float16, so only close to what was added
+        np.testing.assert_allclose(case["embedding"], expected[case["id"]], atol=1e-2)
+
+def test_retrieve_for_session(rag):
+    session = Session()
+    cases, reused = retrieve_for_session(rag, session, "mining concession expropriation", n_results=2)
+    assert not reused
+    assert [case["id"] for case in cases] == ["case-1", "case-2"]
+    assert cases[0]["distance"] <= cases[1]["distance"]
+    assert set(session.cases) >= {"case-1", "case-2"}
+
+    # a close follow-up is answered from the session's cases without a search
+    cases, reused = retrieve_for_session(rag, session, "mining concession expropriation compensation", n_results=2)
+    assert reused
+    assert cases[0]["id"] == "case-1"
+
+    # a different topic searches again and merges with what the session had
+    cases, reused = retrieve_for_session(rag, session, "solar feed-in tariff", n_results=2)
+    assert not reused
+    assert "case-5" in [case["id"] for case in cases]
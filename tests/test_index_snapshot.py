@@ -0,0 +1,62 @@
+import pytest
+
+from handle_rag import ArbitrationRAGChroma
+from index_snapshot import export_snapshot, import_snapshot, read_manifest
+
+CASES = [
+    {
+        "Identifier": f"CASE-{i}",
+        "Title": title,
+        "Institution": "ICSID - International Centre",
+        "Decisions": [{"Title": "Award", "Type": "Award", "Date": "2020", "Content": content, "Opinions": []}]
+    }
+    for i, (title, content) in enumerate([
+        ("Mining v. Republic", "tribunal award mining concession expropriation compensation damages"),
+        ("Gas v. Republic", "tribunal decision gas pipeline tariff"),
+        ("Solar v. Republic", "tribunal award solar tariff damages"),
+    ])
+]
+
+def open_rag(persist_dir, onnx_model_dir, index_decisions=True):
+    return ArbitrationRAGChroma(persist_directory=str(persist_dir), backend="numpy", index_decisions=index_decisions,
+                                embedding_backend="onnx", onnx_model_dir=onnx_model_dir)
+
+def all_ids(collection):
+    return sorted(collection.get(include=[])["ids"])
+
+@pytest.fixture
+def source(tmp_path, onnx_model_dir):
+    rag = open_rag(tmp_path / "source", onnx_model_dir)
+    rag.add_arbitration_cases(CASES)
+    rag.summary_index(create=True).store([
+        {"id": f"summary_{case['Identifier']}", "document": f"Award: {case['Title']}",
+         "metadata": {"case_id": case["Identifier"], "level": "case"}}
+        for case in CASES
+    ])
+    return rag
+
+def test_snapshot_carries_decisions_and_summaries(tmp_path, onnx_model_dir, source):
+    path = str(tmp_path / "index.npz")
+    manifest = export_snapshot(source, path)
+    assert read_manifest(path)["collections"]["summaries"]["count"] == len(CASES)
+
+    restored = open_rag(tmp_path / "restored", onnx_model_dir)
+    import_snapshot(restored, path)
+    assert manifest["count"] == len(CASES)
+    assert all_ids(restored.collection) == all_ids(source.collection)
+    assert all_ids(restored.decisions.collection) == all_ids(source.decisions.collection)
+    assert all_ids(restored.summaries.collection) == all_ids(source.summaries.collection)
+
+def test_restore_drops_summaries_the_snapshot_lacks(tmp_path, onnx_model_dir, source):
+    # exported without decision indexing or summaries
+    plain = open_rag(tmp_path / "plain", onnx_model_dir, index_decisions=False)
+    plain.add_arbitration_cases(CASES[:1])
+    path = str(tmp_path / "plain.npz")
+    export_snapshot(plain, path)
+    assert set(read_manifest(path)["collections"]) == {"cases"}
+
+    import_snapshot(source, path, replace=True)
+    assert all_ids(source.collection) == ["case_CASE-0"]
+    # stale passages and summaries of the replaced cases are gone
+    assert source.decisions.count() == 0
+    assert source.summaries is None
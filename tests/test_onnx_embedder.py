@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+chromadb = pytest.importorskip("chromadb")
+
+from handle_rag import ArbitrationRAGChroma
+from onnx_embedder import OnnxEmbedding
+
+CASES = {
+    "case_1": "mining concession expropriation compensation",
+    "case_2": "gas pipeline tariff",
+    "case_3": "solar tariff damages",
+    "case_4": "telecom licence",
+    "case_5": "bank damages",
+}
+
+def open_rag(persist_dir, onnx_model_dir):
+    return ArbitrationRAGChroma(persist_directory=persist_dir, backend="chroma", embedding_backend="onnx", onnx_model_dir=onnx_model_dir)
+
+def test_config_round_trip(onnx_model_dir):
+    embedder = OnnxEmbedding(onnx_model_dir)
+    rebuilt = OnnxEmbedding.build_from_config(embedder.get_config())
+    assert rebuilt.quantized == embedder.quantized
+    assert rebuilt(["gas pipeline"]) == embedder(["gas pipeline"])
+
+def test_chroma_collection_with_onnx_embedding(tmp_path, onnx_model_dir):
+    persist_dir = str(tmp_path / "chroma")
+    rag = open_rag(persist_dir, onnx_model_dir)
+    # chroma embeds the documents with the collection's embedding function
+    rag.collection.add(ids=list(CASES), documents=list(CASES.values()), metadatas=[{"case_id": case_id} for case_id in CASES])
+    assert rag.collection.configuration_json["embedding_function"]["name"] == OnnxEmbedding.name()
+    expected = rag.search_cases("mining concession expropriation compensation", n_results=2, rerank=False)
+    assert expected[0]["id"] == "case_1"
+    # cosine space, as with SentenceTransformerEmbeddingFunction
+    assert expected[0]["distance"] == pytest.approx(0, abs=1e-3)
+
+    # reopening checks the stored embedding function against the one passed in
+    reopened = open_rag(persist_dir, onnx_model_dir)
+    assert reopened.collection.count() == len(CASES)
+    found = reopened.search_cases("mining concession expropriation compensation", n_results=2, rerank=False)
+    assert [case["id"] for case in found] == [case["id"] for case in expected]
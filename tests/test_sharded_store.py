@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+from sharded_store import ShardedClient
+
+DIMENSION = 8
+
+class CosineEmbedding:
+    """Fixed vectors per document, declaring cosine space like SentenceTransformerEmbeddingFunction"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def __call__(self, input):
+        return [self.vectors.get(text, np.ones(DIMENSION)).tolist() for text in input]
+
+    @staticmethod
+    def name():
+        return "test_cosine"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return CosineEmbedding({})
+
+    def is_legacy(self):
+        return False
+
+    def default_space(self):
+        return "cosine"
+
+    def supported_spaces(self):
+        return ["cosine", "l2", "ip"]
+
+def test_sharded_chroma_distances_match_unsharded(tmp_path):
+    rng = np.random.default_rng(0)
+    documents = [f"case {i}" for i in range(12)]
+    # unnormalised on purpose, so l2 and cosine distances differ
+    embeddings = rng.normal(size=(len(documents), DIMENSION)) * rng.uniform(0.5, 3, size=(len(documents), 1))
+    embedding_function = CosineEmbedding(dict(zip(documents, embeddings)))
+    ids = [f"case_{i}" for i in range(len(documents))]
+    queries = rng.normal(size=(3, DIMENSION)).tolist()
+
+    unsharded = chromadb.PersistentClient(path=str(tmp_path / "unsharded")).create_collection(
+        name="arbitration_cases", embedding_function=embedding_function
+    )
+    unsharded.add(ids=ids, documents=documents, embeddings=embeddings.tolist())
+    expected = unsharded.query(query_embeddings=queries, n_results=5, include=["distances"])
+
+    client = ShardedClient(str(tmp_path / "sharded"), backend="chroma", shard_by="hash", shard_count=3, processes=False)
+    sharded = client.create_collection("arbitration_cases", embedding_function=embedding_function)
+    try:
+        sharded.add(ids=ids, documents=documents, embeddings=embeddings.tolist())
+        found = sharded.query(query_embeddings=queries, n_results=5, include=["distances"])
+    finally:
+        sharded.close()
+
+    assert found["ids"] == expected["ids"]
+    np.testing.assert_allclose(found["distances"], expected["distances"], atol=1e-4)
@@ -0,0 +1,507 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from metrics import timed
+
+FORMAT_VERSION = 1
+STORAGE_DTYPES = ("float16", "int8")
+
+# rows scored per matrix product, keeps the float32 working set small
+SEARCH_CHUNK_ROWS = 65536
+
+# row data files; compact() writes a new generation of them (vectors.1.bin, ...)
+DATA_FILES = ("vectors.bin", "scales.bin", "offsets.bin", "ids.txt", "records.jsonl")
+
+def _generation_file(filename, generation):
+    if not generation:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{generation}{ext}"
+
+class SentenceTransformerEmbedding:
+    """Normalised sentence-transformers embeddings, callable like a Chroma embedding function."""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", device=None):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device)
+
+    def __call__(self, input):
+        return self.model.encode(list(input), normalize_embeddings=True, convert_to_numpy=True).tolist()
+
+def _write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class NumpyCollection:
+    """
+    Exact (or IVF) cosine search over embeddings in a memory-mapped file.
+
+    Implements the part of the Chroma collection API this project uses (add,
+    upsert, delete, get, query, count), returning Chroma-shaped results.
+    Distances are cosine distances, so 1 - distance is the similarity.
+
+    On disk, in <persist dir>/<name>.vectors/:
+      manifest.json   format version, dimension, storage dtype, committed row count, deleted rows
+      vectors.bin     row-major float16, or int8 with a per-row float32 scale in scales.bin
+      ids.txt         one id per row
+      records.jsonl   {"document", "metadata"} per row, located via offsets.bin
+      ivf_*.npy       optional inverted-file index from build_ivf()
+
+    compact() writes the surviving rows to a new generation of the data files
+    (vectors.<n>.bin, ...) that the manifest then switches to.
+
+    Writes append rows and then replace the manifest, so readers only ever see
+    committed rows. Other processes pick up changes on their next call by
+    checking the manifest's mtime; the vectors themselves are shared through
+    the page cache. Only one process should write at a time.
+    """
+
+    def __init__(self, directory, name, embedding_function=None, metadata=None):
+        self.directory = directory
+        self.name = name
+        self.embedding_function = embedding_function
+        self.metadata = metadata or {}
+        self.lock = threading.RLock()
+        self._manifest_stamp = None
+        self._load()
+
+    # ---- files ----
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _data_path(self, filename):
+        return self._path(_generation_file(filename, self.generation))
+
+    def _load(self, ids_current=False):
+        manifest_path = self._path("manifest.json")
+        stat = os.stat(manifest_path)
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector store format {manifest['format_version']} in {self.directory}")
+
+        self.manifest = manifest
+        self.dimension = manifest["dimension"]
+        self.dtype = manifest["dtype"]
+        self.rows = manifest["rows"]
+        self.deleted = set(manifest["deleted"])
+        self.metadata = manifest.get("metadata", self.metadata)
+        self.generation = manifest.get("generation", 0)
+
+        # after our own commit, ids/id_to_row were already brought up to date in memory
+        if not ids_current:
+            with open(self._data_path("ids.txt"), "r", encoding="utf-8") as f:
+                self.ids = f.read().splitlines()[:self.rows]
+            self.id_to_row = {case_id: row for row, case_id in enumerate(self.ids) if row not in self.deleted}
+        # committed length of ids.txt (older manifests don't record it)
+        self.ids_bytes = manifest.get("ids_bytes")
+        if self.ids_bytes is None:
+            self.ids_bytes = sum(len(case_id.encode("utf-8")) + 1 for case_id in self.ids)
+
+        self.vectors = self._memmap("vectors.bin", np.int8 if self.dtype == "int8" else np.float16, (self.rows, self.dimension))
+        self.scales = self._memmap("scales.bin", np.float32, (self.rows,)) if self.dtype == "int8" else None
+        self.offsets = self._memmap("offsets.bin", np.int64, (self.rows,))
+
+        self.ivf = None
+        if manifest.get("ivf_rows"):
+            self.ivf = {
+                "rows": manifest["ivf_rows"],
+                "centroids": np.load(self._path("ivf_centroids.npy")),
+                "order": np.load(self._path("ivf_order.npy"), mmap_mode="r"),
+                "bounds": np.load(self._path("ivf_bounds.npy"))
+            }
+
+        self._manifest_stamp = (stat.st_mtime_ns, stat.st_size)
+
+    def _memmap(self, filename, dtype, shape):
+        if self.rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._data_path(filename), dtype=dtype, mode="r", shape=shape)
+
+    def _refresh(self):
+        """Reload if another process committed a write since we last looked."""
+        stat = os.stat(self._path("manifest.json"))
+        if (stat.st_mtime_ns, stat.st_size) != self._manifest_stamp:
+            self._load()
+
+    def _commit(self, rows=None, deleted=None, appended_ids=(), **changes):
+        """
+        Replace the manifest. Unless the data files changed generation, the id
+        list is updated in memory (appended_ids are the ids _append just wrote)
+        instead of re-reading ids.txt, so a batch costs O(batch), not O(rows).
+        """
+        manifest = dict(self.manifest, **changes)
+        manifest["rows"] = self.rows if rows is None else rows
+        manifest["deleted"] = sorted(self.deleted if deleted is None else deleted)
+        if "ids_bytes" not in changes:
+            manifest["ids_bytes"] = self.ids_bytes + sum(len(case_id.encode("utf-8")) + 1 for case_id in appended_ids)
+        _write_json_atomic(self._path("manifest.json"), manifest)
+
+        if manifest.get("generation", 0) != self.generation:
+            self._load()
+            return
+        for row, case_id in enumerate(appended_ids, start=len(self.ids)):
+            self.ids.append(case_id)
+            self.id_to_row[case_id] = row
+        for row in set(manifest["deleted"]) - self.deleted:
+            if self.id_to_row.get(self.ids[row]) == row:
+                del self.id_to_row[self.ids[row]]
+        self._load(ids_current=True)
+
+    @staticmethod
+    def create(directory, name, dimension, dtype="float16", embedding_function=None, metadata=None, embedding_model=None):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"dtype must be one of {STORAGE_DTYPES}")
+        os.makedirs(directory, exist_ok=True)
+        for filename in ("vectors.bin", "scales.bin", "offsets.bin", "ids.txt", "records.jsonl"):
+            open(os.path.join(directory, filename), "wb").close()
+        _write_json_atomic(os.path.join(directory, "manifest.json"), {
+            "format_version": FORMAT_VERSION,
+            "name": name,
+            "dimension": dimension,
+            "dtype": dtype,
+            "embedding_model": embedding_model,
+            "rows": 0,
+            "deleted": [],
+            "generation": 0,
+            "ids_bytes": 0,
+            "metadata": metadata or {}
+        })
+        return NumpyCollection(directory, name, embedding_function, metadata)
+
+    # ---- writes ----
+
+    def _embed(self, documents, embeddings):
+        if embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("No embeddings given and the collection has no embedding function")
+            embeddings = self.embedding_function(documents)
+        embeddings = _normalize(embeddings)
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match collection dimension {self.dimension}")
+        return embeddings
+
+    def _truncate_uncommitted(self):
+        # drop anything a crashed writer appended past the committed row count
+        row_bytes = self.dimension * (1 if self.dtype == "int8" else 2)
+        sizes = {"vectors.bin": self.rows * row_bytes, "offsets.bin": self.rows * 8}
+        if self.dtype == "int8":
+            sizes["scales.bin"] = self.rows * 4
+        sizes["ids.txt"] = self.ids_bytes
+        for filename, size in sizes.items():
+            with open(self._data_path(filename), "r+b") as f:
+                f.truncate(size)
+        records_size = 0
+        if self.rows:
+            with open(self._data_path("records.jsonl"), "rb") as f:
+                f.seek(int(self.offsets[-1]))
+                f.readline()
+                records_size = f.tell()
+        with open(self._data_path("records.jsonl"), "r+b") as f:
+            f.truncate(records_size)
+
+    def _append(self, ids, documents, metadatas, embeddings):
+        embeddings = self._embed(documents, embeddings)
+        self._truncate_uncommitted()
+
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12) / 127.0
+            quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+            with open(self._data_path("scales.bin"), "ab") as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            quantized = embeddings.astype(np.float16)
+        with open(self._data_path("vectors.bin"), "ab") as f:
+            f.write(quantized.tobytes())
+
+        offsets = []
+        with open(self._data_path("records.jsonl"), "ab") as f:
+            for document, metadata in zip(documents, metadatas or [None] * len(ids)):
+                offsets.append(f.tell())
+                f.write((json.dumps({"document": document, "metadata": metadata}) + "\n").encode("utf-8"))
+        with open(self._data_path("offsets.bin"), "ab") as f:
+            f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+        with open(self._data_path("ids.txt"), "ab") as f:
+            f.write("".join(f"{case_id}\n" for case_id in ids).encode("utf-8"))
+
+        return self.rows + len(ids)
+
+    def add(self, ids, documents, metadatas=None, embeddings=None):
+        """Add new rows; ids already present are ignored (as in Chroma)."""
+        with self.lock:
+            self._refresh()
+            keep = []
+            seen = set()
+            for i, case_id in enumerate(ids):
+                if case_id not in self.id_to_row and case_id not in seen:
+                    seen.add(case_id)
+                    keep.append(i)
+            if not keep:
+                return
+            rows = self._append(
+                [ids[i] for i in keep],
+                [documents[i] for i in keep],
+                [metadatas[i] for i in keep] if metadatas else None,
+                [embeddings[i] for i in keep] if embeddings is not None else None
+            )
+            self._commit(rows=rows, appended_ids=[ids[i] for i in keep])
+
+    def upsert(self, ids, documents, metadatas=None, embeddings=None):
+        with self.lock:
+            self._refresh()
+            replaced = {self.id_to_row[case_id] for case_id in ids if case_id in self.id_to_row}
+            rows = self._append(ids, documents, metadatas, embeddings)
+            self._commit(rows=rows, deleted=self.deleted | replaced, appended_ids=ids)
+
+    def delete(self, ids):
+        with self.lock:
+            self._refresh()
+            removed = {self.id_to_row[case_id] for case_id in ids if case_id in self.id_to_row}
+            if removed:
+                self._commit(deleted=self.deleted | removed)
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return self.rows - len(self.deleted)
+
+    # ---- reads ----
+
+    def _record(self, row):
+        with open(self._data_path("records.jsonl"), "rb") as f:
+            f.seek(int(self.offsets[row]))
+            return json.loads(f.readline())
+
+    def _vector(self, row):
+        vector = np.asarray(self.vectors[row], dtype=np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def _result(self, rows, include):
+        records = [self._record(row) for row in rows] if ("documents" in include or "metadatas" in include) else None
+        result = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [record["document"] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [record["metadata"] for record in records]
+        if "embeddings" in include:
+            result["embeddings"] = [self._vector(row).tolist() for row in rows]
+        return result
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=0):
+        with self.lock:
+            self._refresh()
+            if ids is not None:
+                rows = [self.id_to_row[case_id] for case_id in ids if case_id in self.id_to_row]
+            else:
+                live = [row for row in range(self.rows) if row not in self.deleted]
+                rows = live[offset:offset + limit if limit is not None else None]
+            return self._result(rows, include)
+
+    def _score_rows(self, query, start, stop):
+        block = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        scores = block @ query.T
+        if self.scales is not None:
+            scores *= self.scales[start:stop, None]
+        return scores
+
+    def _candidate_rows(self, query, nprobe):
+        """Rows to score exactly: the nearest IVF lists plus anything added after the index was built."""
+        ivf = self.ivf
+        nearest = np.argsort(-(ivf["centroids"] @ query))[:nprobe]
+        rows = [ivf["order"][ivf["bounds"][c]:ivf["bounds"][c + 1]] for c in nearest]
+        rows.append(np.arange(ivf["rows"], self.rows))
+        return np.concatenate(rows)
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, include=("documents", "metadatas", "distances"), nprobe=8):
+        with self.lock:
+            self._refresh()
+            if query_embeddings is None:
+                query_embeddings = self.embedding_function(query_texts)
+            queries = _normalize(query_embeddings)
+            n_results = min(n_results, self.rows - len(self.deleted))
+
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            if "embeddings" in include:
+                results["embeddings"] = []
+            if n_results <= 0:
+                return results
+
+            dead = np.fromiter(self.deleted, dtype=np.int64) if self.deleted else None
+            for query in queries:
+                with timed("vector_scan"):
+                    if self.ivf is not None:
+                        rows = self._candidate_rows(query, nprobe)
+                        rows = np.sort(rows)
+                        block = np.asarray(self.vectors[rows], dtype=np.float32)
+                        scores = block @ query
+                        if self.scales is not None:
+                            scores *= self.scales[rows]
+                        if dead is not None:
+                            scores[np.isin(rows, dead)] = -np.inf
+                    else:
+                        rows = None
+                        scores = np.concatenate([
+                            self._score_rows(query[None, :], start, min(start + SEARCH_CHUNK_ROWS, self.rows))[:, 0]
+                            for start in range(0, self.rows, SEARCH_CHUNK_ROWS)
+                        ])
+                        if dead is not None:
+                            scores[dead] = -np.inf
+
+                    k = min(n_results, len(scores))
+                    top = np.argpartition(-scores, k - 1)[:k] if k else np.arange(0)
+                    top = top[np.argsort(-scores[top])]
+                    top = top[np.isfinite(scores[top])]
+                    top_rows = [int(rows[i]) if rows is not None else int(i) for i in top]
+
+                found = self._result(top_rows, include)
+                results["ids"].append(found["ids"])
+                results["documents"].append(found.get("documents"))
+                results["metadatas"].append(found.get("metadatas"))
+                results["distances"].append([float(1 - scores[i]) for i in top])
+                if "embeddings" in include:
+                    results["embeddings"].append(found["embeddings"])
+            return results
+
+    # ---- maintenance ----
+
+    def build_ivf(self, n_lists=None, iterations=10, sample_size=50000, seed=0):
+        """
+        Cluster the vectors into n_lists (default ~sqrt(rows)) for approximate
+        search. Queries then score only the nprobe closest lists exactly.
+        """
+        with self.lock:
+            self._refresh()
+            if self.rows == 0:
+                return
+            n_lists = n_lists or max(1, int(np.sqrt(self.rows)))
+            rng = np.random.default_rng(seed)
+            vectors = _normalize(np.stack([self._vector(row) for row in range(self.rows)]))
+
+            sample = vectors[rng.choice(self.rows, size=min(sample_size, self.rows), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=min(n_lists, len(sample)), replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(len(centroids)):
+                    members = sample[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+            np.save(self._path("ivf_centroids.npy"), centroids.astype(np.float32))
+            np.save(self._path("ivf_order.npy"), order)
+            np.save(self._path("ivf_bounds.npy"), bounds)
+            self._commit(ivf_rows=self.rows)
+
+    def compact(self):
+        """
+        Rewrite the files without deleted rows (drops any IVF index).
+
+        The surviving rows are copied, still in their stored encoding, to the
+        next generation of data files; replacing the manifest switches readers
+        over in one rename. Until then, and if compaction dies part-way, the
+        collection keeps serving the current files. The generation before the
+        current one is removed afterwards, so a reader that loaded it just
+        before the switch can still finish.
+        """
+        with self.lock:
+            self._refresh()
+            live = np.asarray([row for row in range(self.rows) if row not in self.deleted], dtype=np.int64)
+            generation = self.generation + 1
+            paths = {filename: self._path(_generation_file(filename, generation)) for filename in DATA_FILES}
+
+            with open(paths["vectors.bin"], "wb") as vectors_file, open(paths["scales.bin"], "wb") as scales_file:
+                for start in range(0, len(live), SEARCH_CHUNK_ROWS):
+                    rows = live[start:start + SEARCH_CHUNK_ROWS]
+                    vectors_file.write(np.asarray(self.vectors[rows]).tobytes())
+                    if self.scales is not None:
+                        scales_file.write(np.asarray(self.scales[rows]).tobytes())
+
+            offsets = np.empty(len(live), dtype=np.int64)
+            with open(self._data_path("records.jsonl"), "rb") as source, open(paths["records.jsonl"], "wb") as f:
+                for i, row in enumerate(live):
+                    source.seek(int(self.offsets[row]))
+                    offsets[i] = f.tell()
+                    f.write(source.readline())
+            with open(paths["offsets.bin"], "wb") as f:
+                f.write(offsets.tobytes())
+
+            ids = "".join(f"{self.ids[row]}\n" for row in live).encode("utf-8")
+            with open(paths["ids.txt"], "wb") as f:
+                f.write(ids)
+
+            self._commit(rows=len(live), deleted=set(), ivf_rows=None, generation=generation, ids_bytes=len(ids))
+            for old_generation in range(generation - 1):
+                for filename in DATA_FILES:
+                    try:
+                        os.remove(self._path(_generation_file(filename, old_generation)))
+                    except OSError:
+                        pass
+
+class NumpyVectorClient:
+    """Drop-in for chromadb.PersistentClient backed by NumpyCollection directories."""
+
+    def __init__(self, path, dtype="float16"):
+        self.path = path
+        self.dtype = dtype
+        os.makedirs(path, exist_ok=True)
+
+    def _directory(self, name):
+        return os.path.join(self.path, f"{name}.vectors")
+
+    def get_collection(self, name, embedding_function=None):
+        directory = self._directory(name)
+        if not os.path.exists(os.path.join(directory, "manifest.json")):
+            raise ValueError(f"Collection {name} does not exist")
+        return NumpyCollection(directory, name, embedding_function)
+
+    def create_collection(self, name, embedding_function=None, metadata=None, dimension=None, embedding_model=None):
+        if dimension is None:
+            if embedding_function is None:
+                raise ValueError("Need an embedding function or an explicit dimension")
+            dimension = len(embedding_function(["dimension probe"])[0])
+        if embedding_model is None:
+            embedding_model = getattr(embedding_function, "model_name", None)
+        return NumpyCollection.create(
+            self._directory(name), name, dimension, self.dtype, embedding_function, metadata, embedding_model
+        )
+
+    def delete_collection(self, name):
+        shutil.rmtree(self._directory(name), ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Numpy vector store maintenance")
+    parser.add_argument("command", choices=["info", "build-ivf", "compact"])
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--collection", default="arbitration_cases")
+    parser.add_argument("--lists", type=int, default=None, help="IVF lists (default ~sqrt(rows))")
+    args = parser.parse_args()
+
+    collection = NumpyVectorClient(args.persist_dir).get_collection(args.collection)
+    if args.command == "build-ivf":
+        collection.build_ivf(n_lists=args.lists)
+    elif args.command == "compact":
+        collection.compact()
+
+    manifest = dict(collection.manifest, deleted=len(collection.deleted))
+    print(json.dumps(manifest, indent=2))
+
+if __name__ == "__main__":
+    main()